@@ -0,0 +1,184 @@
+"""
+    Answer the prompts of a JSONL file with a pool of worker processes
+"""
+import json
+import logging
+from collections.abc import Callable, Iterable, Iterator, Set
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+from pathlib import Path
+from typing import TextIO
+
+from gpt4all import GPT4All
+
+from gpt4all_cli.instrumentation import GenerationRecorder
+from gpt4all_cli.model_pool import ChatContext, ModelPool
+from gpt4all_cli.response_cache import ResponseCache, cached_generate
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_prompts(lines: Iterable[str]) -> Iterator[dict]:
+    """
+    Read the prompts from JSONL lines. Every prompt gets an id: The line number, if it has none.
+
+    >>> list(read_prompts(['{"prompt": "Hi"}', '', '{"id": "x", "prompt": "Bye", "max_tokens": 5}']))
+    [{'prompt': 'Hi', 'id': 1}, {'id': 'x', 'prompt': 'Bye', 'max_tokens': 5}]
+    """
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        item = json.loads(line)
+        if 'prompt' not in item:
+            raise ValueError(f'Line {line_number}: No "prompt" in: {line!r}')
+        item.setdefault('id', line_number)
+        yield item
+
+
+def prepare_resume(output_path: Path) -> set:
+    """
+    Returns the ids of all successfully answered prompts in the output file.
+    Failed prompts are removed from the file, so they are answered again.
+    A partially written last line (e.g. the process was killed) is removed, too.
+    """
+    if not output_path.exists():
+        return set()
+
+    content = output_path.read_text()
+    complete, _, partial = content.rpartition('\n')
+    if partial:
+        logger.warning('Remove partially written last line from %s: %r', output_path, partial)
+
+    done_ids = set()
+    lines = []
+    failed = 0
+    for line in complete.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        if 'error' in result:
+            failed += 1
+            continue
+        done_ids.add(result['id'])
+        lines.append(f'{line}\n')
+
+    if failed:
+        logger.warning('Retry %i failed prompts from %s', failed, output_path)
+    if partial or failed:
+        output_path.write_text(''.join(lines))
+    return done_ids
+
+
+# The model of the worker process: Loaded once by init_worker()
+worker_state: dict = {}
+
+
+def init_worker(
+    model_name: str,
+    n_threads: int,
+    loader: Callable[..., GPT4All],
+    response_cache_path: Path | None = None,
+) -> None:
+    model_pool = ModelPool(loader=loader, n_threads=n_threads)
+    worker_state['model_name'] = model_name
+    worker_state['model_pool'] = model_pool
+    worker_state['response_cache'] = ResponseCache(path=response_cache_path) if response_cache_path else None
+    # Hold one reference, so the model stays loaded between the prompts:
+    worker_state['chat_context'] = model_pool.chat_context(model_name)
+
+
+def process_prompt(item: dict, *, max_tokens: int, temperature: float) -> dict:
+    """
+    Answer one prompt in the worker process, with an empty chat history.
+    """
+    max_tokens = item.get('max_tokens', max_tokens)
+    chat_context: ChatContext = worker_state['model_pool'].chat_context(worker_state['model_name'])
+    recorder = GenerationRecorder(name=worker_state['model_name'], max_tokens=max_tokens)
+    result = {'id': item['id']}
+    try:
+        response = ''
+        for token in cached_generate(
+            chat_context,
+            item['prompt'],
+            response_cache=worker_state['response_cache'],
+            max_tokens=max_tokens,
+            temp=item.get('temperature', temperature),
+            on_start=recorder.start,
+        ):
+            recorder.token()
+            response += token
+        stats = recorder.finish()
+        result.update(
+            response=response,
+            tokens=stats.tokens,
+            ttft=stats.ttft,
+            duration=stats.duration,
+            stop_reason=str(stats.stop_reason),
+        )
+    except Exception as err:
+        logger.exception('Prompt %r failed', item['id'])
+        result['error'] = f'{type(err).__name__}: {err}'
+    finally:
+        chat_context.close()
+    return result
+
+
+def run_batch(
+    *,
+    prompts: Iterable[dict],
+    output: TextIO,
+    model_name: str,
+    workers: int,
+    n_threads: int,
+    max_tokens: int,
+    temperature: float,
+    skip_ids: Set = frozenset(),
+    loader: Callable[..., GPT4All] = GPT4All,
+    response_cache_path: Path | None = None,
+    on_result: Callable[[dict], None] | None = None,
+) -> int:
+    """
+    Answer all prompts and write the results in completion order into `output`.
+    Returns the number of answered prompts.
+    """
+    max_pending = workers * 2  # Don't read the complete input into memory
+    pending: set[Future] = set()
+    count = 0
+
+    def write_results(futures: Iterable[Future]) -> None:
+        nonlocal count
+        for future in futures:
+            result = future.result()
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+            count += 1
+            if on_result:
+                on_result(result)
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context('spawn'),
+        initializer=init_worker,
+        initargs=(model_name, n_threads, loader, response_cache_path),
+    ) as executor:
+        for item in prompts:
+            if item['id'] in skip_ids:
+                continue
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                write_results(done)
+            pending.add(executor.submit(process_prompt, item, max_tokens=max_tokens, temperature=temperature))
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            write_results(done)
+
+    return count
+
+
+def format_result(result: dict) -> str:
+    if 'error' in result:
+        return f'{result["id"]}: {result["error"]}'
+    return f'{result["id"]}: {result["tokens"]} tokens in {result["duration"]:.1f} sec.'
@@ -0,0 +1,194 @@
+"""
+    Measure the model throughput with different thread counts
+"""
+import dataclasses
+import resource
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from gpt4all import GPT4All
+
+from gpt4all_cli.model_pool import (
+    GENERATE_DEFAULTS,
+    ChatContext,
+    ModelPool,
+    empty_response_callback,
+    format_chat_prompt,
+)
+from gpt4all_cli.prefix_cache import PrefixCache
+
+
+BENCH_PROMPTS = (
+    'What is the capital of France?',
+    'Write a short poem about the sea.',
+    'Explain in a few sentences how a CPU cache works.',
+)
+
+
+@dataclasses.dataclass
+class BenchResult:
+    n_threads: int
+    load_time: float = 0.0  # seconds
+    ttft: float = 0.0  # Mean time to first token in seconds
+    prompt_tokens: int = 0
+    prompt_tokens_per_second: float = 0.0
+    generated_tokens: int = 0
+    decode_tokens_per_second: float = 0.0
+    peak_rss: int = 0  # bytes
+
+
+def get_thread_counts(cpu_count: int) -> list[int]:
+    """
+    Powers of two up to the CPU count, plus the CPU count itself.
+
+    >>> get_thread_counts(6)
+    [1, 2, 4, 6]
+    >>> get_thread_counts(8)
+    [1, 2, 4, 8]
+    """
+    thread_counts = []
+    n_threads = 1
+    while n_threads < cpu_count:
+        thread_counts.append(n_threads)
+        n_threads *= 2
+    thread_counts.append(cpu_count)
+    return thread_counts
+
+
+def get_peak_rss() -> int:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_configuration(
+    *,
+    model_name: str,
+    n_threads: int,
+    prompts: tuple[str, ...],
+    max_tokens: int,
+    loader: Callable[..., GPT4All] = GPT4All,
+) -> BenchResult:
+    """
+    Load the model and generate answers to all prompts. Should be called in a new process,
+    so the peak RSS belongs to this configuration only.
+    """
+    result = BenchResult(n_threads=n_threads)
+
+    start_time = time.monotonic()
+    gpt4all = loader(model_name, n_threads=n_threads, verbose=False)
+    result.load_time = time.monotonic() - start_time
+
+    model = gpt4all.model
+    config = gpt4all.config
+
+    # The time to first token is mainly the evaluation of the prompt:
+    prefill_time = decode_time = 0.0
+    for prompt in prompts:
+        full_prompt = format_chat_prompt(
+            prompt_template=config['promptTemplate'],
+            messages=[{'role': 'user', 'content': prompt}],
+            header=config['systemPrompt'],
+        )
+        start_time = time.monotonic()
+        token_times = []
+        for _ in model.prompt_model_streaming(
+            prompt=full_prompt,
+            callback=empty_response_callback,
+            n_predict=max_tokens,
+            temp=0.0,
+            reset_context=True,
+            **GENERATE_DEFAULTS,
+        ):
+            token_times.append(time.monotonic())
+
+        if not token_times:
+            continue
+
+        generated_tokens = len(token_times)
+        prefill_time += token_times[0] - start_time
+        decode_time += token_times[-1] - token_times[0]
+
+        # After a reset, the context contains the prompt and the generated tokens:
+        result.prompt_tokens += max(model.context.n_past - generated_tokens, 0)
+        result.generated_tokens += generated_tokens
+
+    result.ttft = prefill_time / len(prompts)
+    if prefill_time:
+        result.prompt_tokens_per_second = result.prompt_tokens / prefill_time
+    if decode_time:
+        # The first token of every answer is part of the "time to first token":
+        result.decode_tokens_per_second = (result.generated_tokens - len(prompts)) / decode_time
+    result.peak_rss = get_peak_rss()
+    return result
+
+
+def run_bench(
+    *,
+    model_name: str,
+    thread_counts: list[int],
+    prompts: tuple[str, ...] = BENCH_PROMPTS,
+    max_tokens: int,
+    loader: Callable[..., GPT4All] = GPT4All,
+    on_result: Callable[[BenchResult], None] | None = None,
+) -> list[BenchResult]:
+    results = []
+    for n_threads in thread_counts:
+        # A fresh process for every configuration:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            future = executor.submit(
+                run_configuration,
+                model_name=model_name,
+                n_threads=n_threads,
+                prompts=prompts,
+                max_tokens=max_tokens,
+                loader=loader,
+            )
+            result = future.result()
+        if on_result:
+            on_result(result)
+        results.append(result)
+    return results
+
+
+@dataclasses.dataclass
+class PrefixCacheResult:
+    # Time to first token of a new chat session in seconds:
+    without_cache: float
+    cache_miss: float  # The system prompt is evaluated and cached
+    cache_hit: float  # The cached state after the system prompt is restored
+
+
+def measure_ttft(chat_context: ChatContext, prompt: str) -> float:
+    start_time = time.monotonic()
+    chat_context.generate(prompt, streaming=False, max_tokens=1, temp=0.0)
+    return time.monotonic() - start_time
+
+
+def run_prefix_cache_bench(
+    *,
+    model_name: str,
+    n_threads: int,
+    prompt: str = BENCH_PROMPTS[0],
+    loader: Callable[..., GPT4All] = GPT4All,
+) -> PrefixCacheResult:
+    """
+    Measure the time to first token of new chat sessions with and without the prefix cache.
+    """
+    model_pool = ModelPool(loader=loader, keep_idle=True, n_threads=n_threads)
+    prefix_cache = PrefixCache()
+
+    def new_session_ttft() -> float:
+        chat_context = model_pool.chat_context(model_name)
+        try:
+            return measure_ttft(chat_context, prompt)
+        finally:
+            chat_context.close()
+
+    new_session_ttft()  # Warmup: The first generation after loading is slower
+    without_cache = new_session_ttft()
+    model_pool.prefix_cache = prefix_cache
+    cache_miss = new_session_ttft()
+    cache_hit = new_session_ttft()
+    return PrefixCacheResult(without_cache=without_cache, cache_miss=cache_miss, cache_hit=cache_hit)
@@ -0,0 +1,3 @@
+"""
+    Offline benchmarks of the chat internals, runnable via ./dev-cli.py
+"""
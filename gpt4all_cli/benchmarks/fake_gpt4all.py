@@ -0,0 +1,114 @@
+"""
+    A deterministic stand-in for GPT4All that "generates" tokens at a fixed rate
+"""
+import contextlib
+import itertools
+import time
+from collections.abc import Callable, Iterator
+from types import SimpleNamespace
+
+from gpt4all_cli.model_state import ModelState
+
+
+WORDS = ('Hello', ' there', '!', ' How', ' can', ' I', ' help', ' you', ' today', '?')
+
+
+class FakeLLModel:
+    """
+    Mimics `gpt4all.pyllmodel.LLModel`: Yields the WORDS in a loop with `tokens_per_second`.
+    The production time of every token is stored in `produced` as (length of the answer, time).
+    Every word of the prompt counts as one token in `context.n_past` and in `evaluated`.
+    With `prompt_tokens_per_second` the evaluation of the prompt takes time, too.
+    """
+
+    def __init__(self, *, n_threads: int, tokens_per_second: float, prompt_tokens_per_second: float | None = None):
+        self.n_threads = n_threads
+        self.tokens_per_second = tokens_per_second
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.produced: list[tuple[int, float]] = []
+        self.context = SimpleNamespace(n_past=0)
+        self.evaluated = 0  # Number of evaluated prompt tokens
+
+    def thread_count(self) -> int:
+        return self.n_threads
+
+    def set_thread_count(self, n_threads: int) -> None:
+        self.n_threads = n_threads
+
+    def prompt_model_streaming(
+        self,
+        prompt: str,
+        callback: Callable[[int, str], bool],
+        n_predict: int = 4096,
+        reset_context: bool = False,
+        **kwargs,
+    ) -> Iterator[str]:
+        if reset_context:
+            self.context.n_past = 0
+        prompt_tokens = len(prompt.split())
+        if self.prompt_tokens_per_second:
+            time.sleep(prompt_tokens / self.prompt_tokens_per_second)
+        self.context.n_past += prompt_tokens
+        self.evaluated += prompt_tokens
+        self.produced = []
+        length = 0
+        start_time = time.monotonic()
+        for token_id, token in zip(range(n_predict), itertools.cycle(WORDS)):
+            wait = start_time + token_id / self.tokens_per_second - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            if not callback(token_id, token):
+                return
+            length += len(token)
+            self.context.n_past += 1
+            self.produced.append((length, time.monotonic()))
+            yield token
+
+    def save_state(self) -> ModelState:
+        return ModelState(data=b'', n_past=self.context.n_past, tokens=[])
+
+    def restore_state(self, state: ModelState) -> bool:
+        self.context.n_past = state.n_past
+        return True
+
+
+class FakeGPT4All:
+    """
+    Can be used as loader of the ModelPool, or like GPT4All directly.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        n_threads: int | None = None,
+        *,
+        tokens_per_second: float = 20,
+        prompt_tokens_per_second: float | None = None,
+        **kwargs,
+    ):
+        self.config = {
+            'name': model_name,
+            'filename': model_name,
+            'type': 'fake',
+            'systemPrompt': '### System:\nYou are a benchmark.\n\n',
+            'promptTemplate': '### User:\n{0}\n### Response:\n',
+        }
+        self.model = FakeLLModel(
+            n_threads=n_threads or 1,
+            tokens_per_second=tokens_per_second,
+            prompt_tokens_per_second=prompt_tokens_per_second,
+        )
+
+    @contextlib.contextmanager
+    def chat_session(self):
+        yield self
+
+    def generate(self, prompt: str, *, max_tokens: int = 200, streaming: bool = False, callback=None, **kwargs):
+        tokens = self.model.prompt_model_streaming(
+            prompt=prompt,
+            callback=callback or (lambda token_id, response: True),
+            n_predict=max_tokens,
+        )
+        if streaming:
+            return tokens
+        return ''.join(tokens)
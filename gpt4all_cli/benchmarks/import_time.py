@@ -0,0 +1,139 @@
+"""
+    Import time of the CLI commands, measured with "python -X importtime"
+"""
+import collections
+import dataclasses
+import os
+import subprocess
+import sys
+import tempfile
+
+from rich import print  # noqa
+from rich.table import Table
+
+
+# Slow to import: The native library and the web stack. Only the commands that need them may import them.
+HEAVY_MODULES = ('gpt4all', 'lona', 'lona_picocss', 'gpt4all_cli.web_ui')
+
+
+@dataclasses.dataclass
+class ImportTimeBudget:
+    args: tuple[str, ...]  # ./cli.py arguments
+    max_ms: float  # Sum of all imports
+    forbidden: tuple[str, ...] = HEAVY_MODULES
+
+
+IMPORT_TIME_BUDGETS = {
+    '--help': ImportTimeBudget(args=('--help',), max_ms=350),
+    'version': ImportTimeBudget(args=('version',), max_ms=350),
+    'list-models': ImportTimeBudget(args=('list-models', '--offline'), max_ms=400),
+}
+
+
+@dataclasses.dataclass
+class ImportTimeResult:
+    name: str
+    budget: ImportTimeBudget
+    modules: dict[str, float]  # Module name -> self import time in ms
+
+    @property
+    def total_ms(self) -> float:
+        return sum(self.modules.values())
+
+    @property
+    def forbidden_imports(self) -> list[str]:
+        return sorted(self.modules.keys() & set(self.budget.forbidden))
+
+    @property
+    def errors(self) -> list[str]:
+        errors = []
+        if self.total_ms > self.budget.max_ms:
+            errors.append(f'{self.total_ms:.0f} ms > budget {self.budget.max_ms:.0f} ms')
+        if forbidden := self.forbidden_imports:
+            errors.append(f'imports {", ".join(forbidden)}')
+        return errors
+
+    def slowest_packages(self, count: int = 3) -> list[tuple[str, float]]:
+        """
+        >>> result = ImportTimeResult(
+        ...     name='x', budget=None, modules={'rich': 1.0, 'rich.table': 2.5, 'site': 0.5, 'json': 3.0}
+        ... )
+        >>> result.slowest_packages(2)
+        [('rich', 3.5), ('json', 3.0)]
+        """
+        packages: collections.defaultdict[str, float] = collections.defaultdict(float)
+        for module_name, ms in self.modules.items():
+            packages[module_name.split('.', 1)[0]] += ms
+        return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:count]
+
+
+def parse_importtime(output: str) -> dict[str, float]:
+    """
+    Returns the self import times in ms of all imported modules.
+
+    >>> parse_importtime('''
+    ... import time: self [us] | cumulative | imported package
+    ... import time:       200 |        200 |   encodings.aliases
+    ... import time:      1000 |       1200 | encodings
+    ... Other output
+    ... ''')
+    {'encodings.aliases': 0.2, 'encodings': 1.0}
+    """
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, _, name = line[len('import time:'):].split('|', 2)
+        if not self_us.strip().isdigit():
+            continue  # The header line
+        modules[name.strip()] = int(self_us) / 1000
+    return modules
+
+
+def measure_import_time(name: str, budget: ImportTimeBudget, *, repeat: int = 3) -> ImportTimeResult:
+    """
+    Run the command `repeat` times in a new interpreter and return the fastest run.
+    Runs with an empty home directory, so no user caches or models are used.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        env = dict(os.environ, HOME=temp_dir, PYTHONDONTWRITEBYTECODE='1')
+        for _ in range(repeat):
+            process = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-m', 'gpt4all_cli', *budget.args],
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            if process.returncode != 0:
+                raise RuntimeError(f'{name!r} failed:\n{process.stderr[-2000:]}')
+            results.append(ImportTimeResult(name=name, budget=budget, modules=parse_importtime(process.stderr)))
+    return min(results, key=lambda result: result.total_ms)
+
+
+def print_import_times(*, repeat: int) -> bool:
+    """
+    Measure all budgets and print a table. Returns False, if a budget is exceeded.
+    """
+    table = Table(title='Import time of the CLI commands')
+    table.add_column('Command')
+    table.add_column('Imports', justify='right')
+    table.add_column('Budget', justify='right')
+    table.add_column('Slowest packages')
+    table.add_column('Errors')
+
+    ok = True
+    for name, budget in IMPORT_TIME_BUDGETS.items():
+        result = measure_import_time(name, budget, repeat=repeat)
+        if errors := result.errors:
+            ok = False
+        table.add_row(
+            ' '.join(budget.args),
+            f'{result.total_ms:.0f} ms',
+            f'{budget.max_ms:.0f} ms',
+            ', '.join(f'{module} {ms:.0f} ms' for module, ms in result.slowest_packages()),
+            '[red]' + '\n'.join(errors) if errors else '[green]OK',
+        )
+    print(table)
+    return ok
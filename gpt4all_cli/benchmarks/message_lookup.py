@@ -0,0 +1,65 @@
+"""
+    Benchmark: Find the chat line of a streamed answer in the message scroller
+"""
+import time
+from datetime import datetime
+from functools import partial
+from uuid import uuid4
+
+from rich import print  # noqa
+from rich.table import Table
+
+from gpt4all_cli.web_ui import ChatLine, MessageScrollerDiv, Span
+
+
+def fill_scroller(history_length: int) -> tuple[MessageScrollerDiv, str]:
+    """
+    Create a scroller with `history_length` messages and return it with the id of the last message.
+    """
+    scroller = MessageScrollerDiv(lines=None)
+    for _ in range(history_length):
+        message_id = uuid4().hex
+        line = ChatLine(message_id=message_id, user_name='user', dt=datetime.now(), text=Span('Hello'))
+        scroller.add_message(line)
+    return scroller, message_id
+
+
+def time_lookups(lookup, *, tokens: int) -> float:
+    """
+    Returns the mean duration in seconds of one lookup
+    """
+    start_time = time.perf_counter()
+    for _ in range(tokens):
+        lookup()
+    return (time.perf_counter() - start_time) / tokens
+
+
+def benchmark_message_lookup(*, history_lengths=(10, 100, 1000), tokens=200) -> list[dict]:
+    results = []
+    for history_length in history_lengths:
+        scroller, message_id = fill_scroller(history_length)
+        results.append(
+            dict(
+                history_length=history_length,
+                query_selector=time_lookups(
+                    partial(scroller.query_selector, f'[data-message-id={message_id}]'),
+                    tokens=tokens,
+                ),
+                index=time_lookups(partial(scroller.get_message, message_id), tokens=tokens),
+            )
+        )
+    return results
+
+
+def print_message_lookup(**kwargs) -> None:
+    table = Table(title='Lookup of the chat line per token')
+    table.add_column('History length', justify='right')
+    table.add_column('query_selector()', justify='right')
+    table.add_column('Index', justify='right')
+    for result in benchmark_message_lookup(**kwargs):
+        table.add_row(
+            str(result['history_length']),
+            f'{result["query_selector"] * 1_000_000:.1f} µs',
+            f'{result["index"] * 1_000_000:.2f} µs',
+        )
+    print(table)
@@ -0,0 +1,92 @@
+"""
+    Benchmark: Allocations and memory of 10k chat messages in different representations
+"""
+import dataclasses
+import gc
+import tracemalloc
+from datetime import datetime
+from uuid import uuid4
+
+from rich import print  # noqa
+from rich.table import Table
+
+from gpt4all_cli.data_classes import ChatMessage, MessageTypeEnum
+
+
+@dataclasses.dataclass
+class DictChatMessage:
+    """
+    The old ChatMessage: A dataclass with a __dict__
+    """
+
+    id: str
+    type: MessageTypeEnum
+
+    dt: datetime | None = None
+    user_name: str | None = None
+    message: str | None = None
+
+
+def make_list(message_id, text):
+    # The old history entry: [id, unix timestamp, type, user name, text]
+    return [message_id, 1700000000.0, 'message', 'user', text]
+
+
+def make_dict_message(message_id, text):
+    return DictChatMessage(id=message_id, type=MessageTypeEnum.APPEND, message=text)
+
+
+def make_chat_message(message_id, text):
+    return ChatMessage(id=message_id, type=MessageTypeEnum.APPEND, text=text)
+
+
+def make_encoded_message(message_id, text):
+    return ChatMessage(id=message_id, type=MessageTypeEnum.APPEND, text=text).encode()
+
+
+FACTORIES = {
+    '5-element list': make_list,
+    'dataclass with __dict__': make_dict_message,
+    'ChatMessage (slotted, frozen)': make_chat_message,
+    'ChatMessage.encode()': make_encoded_message,
+}
+
+
+def measure(factory, *, count: int) -> dict:
+    # Create the id and text before the measuring, they are the same for all representations:
+    args = [(uuid4().hex, f'token {number}') for number in range(count)]
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        messages = [factory(*arg) for arg in args]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    stats = after.compare_to(before, 'filename')
+    allocations = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    del messages
+    return dict(allocations=allocations, size=size)
+
+
+def benchmark_message_records(*, count: int = 10_000) -> dict[str, dict]:
+    return {name: measure(factory, count=count) for name, factory in FACTORIES.items()}
+
+
+def print_message_records(*, count: int = 10_000) -> None:
+    table = Table(title=f'{count} chat messages')
+    table.add_column('Representation')
+    table.add_column('Allocations', justify='right')
+    table.add_column('Memory', justify='right')
+    table.add_column('Bytes/message', justify='right')
+    for name, result in benchmark_message_records(count=count).items():
+        table.add_row(
+            name,
+            str(result['allocations']),
+            f'{result["size"] / 1024:.1f} KiB',
+            f'{result["size"] / count:.1f}',
+        )
+    print(table)
@@ -0,0 +1,233 @@
+"""
+    Benchmark: The streaming pipeline of the web UI and the CLI with a fake GPT4All backend
+
+    Every simulated room uses its own fake model and every room has M simulated clients.
+    The channel delivers the messages synchronously to all clients of a room, so the
+    measured latency contains the complete pipeline: Token coalescing, channel messages
+    and the DOM updates of `ChatView.handle_messages()` for every client.
+    """
+import io
+import statistics
+import threading
+import time
+from functools import partial
+from types import SimpleNamespace
+from uuid import uuid4
+
+from lona.channels import Message
+from rich import print  # noqa
+from rich.console import Console
+from rich.table import Table
+
+from gpt4all_cli.benchmarks.fake_gpt4all import FakeGPT4All
+from gpt4all_cli.data_classes import ChatMessage, MessageTypeEnum, RoomData
+from gpt4all_cli.gpt import GptChat
+from gpt4all_cli.model_pool import ChatContext, ModelPool
+from gpt4all_cli.scheduler import GenerationJob, GenerationQueue, InferenceScheduler
+from gpt4all_cli.web_ui import HTML, ChatView, MessageScrollerDiv, P, Td
+
+
+class FanoutChannel:
+    """
+    Replaces the Lona channel of a room: Pass every message to all clients of the room.
+    """
+
+    def __init__(self, topic: str):
+        self.topic = topic
+        self.clients: list[SimulatedChatView] = []
+        self.message_count = 0
+
+    def send(self, message_data: dict) -> None:
+        self.message_count += 1
+        message = Message(topic=self.topic, data=message_data)
+        for client in self.clients:
+            client.handle_messages(message)
+
+
+class SimulatedChatView(ChatView):
+    """
+    A ChatView without a browser: Renders the messages into its HTML tree and records the
+    latency of every token, from the production in the fake model until the DOM update.
+    """
+
+    server = None  # Replaces the property of the Lona view
+
+    def __init__(self, *, server, room_data: RoomData, channel: FanoutChannel):
+        self.server = server
+        self.room_data = room_data
+        self.channel = channel
+        self.user_name = f'client-{len(channel.clients)}'
+        self.queue_owner = uuid4().hex
+        self.joined = True
+
+        self.messages_scroller = MessageScrollerDiv(lines=room_data.back_log)
+        self.queue_info = P()
+        self.last_thread_count = Td('-')
+        self.last_generation = Td('-')
+        self.all_generations = Td('-')
+        self.html = HTML(
+            self.messages_scroller,
+            self.queue_info,
+            self.last_thread_count,
+            self.last_generation,
+            self.all_generations,
+        )
+
+        self.received_length = 0  # Length of the answer that is currently streamed
+        self.token_index = 0
+        self.latencies: list[float] = []
+
+    def show(self, *args, **kwargs):
+        pass  # Nothing to send to a browser
+
+    def handle_messages(self, message: Message):
+        super().handle_messages(message)
+
+        chat_message: ChatMessage = message.data['message']
+        if chat_message.type == MessageTypeEnum.WAIT:
+            self.received_length = self.token_index = 0
+        elif chat_message.type == MessageTypeEnum.APPEND:
+            now = time.monotonic()
+            self.received_length += len(chat_message.text)
+            chat_session = self.room_data.chat_session
+            assert isinstance(chat_session, ChatContext), 'The benchmark uses the in-process model pool'
+            produced = chat_session.model.produced
+            while self.token_index < len(produced) and produced[self.token_index][0] <= self.received_length:
+                self.latencies.append(now - produced[self.token_index][1])
+                self.token_index += 1
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    """
+    >>> percentiles(list(range(101)))
+    {'p50': 50.0, 'p90': 90.0, 'p99': 99.0, 'max': 100}
+    """
+    quantiles = statistics.quantiles(values, n=100, method='inclusive')
+    return {
+        'p50': quantiles[49],
+        'p90': quantiles[89],
+        'p99': quantiles[98],
+        'max': max(values),
+    }
+
+
+def benchmark_web_ui(*, rooms: int, clients: int, prompts: int, tokens: int, tokens_per_second: float) -> dict:
+    scheduler = InferenceScheduler(thread_budget=rooms, max_concurrent=rooms)
+    model_pool = ModelPool(scheduler=scheduler, loader=partial(FakeGPT4All, tokens_per_second=tokens_per_second))
+
+    server = SimpleNamespace(state={'user': {}, 'rooms': {}})  # Only the state of the Lona server
+    all_clients = []
+    channels = []
+    for room_number in range(rooms):
+        chat_session = model_pool.chat_context(f'fake-model-{room_number}')
+        room_data = RoomData(gpt_model_name=chat_session.pooled_model.model_name, chat_session=chat_session)
+        room_data.queue = GenerationQueue(worker=chat_session.pooled_model.worker, max_depth=prompts + 1)
+        server.state['rooms'][str(room_number)] = room_data
+
+        channel = FanoutChannel(topic=f'chat.room.{room_number}')
+        for _ in range(clients):
+            channel.clients.append(SimulatedChatView(server=server, room_data=room_data, channel=channel))
+        channels.append(channel)
+        all_clients.extend(channel.clients)
+
+    done = threading.Semaphore(0)
+    start_time = time.monotonic()
+    start_cpu_time = time.process_time()
+
+    for channel in channels:
+        view = channel.clients[0]
+        for prompt_number in range(prompts):
+            view.submit_gpt_job(prompt=f'Prompt {prompt_number}', max_tokens=tokens)
+        # Signal the end of the last generation of this room:
+        queue = view.room_data.queue
+        assert queue is not None, 'The room is loaded'
+        queue.submit(GenerationJob(func=lambda job: done.release(), name='done'))
+
+    for _ in channels:
+        done.acquire()
+
+    duration = time.monotonic() - start_time
+    cpu_time = time.process_time() - start_cpu_time
+
+    for channel in channels:
+        room_data = channel.clients[0].room_data
+        room_data.close()
+
+    latencies = [latency for client in all_clients for latency in client.latencies]
+    message_count = sum(channel.message_count for channel in channels)
+    return {
+        'rooms': rooms,
+        'clients': clients,
+        'delivered_tokens': len(latencies),
+        'duration': duration,
+        'latency': percentiles(latencies),
+        'channel_messages_per_second': message_count / duration,
+        'cpu_time_per_token': cpu_time / len(latencies),
+    }
+
+
+def benchmark_cli(*, prompts: int, tokens: int, tokens_per_second: float) -> dict:
+    """
+    Measure `GptChat.ask()`, the output is written into a buffer.
+    """
+    model_pool = ModelPool(loader=partial(FakeGPT4All, tokens_per_second=tokens_per_second))
+    gpt_chat = GptChat(
+        initial_prompt='',
+        model_name='fake-model',
+        max_tokens=tokens,
+        cpu_count=1,
+        temperature=0.7,
+        model_pool=model_pool,
+        console=Console(file=io.StringIO()),
+    )
+    start_time = time.monotonic()
+    start_cpu_time = time.process_time()
+    for prompt_number in range(prompts):
+        gpt_chat.ask(prompt=f'Prompt {prompt_number}')
+    duration = time.monotonic() - start_time
+    cpu_time = time.process_time() - start_cpu_time
+    gpt_chat.chat_session.close()
+
+    delivered_tokens = prompts * tokens
+    return {
+        'delivered_tokens': delivered_tokens,
+        'duration': duration,
+        'cpu_time_per_token': cpu_time / delivered_tokens,
+    }
+
+
+def format_ms(seconds: float) -> str:
+    return f'{seconds * 1000:.1f} ms'
+
+
+def print_streaming_pipeline(*, rooms: int, clients: int, prompts: int, tokens: int, tokens_per_second: float):
+    print(
+        f'{rooms} room(s) with {clients} client(s), {prompts} prompt(s) per room,'
+        f' {tokens} tokens per answer with {tokens_per_second} tokens/sec.'
+    )
+    result = benchmark_web_ui(
+        rooms=rooms,
+        clients=clients,
+        prompts=prompts,
+        tokens=tokens,
+        tokens_per_second=tokens_per_second,
+    )
+    table = Table(title='Web UI')
+    table.add_column('Metric')
+    table.add_column('Value', justify='right')
+    table.add_row('Delivered tokens', str(result['delivered_tokens']))
+    table.add_row('Duration', f'{result["duration"]:.2f} sec.')
+    for name, value in result['latency'].items():
+        table.add_row(f'Token latency {name}', format_ms(value))
+    table.add_row('Channel messages/sec', f'{result["channel_messages_per_second"]:.1f}')
+    table.add_row('CPU time per delivered token', f'{result["cpu_time_per_token"] * 1_000_000:.1f} µs')
+    print(table)
+
+    result = benchmark_cli(prompts=prompts, tokens=tokens, tokens_per_second=tokens_per_second)
+    table = Table(title='CLI: GptChat.ask()')
+    table.add_column('Metric')
+    table.add_column('Value', justify='right')
+    table.add_row('Delivered tokens', str(result['delivered_tokens']))
+    table.add_row('Duration', f'{result["duration"]:.2f} sec.')
+    table.add_row('CPU time per delivered token', f'{result["cpu_time_per_token"] * 1_000_000:.1f} µs')
+    print(table)
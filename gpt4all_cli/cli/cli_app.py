@@ -1,6 +1,10 @@
 """
     CLI for usage
 """
+import contextlib
+import dataclasses
+import datetime
+import json
 import logging
 import multiprocessing
 import sys
@@ -12,16 +16,17 @@ import rich_click as click
 from bx_py_utils.path import assert_is_file
 from cli_base.cli_tools.verbosity import OPTION_KWARGS_VERBOSE, setup_logging
 from cli_base.cli_tools.version_info import print_version
-from gpt4all import GPT4All
 from rich import print  # noqa
 from rich.console import Console
-from rich.table import Table
 from rich.traceback import install as rich_traceback_install
 from rich_click import RichGroup
 
 import gpt4all_cli
-from gpt4all_cli import constants, web_ui
-from gpt4all_cli.gpt import GptChat
+from gpt4all_cli import constants
+
+# Only light imports here: The commands import their modules on demand,
+# because the native gpt4all library and the web stack are slow to import.
+from gpt4all_cli.constants import DAEMON_SOCKET_PATH, MODEL_DIRECTORY, PREFIX_CACHE_PATH, RESPONSE_CACHE_PATH
 
 
 logger = logging.getLogger(__name__)
@@ -75,23 +80,68 @@ cli.add_command(version)
 
 
 @click.command()
-def list_models():
-    table = Table(title='GPT4All Models')
+@click.option('--offline', is_flag=True, help='Use only the cached catalogue and list the local model files')
+@click.option('--refresh', is_flag=True, help='Fetch the catalogue, even if the cache is not expired')
+@click.option(
+    '--seed',
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help='Fill the catalogue cache from this file (e.g. a downloaded models2.json)',
+)
+@click.option('-v', '--verbosity', **OPTION_KWARGS_VERBOSE)
+def list_models(offline: bool, refresh: bool, seed: Path | None, verbosity: int):
+    """
+    List the GPT4All models. The catalogue is cached locally.
+    """
+    from rich.table import Table
+
+    from gpt4all_cli.model_catalogue import ModelCatalogue
+
+    setup_logging(verbosity=verbosity)
     console = Console()
-    skip_keys = {'order', 'url', 'md5sum', 'name'}
-    with console.status('Fetch...'):
-        models = GPT4All.list_models()
-        keys = None
-        for model in models:
-            if not keys:
-                keys = sorted(model.keys() - skip_keys)
-                for key in keys:
-                    table.add_column(key)
-            values = [model.get(key) for key in keys]
-            table.add_row(*values)
+    catalogue = ModelCatalogue()
+    if seed:
+        count = catalogue.seed(seed)
+        console.print(f'{count} models from {seed} stored in {catalogue.path}')
+
+    if catalogue.is_fresh() and not refresh:
+        models = catalogue.get_models(offline=offline)
+    else:
+        with console.status('Fetch...'):
+            models = catalogue.get_models(offline=offline, refresh=refresh)
 
+    table = Table(title='GPT4All Models')
+    skip_keys = {'order', 'url', 'md5sum', 'name'}
+    keys = None
+    for model in models:
+        if not keys:
+            keys = sorted(model.keys() - skip_keys)
+            for key in keys:
+                table.add_column(key)
+        values = [model.get(key) for key in keys]
+        table.add_row(*values)
     print(table)
 
+    if catalogue.fetched:
+        console.print(f'Catalogue from: {datetime.datetime.fromtimestamp(catalogue.fetched):%Y-%m-%d %H:%M}')
+
+    if offline:
+        table = Table(title=f'Local model files in {MODEL_DIRECTORY}')
+        table.add_column('File')
+        table.add_column('Size', justify='right')
+        table.add_column('MD5')
+        table.add_column('Checksum')
+        with console.status('Check local model files...'):
+            local_models = catalogue.get_local_models()
+        for local_model in local_models:
+            checksum_ok = local_model.checksum_ok
+            table.add_row(
+                local_model.filename,
+                f'{local_model.size / 1024 / 1024:.0f} MiB',
+                local_model.md5sum,
+                {None: 'not in catalogue', True: 'OK', False: '[red]mismatch'}[checksum_ok],
+            )
+        print(table)
+
 
 cli.add_command(list_models)
 
@@ -110,20 +160,91 @@ cli.add_command(list_models)
 @click.option("--max-tokens", type=click.IntRange(1, 9999), default=400)
 @click.option("--cpu-count", type=click.IntRange(1, 9999), default=multiprocessing.cpu_count())
 @click.option("--temperature", type=click.FloatRange(0, 2), default=0.7)
+@click.option(
+    '--stats-file',
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    help='Append the timings of every answer as JSON line to this file',
+)
+@click.option('--resume', 'session_id', help='Continue a saved chat session, e.g.: "20240101-120000-abcdef"')
+@click.option(
+    '--save-session/--no-save-session',
+    default=True,
+    show_default=True,
+    help='Save the chat session (with the model state, if possible) on exit',
+)
+@click.option(
+    '--prefix-cache/--no-prefix-cache',
+    default=False,
+    show_default=True,
+    help=f'Store the model state after the system prompt in {PREFIX_CACHE_PATH} and reuse it',
+)
+@click.option(
+    '--response-cache/--no-response-cache',
+    default=False,
+    show_default=True,
+    help=(
+        'Replay cached answers of identical prompts with identical history and arguments'
+        f' ({RESPONSE_CACHE_PATH}), only used with --temperature 0'
+    ),
+)
+@click.option(
+    '--daemon/--no-daemon',
+    'use_daemon',
+    default=True,
+    show_default=True,
+    help='Use the resident model of the model daemon, if it is running (see: "daemon" command)',
+)
 @click.option('-v', '--verbosity', **OPTION_KWARGS_VERBOSE)
-def chat(prompt, model, max_tokens, cpu_count, temperature, verbosity: int):
+def chat(
+    prompt,
+    model,
+    max_tokens,
+    cpu_count,
+    temperature,
+    stats_file: Path | None,
+    session_id: str | None,
+    save_session: bool,
+    prefix_cache: bool,
+    response_cache: bool,
+    use_daemon: bool,
+    verbosity: int,
+):
     """
     Chat with GPT4all
 
     https://github.com/nomic-ai/gpt4all/tree/main/gpt4all-bindings/python
     """
+    from gpt4all_cli.daemon import connect
+    from gpt4all_cli.gpt import GptChat
+    from gpt4all_cli.instrumentation import JsonLinesSink
+    from gpt4all_cli.prefix_cache import PrefixCache
+    from gpt4all_cli.response_cache import ResponseCache
+    from gpt4all_cli.sessions import SessionSnapshot
+
     setup_logging(verbosity=verbosity)
+
+    snapshot = None
+    if session_id:
+        try:
+            snapshot = SessionSnapshot.load(session_id)
+        except (FileNotFoundError, ValueError) as err:
+            raise click.BadParameter(f'Can not load session: {err}', param_hint='--resume') from err
+        if snapshot.model_name != model:
+            print(f'Use the model of the session: {snapshot.model_name}')
+            model = snapshot.model_name
+
     chat = GptChat(
         initial_prompt=' '.join(prompt),
         model_name=model,
         max_tokens=max_tokens,
         cpu_count=cpu_count,
         temperature=temperature,
+        stats_sinks=[JsonLinesSink(stats_file)] if stats_file else None,
+        snapshot=snapshot,
+        save_on_exit=save_session,
+        prefix_cache=PrefixCache(path=PREFIX_CACHE_PATH) if prefix_cache else None,
+        response_cache=ResponseCache() if response_cache else None,
+        daemon_connection=connect() if use_daemon else None,
     )
     chat.loop()
 
@@ -131,6 +252,312 @@ def chat(prompt, model, max_tokens, cpu_count, temperature, verbosity: int):
 cli.add_command(chat)
 
 
+@click.command()
+@click.argument('prompt', nargs=-1, required=True)
+@click.option('--model', default='em_german_mistral_v01.Q4_0.gguf')
+@click.option('--max-tokens', type=click.IntRange(1, 9999), default=400, show_default=True)
+@click.option('--temperature', type=click.FloatRange(0, 2), default=0.7, show_default=True)
+@click.option(
+    '--daemon/--no-daemon',
+    'use_daemon',
+    default=True,
+    show_default=True,
+    help='Use the resident model of the model daemon, if it is running',
+)
+def ask(prompt, model: str, max_tokens: int, temperature: float, use_daemon: bool):
+    """
+    Print only the answer of one prompt, e.g. for scripts. Fast with a running model daemon.
+    """
+    from gpt4all_cli.daemon import RemoteChatContext, connect
+    from gpt4all_cli.model_pool import ChatContext, ModelPool
+
+    chat_context: ChatContext | RemoteChatContext
+    if use_daemon and (connection := connect()):
+        chat_context = RemoteChatContext(connection, model_name=model)
+    else:
+        chat_context = ModelPool().chat_context(model)
+    try:
+        for token in chat_context.generate(' '.join(prompt), max_tokens=max_tokens, temp=temperature):
+            sys.stdout.write(token)
+            sys.stdout.flush()
+        sys.stdout.write('\n')
+    finally:
+        chat_context.close()
+
+
+cli.add_command(ask)
+
+
+@click.command()
+@click.option(
+    '--model',
+    multiple=True,
+    help='Load this model on startup and keep it resident (Can be used multiple times)',
+)
+@click.option('--cpu-count', type=click.IntRange(1, 9999), default=multiprocessing.cpu_count(), show_default=True)
+@click.option(
+    '--max-concurrent',
+    type=click.IntRange(1, 999),
+    default=1,
+    show_default=True,
+    help='Number of generations at the same time, they share the CPU threads',
+)
+@click.option(
+    '--prefix-cache/--no-prefix-cache',
+    default=False,
+    show_default=True,
+    help=f'Store the model state after the system prompt in {PREFIX_CACHE_PATH} and reuse it',
+)
+@click.option('--status', is_flag=True, help='Print the status of the running daemon and exit')
+@click.option('--stop', is_flag=True, help='Stop the running daemon and exit')
+@click.option('-v', '--verbosity', **OPTION_KWARGS_VERBOSE)
+def daemon(
+    model: tuple[str, ...],
+    cpu_count: int,
+    max_concurrent: int,
+    prefix_cache: bool,
+    status: bool,
+    stop: bool,
+    verbosity: int,
+):
+    """
+    Run the model daemon: It keeps the models resident and "chat" and "ask" use them via a Unix socket
+    """
+    from gpt4all_cli.daemon import ModelDaemon, get_status, stop_daemon
+    from gpt4all_cli.model_pool import ModelPool
+    from gpt4all_cli.prefix_cache import PrefixCache
+    from gpt4all_cli.scheduler import InferenceScheduler
+
+    setup_logging(verbosity=verbosity)
+
+    if status:
+        if info := get_status():
+            print(f'Daemon is running (PID {info["pid"]}), loaded models: {", ".join(info["models"]) or "-"}')
+        else:
+            print(f'Daemon is not running ({DAEMON_SOCKET_PATH})')
+        return
+    if stop:
+        print('Daemon stopped' if stop_daemon() else 'Daemon is not running')
+        return
+
+    model_pool = ModelPool(
+        scheduler=InferenceScheduler(thread_budget=cpu_count, max_concurrent=max_concurrent),
+        prefix_cache=PrefixCache(path=PREFIX_CACHE_PATH) if prefix_cache else None,
+    )
+    try:
+        server = ModelDaemon(model_pool=model_pool)
+    except RuntimeError as err:
+        raise click.ClickException(str(err)) from err
+    with server:
+        for model_name in model:
+            print(f'Load {model_name}...')
+            server.preload(model_name)
+        print(f'Daemon listening on {DAEMON_SOCKET_PATH} (Stop with Ctrl-C or "daemon --stop")')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print('\nBye!')
+
+
+cli.add_command(daemon)
+
+
+@click.command()
+@click.option(
+    '--model',
+    default='em_german_mistral_v01.Q4_0.gguf',
+)
+@click.option(
+    '--threads',
+    help='Comma separated thread counts, e.g.: "1,2,4" (Default: powers of two up to the CPU count)',
+)
+@click.option('--max-tokens', type=click.IntRange(1, 9999), default=100, show_default=True)
+@click.option(
+    '--json',
+    'json_path',
+    type=click.Path(dir_okay=False, writable=True, allow_dash=True, path_type=Path),
+    help='Write the results as JSON into this file ("-" for stdout)',
+)
+@click.option(
+    '--prefix-cache/--no-prefix-cache',
+    default=False,
+    help='Measure the time to first token of new chat sessions with and without the prefix cache, too',
+)
+@click.option('-v', '--verbosity', **OPTION_KWARGS_VERBOSE)
+def bench(
+    model: str,
+    threads: str | None,
+    max_tokens: int,
+    json_path: Path | None,
+    prefix_cache: bool,
+    verbosity: int,
+):
+    """
+    Measure time to first token, prompt/decode tokens/sec and peak RSS for different thread counts
+    """
+    from rich.table import Table
+
+    from gpt4all_cli.bench import BENCH_PROMPTS, BenchResult, get_thread_counts, run_bench, run_prefix_cache_bench
+
+    setup_logging(verbosity=verbosity)
+
+    if threads:
+        thread_counts = [int(n_threads) for n_threads in threads.split(',')]
+    else:
+        thread_counts = get_thread_counts(multiprocessing.cpu_count())
+
+    console = Console()
+    table = Table(title=f'Benchmark: {model}')
+    table.add_column('Threads', justify='right')
+    table.add_column('Load time', justify='right')
+    table.add_column('TTFT', justify='right')
+    table.add_column('Prompt tok/s', justify='right')
+    table.add_column('Decode tok/s', justify='right')
+    table.add_column('Peak RSS', justify='right')
+
+    def on_result(result: BenchResult):
+        console.print(f'{result.n_threads} threads: {result.decode_tokens_per_second:.1f} tokens/sec.')
+        table.add_row(
+            str(result.n_threads),
+            f'{result.load_time:.1f} s',
+            f'{result.ttft:.2f} s',
+            f'{result.prompt_tokens_per_second:.1f}',
+            f'{result.decode_tokens_per_second:.1f}',
+            f'{result.peak_rss / 1024 / 1024:.0f} MiB',
+        )
+
+    with console.status(f'Run {len(BENCH_PROMPTS)} prompts with {thread_counts} threads...'):
+        results = run_bench(
+            model_name=model,
+            thread_counts=thread_counts,
+            max_tokens=max_tokens,
+            on_result=on_result,
+        )
+    console.print(table)
+
+    data = {'model': model, 'max_tokens': max_tokens, 'results': [dataclasses.asdict(result) for result in results]}
+
+    if prefix_cache:
+        n_threads = max(thread_counts)
+        with console.status(f'Measure the prefix cache with {n_threads} threads...'):
+            prefix_cache_result = run_prefix_cache_bench(model_name=model, n_threads=n_threads)
+        table = Table(title='Time to first token of a new chat session')
+        table.add_column('Prefix cache')
+        table.add_column('TTFT', justify='right')
+        table.add_row('without', f'{prefix_cache_result.without_cache:.2f} s')
+        table.add_row('miss (evaluate + store)', f'{prefix_cache_result.cache_miss:.2f} s')
+        table.add_row('hit', f'{prefix_cache_result.cache_hit:.2f} s')
+        console.print(table)
+        data['prefix_cache'] = dataclasses.asdict(prefix_cache_result)
+
+    if json_path:
+        json_text = json.dumps(data, indent=4)
+        if str(json_path) == '-':
+            print(json_text)
+        else:
+            json_path.write_text(json_text)
+            console.print(f'Results written to {json_path}')
+
+
+cli.add_command(bench)
+
+
+@click.command()
+@click.argument('input_file', type=click.File('r'))
+@click.option(
+    '--output',
+    type=click.Path(dir_okay=False, writable=True, allow_dash=True, path_type=Path),
+    default='-',
+    help='JSONL file for the results ("-" for stdout)',
+)
+@click.option(
+    '--resume/--no-resume',
+    default=False,
+    help='Skip all prompts that are already answered in the output file, retry failed ones and append the results',
+)
+@click.option(
+    '--model',
+    default='em_german_mistral_v01.Q4_0.gguf',
+)
+@click.option('--workers', type=click.IntRange(1, 999), default=1, show_default=True, help='Number of processes')
+@click.option(
+    '--threads-per-worker',
+    type=click.IntRange(1, 9999),
+    help='Threads of every worker (Default: CPU count divided by the number of workers)',
+)
+@click.option('--max-tokens', type=click.IntRange(1, 9999), default=400, show_default=True)
+@click.option('--temperature', type=click.FloatRange(0, 2), default=0.7, show_default=True)
+@click.option(
+    '--response-cache/--no-response-cache',
+    default=False,
+    show_default=True,
+    help=(
+        'Replay cached answers of identical prompts with identical history and arguments'
+        f' ({RESPONSE_CACHE_PATH}), only used with --temperature 0'
+    ),
+)
+@click.option('-v', '--verbosity', **OPTION_KWARGS_VERBOSE)
+def batch(
+    input_file,
+    output: Path,
+    resume: bool,
+    model: str,
+    workers: int,
+    threads_per_worker: int | None,
+    max_tokens: int,
+    temperature: float,
+    response_cache: bool,
+    verbosity: int,
+):
+    """
+    Answer all prompts of a JSONL file ("-" for stdin)
+
+    Every line is a JSON object with a "prompt" and optional "id", "max_tokens" and "temperature".
+    Every worker process loads the model once. The results are written in completion order
+    as JSON lines with the id of the prompt.
+    """
+    from gpt4all_cli.batch import format_result, prepare_resume, read_prompts, run_batch
+
+    setup_logging(verbosity=verbosity)
+    console = Console(stderr=True)
+
+    if not threads_per_worker:
+        threads_per_worker = max(multiprocessing.cpu_count() // workers, 1)
+
+    to_stdout = str(output) == '-'
+    skip_ids = set()
+    if resume:
+        if to_stdout:
+            raise click.BadParameter('Can only resume into an output file', param_hint='--resume')
+        skip_ids = prepare_resume(output)
+        console.print(f'Resume: Skip {len(skip_ids)} already answered prompts')
+
+    def on_result(result: dict):
+        console.print(format_result(result))
+
+    with contextlib.ExitStack() as stack:
+        if to_stdout:
+            output_file = sys.stdout
+        else:
+            output_file = stack.enter_context(output.open('a' if resume else 'w'))
+        count = run_batch(
+            prompts=read_prompts(input_file),
+            output=output_file,
+            model_name=model,
+            workers=workers,
+            n_threads=threads_per_worker,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            skip_ids=skip_ids,
+            response_cache_path=RESPONSE_CACHE_PATH if response_cache else None,
+            on_result=on_result,
+        )
+    console.print(f'{count} prompts answered by {workers} worker(s) with {threads_per_worker} threads each')
+
+
+cli.add_command(batch)
+
+
 @click.command()
 @click.option('-h', '--host', default='localhost')
 @click.option('-p', '--port', default=8080)
@@ -139,6 +566,8 @@ def web(host: str, port: int, verbosity: int):
     """
     Start Lona Web UI
     """
+    from gpt4all_cli import web_ui
+
     setup_logging(verbosity=verbosity)
 
     Timer(
@@ -158,6 +587,44 @@ def web(host: str, port: int, verbosity: int):
 cli.add_command(web)
 
 
+@click.command()
+@click.option('-h', '--host', default='localhost')
+@click.option('-p', '--port', default=8080)
+@click.option(
+    '--model',
+    multiple=True,
+    help=(
+        'Load this (already downloaded) model on startup and serve it via the API (Can be used multiple times).'
+        ' Only these models are served.'
+    ),
+)
+@click.option('-v', '--verbosity', **OPTION_KWARGS_VERBOSE)
+def serve(host: str, port: int, model: tuple[str, ...], verbosity: int):
+    """
+    Start the Lona Web UI and the OpenAI compatible API (/v1/chat/completions and /v1/completions)
+    """
+    from gpt4all_cli import web_ui
+
+    setup_logging(verbosity=verbosity)
+
+    for model_name in model:
+        print(f'Load {model_name}...')
+        web_ui.openai_api.preload(model_name)
+
+    print(f'OpenAI compatible API: http://{host}:{port}/v1')
+    try:
+        web_ui.app.run(
+            host=host,
+            port=port,
+            parse_command_line=False,
+        )
+    finally:
+        web_ui.openai_api.close()
+
+
+cli.add_command(serve)
+
+
 def main():
     print_version(gpt4all_cli)
 
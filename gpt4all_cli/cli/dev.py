@@ -243,6 +243,73 @@ def tox():
 cli.add_command(tox)
 
 
+@click.command()
+@click.option('--tokens', default=200, show_default=True, help='Lookups per history length')
+def benchmark_message_lookup(tokens: int):
+    """
+    Benchmark the lookup of streamed chat messages in the web UI
+    """
+    from gpt4all_cli.benchmarks.message_lookup import print_message_lookup
+
+    print_message_lookup(tokens=tokens)
+
+
+cli.add_command(benchmark_message_lookup)
+
+
+@click.command()
+@click.option('--count', default=10_000, show_default=True, help='Number of messages')
+def benchmark_message_records(count: int):
+    """
+    Compare allocations and memory of the chat message representations
+    """
+    from gpt4all_cli.benchmarks.message_records import print_message_records
+
+    print_message_records(count=count)
+
+
+cli.add_command(benchmark_message_records)
+
+
+@click.command()
+@click.option('--rooms', default=2, show_default=True, help='Number of simulated rooms')
+@click.option('--clients', default=5, show_default=True, help='Number of simulated clients per room')
+@click.option('--prompts', default=3, show_default=True, help='Number of prompts per room')
+@click.option('--tokens', default=100, show_default=True, help='Number of tokens per answer')
+@click.option('--tokens-per-second', default=50.0, show_default=True, help='Speed of the fake model')
+def benchmark_streaming(rooms: int, clients: int, prompts: int, tokens: int, tokens_per_second: float):
+    """
+    Benchmark the token streaming of the web UI and the CLI with a fake GPT4All model
+    """
+    from gpt4all_cli.benchmarks.streaming_pipeline import print_streaming_pipeline
+
+    print_streaming_pipeline(
+        rooms=rooms,
+        clients=clients,
+        prompts=prompts,
+        tokens=tokens,
+        tokens_per_second=tokens_per_second,
+    )
+
+
+cli.add_command(benchmark_streaming)
+
+
+@click.command()
+@click.option('--repeat', default=3, show_default=True, help='Runs per command, the fastest run is used')
+def check_import_time(repeat: int):
+    """
+    Check the import time of the CLI commands (via "python -X importtime") against their budgets
+    """
+    from gpt4all_cli.benchmarks.import_time import print_import_times
+
+    if not print_import_times(repeat=repeat):
+        sys.exit(1)
+
+
+cli.add_command(check_import_time)
+
+
 @click.command()
 def version():
     """Print version and exit"""
@@ -6,3 +6,12 @@ import gpt4all_cli
 CLI_EPILOG = 'Project Homepage: https://github.com/jedie/gpt4all_cli'
 
 BASE_PATH = Path(gpt4all_cli.__file__).parent
+
+# Saved chat sessions and other caches:
+CACHE_PATH = Path.home() / '.cache' / 'gpt4all_cli'
+PREFIX_CACHE_PATH = CACHE_PATH / 'prefixes'
+RESPONSE_CACHE_PATH = CACHE_PATH / 'responses.sqlite3'
+DAEMON_SOCKET_PATH = CACHE_PATH / 'daemon.sock'
+
+# Same as gpt4all.gpt4all.DEFAULT_MODEL_DIRECTORY, without importing the native library:
+MODEL_DIRECTORY = Path.home() / '.cache' / 'gpt4all'
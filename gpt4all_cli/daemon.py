@@ -0,0 +1,576 @@
+"""
+    Local model daemon: Keeps models resident and serves chat sessions over a Unix domain socket.
+
+    The protocol: JSON messages, one per line. The client sends "command" messages,
+    the daemon answers with "event" messages. Every connection is one chat session:
+
+        -> {"command": "open", "model": "..."}
+        <- {"event": "opened", "config": {...}, "history": [...], "thread_count": 4}
+        -> {"command": "generate", "prompt": "Hi", "max_tokens": 200, "temp": 0.7}
+        <- {"event": "token", "text": "Hello"}
+        <- ...
+        <- {"event": "done", "answer": "Hello there!", "thread_count": 4}
+
+    A "cancel" command stops a running generation. Errors are answered with {"event": "error", "message": "..."}
+    "open" can send the "history" of the chat, e.g. to continue a chat after a restart of the daemon,
+    and "detached": true for a chat that doesn't take over the model (see: `ChatContext`).
+    With "n_threads" in "generate" the daemon uses this thread count instead of a slot of its own scheduler:
+    The client holds a slot of its scheduler, e.g. the web server that runs all models in worker processes.
+"""
+import copy
+import dataclasses
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from collections.abc import Callable, Iterator
+from pathlib import Path
+
+from gpt4all_cli.constants import DAEMON_SOCKET_PATH
+from gpt4all_cli.model_pool import ChatContext, ModelPool
+from gpt4all_cli.scheduler import InferenceScheduler, ModelWorker, Priority
+from gpt4all_cli.sessions import SESSIONS_PATH, RestoreResult, SessionSnapshot, restore_session, save_session
+
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteError(Exception):
+    """
+    The daemon could not handle a command
+    """
+
+
+class JsonConnection:
+    """
+    Send and receive JSON messages, one per line, over a stream socket.
+    Same interface as `multiprocessing.connection.Connection`: `send()`, `recv()` and `close()`
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+        self.wfile = sock.makefile('wb')
+        self.send_lock = threading.Lock()
+
+    def send(self, message: dict) -> None:
+        data = json.dumps(message, default=str).encode() + b'\n'
+        with self.send_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def recv(self) -> dict:
+        line = self.rfile.readline()
+        if not line:
+            raise EOFError('Connection closed')
+        return json.loads(line)
+
+    def close(self) -> None:
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)  # Wakes up a blocked recv() in another thread
+        except OSError:
+            pass
+        for close in (self.rfile.close, self.wfile.close, self.sock.close):
+            try:
+                close()
+            except OSError:
+                pass
+
+
+def connect(socket_path: Path = DAEMON_SOCKET_PATH) -> JsonConnection | None:
+    """
+    Connect to the daemon. Returns None, if it is not running.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(socket_path))
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+    return JsonConnection(sock)
+
+
+class ChatServer:
+    """
+    Serve the chat session of one connection with a chat context of the model pool.
+    """
+
+    def __init__(
+        self,
+        connection,
+        *,
+        model_pool: ModelPool,
+        shutdown: Callable[[], None] | None = None,
+        sessions_path: Path = SESSIONS_PATH,
+    ):
+        self.connection = connection
+        self.model_pool = model_pool
+        self.shutdown = shutdown
+        self.sessions_path = sessions_path
+
+        self.chat_context: ChatContext | None = None
+        self.requests: queue.SimpleQueue[dict | None] = queue.SimpleQueue()
+        self.cancel = threading.Event()
+        self.disconnected = False
+
+    def _read(self) -> None:
+        # Read in an own thread, so a "cancel" can stop the running generation:
+        try:
+            while True:
+                message = self.connection.recv()
+                if message.get('command') == 'cancel':
+                    self.cancel.set()
+                else:
+                    self.requests.put(message)
+        except (EOFError, OSError, ValueError):
+            pass
+        finally:
+            self.disconnected = True
+            self.cancel.set()  # The client is gone: Stop the generation
+            self.requests.put(None)
+
+    def serve(self) -> None:
+        threading.Thread(target=self._read, name='chat-server-reader', daemon=True).start()
+        try:
+            while (request := self.requests.get()) is not None:
+                try:
+                    self.handle(request)
+                except Exception as err:
+                    # If the connection is broken, sending the error fails, too:
+                    logger.exception('Command %r failed', request.get('command'))
+                    self.connection.send({'event': 'error', 'message': f'{type(err).__name__}: {err}'})
+        except (EOFError, OSError) as err:
+            logger.info('Client disconnected: %s', err)
+        finally:
+            if self.chat_context is not None:
+                self.chat_context.close()
+            self.connection.close()
+
+    def get_chat_context(self) -> ChatContext:
+        if self.chat_context is None:
+            raise ValueError('No model opened')
+        return self.chat_context
+
+    def handle(self, request: dict) -> None:
+        command = request.get('command')
+        if command == 'open':
+            self.open(request['model'], history=request.get('history'), detached=request.get('detached', False))
+        elif command == 'generate':
+            self.generate(
+                request['prompt'],
+                max_tokens=request['max_tokens'],
+                temp=request['temp'],
+                priority=Priority(request.get('priority', Priority.INTERACTIVE)),
+                n_threads=request.get('n_threads'),
+            )
+        elif command == 'append_answer':
+            self.get_chat_context().append_answer(request['prompt'], request['answer'])
+            self.connection.send({'event': 'ok'})
+        elif command == 'save':
+            snapshot = save_session(
+                self.get_chat_context(),
+                session_id=request['session_id'],
+                messages=request.get('messages'),
+                path=self.sessions_path,
+            )
+            self.connection.send({'event': 'saved', 'native': snapshot.state is not None})
+        elif command == 'restore':
+            snapshot = SessionSnapshot.load(request['session_id'], path=self.sessions_path)
+            result = restore_session(self.get_chat_context(), snapshot)
+            self.connection.send({'event': 'restored', 'result': dataclasses.asdict(result)})
+        elif command == 'status':
+            models = self.model_pool.models.copy()
+            self.connection.send(
+                {
+                    'event': 'status',
+                    'pid': os.getpid(),
+                    'models': list(models),
+                    'sizes': {model_name: pooled_model.size for model_name, pooled_model in models.items()},
+                }
+            )
+        elif command == 'shutdown' and self.shutdown:
+            self.connection.send({'event': 'ok'})
+            self.shutdown()
+        else:
+            raise ValueError(f'Unknown command: {command!r}')
+
+    def open(self, model_name: str, *, history: list[dict] | None = None, detached: bool = False) -> None:
+        if self.chat_context is not None:
+            self.chat_context.close()
+            self.chat_context = None
+        self.chat_context = chat_context = self.model_pool.chat_context(model_name, detached=detached)
+        if history:
+            # Evaluated with the next generation:
+            chat_context.current_chat_session = history
+        self.connection.send(
+            {
+                'event': 'opened',
+                'config': chat_context.config,
+                'history': chat_context.current_chat_session,
+                'thread_count': chat_context.thread_count(),
+            }
+        )
+
+    def generate(
+        self, prompt: str, *, max_tokens: int, temp: float, priority: Priority, n_threads: int | None = None
+    ) -> None:
+        chat_context = self.get_chat_context()
+        if not self.disconnected:
+            self.cancel.clear()  # A "cancel" of the previous generation
+
+        def keep_generating(token_id: int, response: str) -> bool:
+            return not self.cancel.is_set()
+
+        def on_start() -> None:
+            self.connection.send({'event': 'start'})
+
+        for token in chat_context.generate(
+            prompt,
+            streaming=True,
+            max_tokens=max_tokens,
+            temp=temp,
+            callback=keep_generating,
+            priority=priority,
+            on_start=on_start,
+            n_threads=n_threads,
+        ):
+            self.connection.send({'event': 'token', 'text': token})
+        self.connection.send(
+            {
+                'event': 'done',
+                'answer': chat_context.current_chat_session[-1]['content'],
+                'thread_count': chat_context.thread_count(),
+            }
+        )
+
+
+class ChatRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        ChatServer(
+            JsonConnection(self.request),
+            model_pool=self.server.model_pool,
+            shutdown=self.server.shutdown_later,
+            sessions_path=self.server.sessions_path,
+        ).serve()
+
+
+class ModelDaemon(socketserver.ThreadingUnixStreamServer):
+    """
+    Serves every connection in an own thread. Preloaded models stay resident until the daemon stops.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        *,
+        model_pool: ModelPool,
+        socket_path: Path = DAEMON_SOCKET_PATH,
+        sessions_path: Path = SESSIONS_PATH,
+    ):
+        if connection := connect(socket_path):
+            connection.close()
+            raise RuntimeError(f'Daemon is already running: {socket_path}')
+        socket_path.parent.mkdir(parents=True, exist_ok=True)
+        socket_path.unlink(missing_ok=True)  # From a crashed daemon
+
+        self.model_pool = model_pool
+        self.socket_path = socket_path
+        self.sessions_path = sessions_path
+        self.resident: list[ChatContext] = []
+
+        old_umask = os.umask(0o077)  # Only the user can connect
+        try:
+            super().__init__(str(socket_path), ChatRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def preload(self, model_name: str) -> None:
+        """
+        Load the model and hold it resident. Blocks until the model is loaded.
+        """
+        self.resident.append(self.model_pool.chat_context(model_name))
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            # Not connectable anymore, new clients should load the model in-process:
+            self.socket_path.unlink(missing_ok=True)
+
+    def shutdown_later(self) -> None:
+        # shutdown() waits for serve_forever(), so it can't be called in its thread:
+        threading.Thread(target=self.shutdown, daemon=True).start()
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.socket_path.unlink(missing_ok=True)
+        for chat_context in self.resident:
+            chat_context.close()
+        self.resident.clear()
+
+
+class RemoteChatContext:
+    """
+    A chat session in the model daemon: Can be used like a local `ChatContext`.
+
+    With `reconnect` a lost connection is opened again before the next command (e.g. after the
+    restart of a crashed worker process) and the daemon gets the history of the chat.
+    With a `scheduler` every generation waits for its slot and the daemon uses the granted thread count.
+    A `detached` chat doesn't take over the model of the daemon (see: `ChatContext`).
+    """
+
+    def __init__(
+        self,
+        connection,
+        *,
+        model_name: str,
+        reconnect: Callable[[], JsonConnection] | None = None,
+        worker: ModelWorker | None = None,
+        on_close: Callable[[], None] | None = None,
+        scheduler: InferenceScheduler | None = None,
+        detached: bool = False,
+    ):
+        self.connection = connection
+        self.model_name = model_name
+        self.detached = detached
+        self.reconnect = reconnect
+        self.worker = worker  # Runs the queued generations of all rooms that use this model
+        self.on_close = on_close
+        self.scheduler = scheduler
+        self.closed = False
+
+        self.current_chat_session: list[dict] = []
+        self._open()
+
+    def _open(self) -> None:
+        opened = self.request(
+            'opened',
+            command='open',
+            model=self.model_name,
+            history=self.current_chat_session,
+            detached=self.detached,
+        )
+        self.config = opened['config']
+        self.current_chat_session = opened['history']
+        self.last_thread_count: int = opened['thread_count']
+
+    def get_connection(self):
+        assert not self.closed, 'Chat context is closed'
+        if self.connection is None:
+            if self.reconnect is None:
+                raise RemoteError('Connection to the daemon lost')
+            logger.info('Reconnect %r', self.model_name)
+            self.connection = self.reconnect()
+            self._open()
+        return self.connection
+
+    def _lost(self, err: Exception) -> RemoteError:
+        logger.warning('Connection of %r lost: %s', self.model_name, err)
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        return RemoteError(f'Connection lost: {err}')
+
+    def send(self, command: dict) -> None:
+        try:
+            self.get_connection().send(command)
+        except (EOFError, OSError) as err:
+            raise self._lost(err) from err
+
+    def recv(self) -> dict:
+        try:
+            return self.connection.recv()
+        except (EOFError, OSError) as err:
+            raise self._lost(err) from err
+
+    def receive(self, event: str) -> dict:
+        message = self.recv()
+        if message['event'] == 'error':
+            raise RemoteError(message['message'])
+        if message['event'] != event:
+            raise RemoteError(f'Expected {event!r} not: {message!r}')
+        return message
+
+    def request(self, event: str, **command) -> dict:
+        self.send(command)
+        return self.receive(event)
+
+    def thread_count(self) -> int:
+        return self.last_thread_count
+
+    def generate(
+        self,
+        prompt: str,
+        *,
+        streaming=True,
+        max_tokens=200,
+        temp=0.7,
+        callback: Callable[[int, str], bool] | None = None,
+        priority: Priority = Priority.INTERACTIVE,
+        on_start: Callable[[], None] | None = None,
+    ) -> Iterator[str] | str:
+        """
+        Generate the answer. `callback(token_id, response)` can stop the generation by returning False.
+        `on_start()` is called, if the daemon acquired the model.
+        """
+        tokens = self._generate(
+            prompt, max_tokens=max_tokens, temp=temp, callback=callback, priority=priority, on_start=on_start
+        )
+        if streaming:
+            return tokens
+        return ''.join(tokens)
+
+    def _generate(
+        self, prompt: str, *, max_tokens: int, temp: float, callback, priority, on_start
+    ) -> Iterator[str]:
+        if self.scheduler is None:
+            yield from self._generate_tokens(
+                prompt, max_tokens=max_tokens, temp=temp, callback=callback, priority=priority, on_start=on_start
+            )
+            return
+
+        # The slot is held until the daemon finished or cancelled the generation:
+        with self.scheduler.slot(name=self.model_name, priority=priority) as n_threads:
+            yield from self._generate_tokens(
+                prompt,
+                max_tokens=max_tokens,
+                temp=temp,
+                callback=callback,
+                priority=priority,
+                on_start=on_start,
+                n_threads=n_threads,
+            )
+
+    def _generate_tokens(
+        self, prompt: str, *, max_tokens: int, temp: float, callback, priority, on_start, n_threads=None
+    ) -> Iterator[str]:
+        self.send(
+            {
+                'command': 'generate',
+                'prompt': prompt,
+                'max_tokens': max_tokens,
+                'temp': temp,
+                'priority': priority,
+                'n_threads': n_threads,
+            }
+        )
+
+        self.current_chat_session.append({'role': 'user', 'content': prompt})
+        answer = {'role': 'assistant', 'content': ''}
+        self.current_chat_session.append(answer)
+
+        finished = False
+        cancelled = False
+        token_id = 0
+        try:
+            while True:
+                message = self.recv()
+                event = message['event']
+                if event == 'start':
+                    if on_start:
+                        on_start()
+                elif event == 'token':
+                    if cancelled:
+                        continue  # Already sent before the daemon received the "cancel"
+                    text = message['text']
+                    if callback and not callback(token_id, text):
+                        cancelled = True
+                        self.send({'command': 'cancel'})
+                        continue
+                    token_id += 1
+                    answer['content'] += text
+                    yield text
+                elif event == 'done':
+                    finished = True
+                    answer['content'] = message['answer']  # Contains the tokens after a "cancel", too
+                    self.last_thread_count = message['thread_count']
+                    return
+                elif event == 'error':
+                    finished = True
+                    raise RemoteError(message['message'])
+        except RemoteError:
+            finished = True
+            raise
+        finally:
+            if not finished:
+                # Stopped by the consumer, e.g. KeyboardInterrupt:
+                self._cancel(answer)
+
+    def _cancel(self, answer: dict) -> None:
+        if self.connection is None:
+            return
+        try:
+            self.send({'command': 'cancel'})
+            while (message := self.recv())['event'] not in ('done', 'error'):
+                pass
+        except RemoteError:
+            pass
+        else:
+            if message['event'] == 'done':
+                answer['content'] = message['answer']
+
+    def append_answer(self, prompt: str, answer: str) -> None:
+        self.request('ok', command='append_answer', prompt=prompt, answer=answer)
+        self.current_chat_session.append({'role': 'user', 'content': prompt})
+        self.current_chat_session.append({'role': 'assistant', 'content': answer})
+
+    def save(self, *, session_id: str, messages: list | None = None, path: Path = SESSIONS_PATH) -> SessionSnapshot:
+        """
+        The daemon saves the session, with the model state, if possible.
+        """
+        self.request('saved', command='save', session_id=session_id, messages=messages)
+        return SessionSnapshot.load(session_id, path=path)
+
+    def restore(self, snapshot: SessionSnapshot) -> RestoreResult:
+        """
+        The daemon loads the saved session and restores the model state.
+        """
+        result = self.request('restored', command='restore', session_id=snapshot.session_id)['result']
+        self.current_chat_session = copy.deepcopy(snapshot.history)
+        return RestoreResult(**result)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        if self.on_close:
+            self.on_close()
+
+
+def get_status(socket_path: Path = DAEMON_SOCKET_PATH) -> dict | None:
+    """
+    The pid and the loaded models of the daemon, or None if it is not running.
+    """
+    if connection := connect(socket_path):
+        try:
+            connection.send({'command': 'status'})
+            return connection.recv()
+        finally:
+            connection.close()
+    return None
+
+
+def stop_daemon(socket_path: Path = DAEMON_SOCKET_PATH, *, timeout: float = 10) -> bool:
+    """
+    Returns False, if the daemon was not running.
+    """
+    if not (connection := connect(socket_path)):
+        return False
+    try:
+        connection.send({'command': 'shutdown'})
+        connection.recv()
+    finally:
+        connection.close()
+
+    end_time = time.monotonic() + timeout
+    while socket_path.exists() and time.monotonic() < end_time:
+        time.sleep(0.1)
+    return True
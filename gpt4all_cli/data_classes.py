@@ -1,37 +1,100 @@
+import collections
 import dataclasses
 import enum
-from datetime import datetime
+import threading
 
-from gpt4all import GPT4All
+from gpt4all_cli.daemon import RemoteChatContext
+from gpt4all_cli.instrumentation import GenerationStats
+from gpt4all_cli.model_pool import ChatContext
+from gpt4all_cli.scheduler import GenerationQueue
 
 
 class MessageTypeEnum(enum.StrEnum):
+    # Messages in the room history:
+    MESSAGE = enum.auto()
+    JOIN = enum.auto()
+    LEAVE = enum.auto()
+
+    # Events of a streamed GPT answer:
     WAIT = enum.auto()
     APPEND = enum.auto()
     COMPLETE = enum.auto()
 
 
 class RoomState(enum.StrEnum):
+    LOADING = enum.auto()  # The model is loading in the background
+    FAILED = enum.auto()  # Loading the model failed
     GPT_WRITES = enum.auto()
     FREE = enum.auto()
 
 
-@dataclasses.dataclass
+ENCODE_DEFAULTS = ('', '', 0.0)  # Default values of: text, user_name, timestamp
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
 class ChatMessage:
+    """
+    A message in the room history or an event of a streamed GPT answer.
+
+    `encode()` returns a compact JSON compatible list: Trailing default values are omitted.
+
+    >>> message = ChatMessage(id='abc', type=MessageTypeEnum.APPEND, text='Hello')
+    >>> message.encode()
+    ['abc', 'append', 'Hello']
+    >>> ChatMessage.decode(message.encode()) == message
+    True
+    >>> ChatMessage(id='abc', type=MessageTypeEnum.COMPLETE).encode()
+    ['abc', 'complete']
+    """
+
     id: str
     type: MessageTypeEnum
+    text: str = ''
+    user_name: str = ''
+    timestamp: float = 0.0  # Unix timestamp
+
+    def encode(self) -> list:
+        data = (self.id, self.type.value, self.text, self.user_name, self.timestamp)
+        end = len(data)
+        while end > 2 and data[end - 1] == ENCODE_DEFAULTS[end - 3]:
+            end -= 1
+        return list(data[:end])
 
-    dt: datetime | None = None
-    user_name: str | None = None
-    message: str | None = None
+    @classmethod
+    def decode(cls, data: list) -> 'ChatMessage':
+        message_id, type, *values = data
+        return cls(message_id, MessageTypeEnum(type), *values)
 
 
 @dataclasses.dataclass
 class RoomData:
     gpt_model_name: str
-    chat_session: GPT4All
+    back_log: int = 10  # Max. number of messages in the history
+    chat_session: ChatContext | RemoteChatContext | None = None
+    queue: GenerationQueue | None = None
 
     users: list[str] = dataclasses.field(default_factory=list)
-    logs: list = dataclasses.field(default_factory=list)
+    # The oldest messages are dropped, if the history is full:
+    logs: collections.deque[ChatMessage] = dataclasses.field(init=False)
+    # The prepared history for joining users: (key, lines), replaced as a whole by `get_history_lines()`
+    history_cache: tuple | None = dataclasses.field(default=None, repr=False)
 
     state: RoomState = RoomState.FREE
+    state_info: str = ''
+
+    last_stats: GenerationStats | None = None  # Timings of the last generation
+
+    # Closes the room, if nobody joined it (again). Cancelled by the next join:
+    close_timer: threading.Timer | None = dataclasses.field(default=None, repr=False)
+
+    def __post_init__(self):
+        self.logs = collections.deque(maxlen=self.back_log)
+
+    def close(self):
+        """
+        Release the shared model: It will be unloaded if no other room uses it.
+        """
+        if self.queue is not None:
+            self.queue.close()
+        if self.chat_session is not None:
+            self.chat_session.close()
@@ -1,27 +1,61 @@
-import time
-
-from bx_py_utils.humanize.time import human_timedelta
-from gpt4all import GPT4All, LLModel
 from rich import print  # noqa
 from rich.console import Console
 from rich.table import Table
 
+from gpt4all_cli.daemon import RemoteChatContext
+from gpt4all_cli.instrumentation import GenerationRecorder, GenerationStats, LogSink, StopReason
+from gpt4all_cli.model_pool import ChatContext, ModelPool
+from gpt4all_cli.prefix_cache import PrefixCache
+from gpt4all_cli.response_cache import ResponseCache, cached_generate
+from gpt4all_cli.scheduler import InferenceScheduler
+from gpt4all_cli.sessions import SessionSnapshot, new_session_id, restore_session, save_session
+
 
 class GptChat:
     """
     https://docs.gpt4all.io/gpt4all_python.html
     """
 
-    def __init__(self, *, initial_prompt: str, model_name: str, max_tokens: int, cpu_count: int, temperature: float):
-        self.console = Console()
+    def __init__(
+        self,
+        *,
+        initial_prompt: str,
+        model_name: str,
+        max_tokens: int,
+        cpu_count: int,
+        temperature: float,
+        model_pool: ModelPool | None = None,
+        console: Console | None = None,
+        stats_sinks: list | None = None,
+        snapshot: SessionSnapshot | None = None,
+        save_on_exit: bool = True,
+        prefix_cache: PrefixCache | None = None,
+        response_cache: ResponseCache | None = None,
+        daemon_connection=None,
+    ):
+        self.console = console or Console()
         self.console.print('\n')
 
         self.console.print(f'Use {model_name=}...')
-        gpt4all = GPT4All(model_name, n_threads=cpu_count, verbose=True)
-        model: LLModel = gpt4all.model
-        thread_count = model.thread_count()
+        self.chat_session: ChatContext | RemoteChatContext
+        if daemon_connection is not None:
+            self.console.print('Use the model daemon...')
+            if prefix_cache is not None:
+                self.console.print(
+                    '[yellow]The prefix cache is a setting of the daemon:'
+                    ' Start it with "daemon --prefix-cache" or use "chat --no-daemon"'
+                )
+            self.chat_session = RemoteChatContext(daemon_connection, model_name=model_name)
+        else:
+            if model_pool is None:
+                # The CLI runs only one generation at the same time, that can use the complete thread budget:
+                scheduler = InferenceScheduler(thread_budget=cpu_count, max_concurrent=1)
+                model_pool = ModelPool(scheduler=scheduler, prefix_cache=prefix_cache)
+            self.chat_session = model_pool.chat_context(model_name)
+        thread_count = self.chat_session.thread_count()
         self.console.print(f'Using {thread_count} threads...')
 
+        config = self.chat_session.config
         table = Table(title='GPT4All info')
         table.add_column('Parameter')
         table.add_column('Value')
@@ -29,39 +63,84 @@ class GptChat:
         table.add_row('Thread count', str(thread_count))
         table.add_row('Temperature', str(temperature))
         table.add_row('Max tokens', str(max_tokens))
-        table.add_row('System prompt', repr(gpt4all.config['systemPrompt']))
-        table.add_row('Prompt template', repr(gpt4all.config['promptTemplate']))
+        table.add_row('System prompt', repr(config['systemPrompt']))
+        table.add_row('Prompt template', repr(config['promptTemplate']))
         self.console.print(table)
 
-        self.generate_kwargs = dict(max_tokens=max_tokens, temp=temperature)
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.stats_sinks = [LogSink(), *(stats_sinks or [])]
 
-        self.chat_session = gpt4all.chat_session().__enter__()
+        self.response_cache = response_cache
+        self.save_on_exit = save_on_exit
+        if snapshot:
+            self.session_id = snapshot.session_id
+            self.restore(snapshot)
+        else:
+            self.session_id = new_session_id()
 
         if initial_prompt:
             self.ask(prompt=initial_prompt)
 
+    def restore(self, snapshot: SessionSnapshot) -> None:
+        for message in snapshot.history[1:]:
+            self.console.print(f'[bold]{message["role"]}:[/bold] {message["content"]}')
+        with self.console.status(f'Restore {snapshot.message_count} messages...'):
+            if isinstance(self.chat_session, RemoteChatContext):
+                result = self.chat_session.restore(snapshot)
+            else:
+                result = restore_session(self.chat_session, snapshot)
+        self.console.rule(result.summary())
+
+    def save(self) -> SessionSnapshot:
+        with self.console.status('Save session...'):
+            if isinstance(self.chat_session, RemoteChatContext):
+                snapshot = self.chat_session.save(session_id=self.session_id)
+            else:
+                snapshot = save_session(self.chat_session, session_id=self.session_id)
+        self.console.print(f'Session saved, continue it with: [bold]chat --resume {self.session_id}')
+        return snapshot
+
     def loop(self):
         while True:
             prompt = self.console.input('You: ')
             if not prompt:
                 self.console.print('\nBye!\n')
-                self.chat_session.__exit__(None, None, None)
+                if self.save_on_exit and len(self.chat_session.current_chat_session) > 1:
+                    self.save()
+                self.chat_session.close()
                 return
             self.ask(prompt=prompt)
 
-    def ask(self, *, prompt):
+    def ask(self, *, prompt) -> GenerationStats:
         self.console.rule(f'[bold red]{prompt}')
-        start_time = time.monotonic()
-
-        generator = self.chat_session.generate(prompt, streaming=True, **self.generate_kwargs)
+        recorder = GenerationRecorder(
+            name=self.model_name,
+            max_tokens=self.max_tokens,
+            sinks=self.stats_sinks,
+        )
+        generator = cached_generate(
+            self.chat_session,
+            prompt,
+            response_cache=self.response_cache,
+            max_tokens=self.max_tokens,
+            temp=self.temperature,
+            on_start=recorder.start,
+        )
 
+        stop_reason = None
         try:
             for token in generator:
+                recorder.token()
                 self.console.print(token, end='')
         except KeyboardInterrupt:
             self.console.print('...')
+            stop_reason = StopReason.CANCELLED
+            generator.close()
 
-        duration = time.monotonic() - start_time
+        stats = recorder.finish(stop_reason)
         self.console.print()
-        self.console.rule(f'Duration: {human_timedelta(duration)}')
+        self.console.rule(stats.summary())
         self.console.print()
+        return stats
@@ -0,0 +1,236 @@
+"""
+    Record timings of every generation and pass them to pluggable sinks
+"""
+import collections
+import dataclasses
+import enum
+import json
+import logging
+import threading
+import time
+from collections.abc import Callable, Iterable
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+
+# Upper bounds of the inter-token latency buckets in seconds:
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float('inf'))
+
+
+class StopReason(enum.StrEnum):
+    END = enum.auto()  # The model stopped the answer
+    LENGTH = enum.auto()  # max. tokens reached
+    CANCELLED = enum.auto()  # e.g.: The user left the room or pressed Ctrl-C
+    ERROR = enum.auto()
+
+
+class LatencyHistogram:
+    """
+    Count observations in fixed buckets.
+
+    >>> histogram = LatencyHistogram(buckets=(0.1, 1.0, float('inf')))
+    >>> for seconds in (0.05, 0.2, 0.3, 3):
+    ...     histogram.observe(seconds)
+    >>> histogram.counts
+    [1, 2, 1]
+    >>> histogram.count, round(histogram.sum, 2)
+    (4, 3.55)
+    >>> histogram.as_dict()
+    {'0.1': 1, '1.0': 2, 'inf': 1}
+    """
+
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        for index, upper_bound in enumerate(self.buckets):
+            if seconds <= upper_bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        assert self.buckets == other.buckets
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def as_dict(self) -> dict[str, int]:
+        return {str(upper_bound): count for upper_bound, count in zip(self.buckets, self.counts)}
+
+
+@dataclasses.dataclass
+class GenerationStats:
+    name: str
+    queue_wait: float  # seconds from submit until the generation started
+    ttft: float | None  # seconds from start until the first token
+    duration: float  # seconds from start until the end
+    tokens: int
+    stop_reason: StopReason
+    inter_token: LatencyHistogram
+
+    @property
+    def tokens_per_second(self) -> float:
+        if self.ttft is None or self.tokens < 2 or self.duration <= self.ttft:
+            return 0.0
+        # The first token belongs to the time to first token:
+        return (self.tokens - 1) / (self.duration - self.ttft)
+
+    def summary(self) -> str:
+        """
+        >>> GenerationStats(
+        ...     name='model', queue_wait=0.5, ttft=1.0, duration=3.0, tokens=21,
+        ...     stop_reason=StopReason.LENGTH, inter_token=LatencyHistogram(),
+        ... ).summary()
+        '21 tokens in 3.0 sec. (10.0 tokens/sec.), first token after 1.00 sec., waited 0.5 sec., stop: length'
+        """
+        parts = [f'{self.tokens} tokens in {self.duration:.1f} sec. ({self.tokens_per_second:.1f} tokens/sec.)']
+        if self.ttft is not None:
+            parts.append(f'first token after {self.ttft:.2f} sec.')
+        if self.queue_wait >= 0.05:
+            parts.append(f'waited {self.queue_wait:.1f} sec.')
+        parts.append(f'stop: {self.stop_reason}')
+        return ', '.join(parts)
+
+    def as_dict(self) -> dict:
+        return dict(
+            name=self.name,
+            queue_wait=self.queue_wait,
+            ttft=self.ttft,
+            duration=self.duration,
+            tokens=self.tokens,
+            tokens_per_second=self.tokens_per_second,
+            stop_reason=str(self.stop_reason),
+            inter_token=self.inter_token.as_dict(),
+        )
+
+
+class LogSink:
+    def __init__(self, level: int = logging.INFO):
+        self.level = level
+
+    def __call__(self, stats: GenerationStats) -> None:
+        logger.log(self.level, 'Generation %r: %s', stats.name, stats.summary())
+
+
+class JsonLinesSink:
+    """
+    Append every generation as one JSON line to a file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __call__(self, stats: GenerationStats) -> None:
+        line = json.dumps(stats.as_dict())
+        with self.lock, self.path.open('a') as f:
+            f.write(f'{line}\n')
+
+
+class MemorySink:
+    """
+    Aggregate all generations in memory and keep the last ones.
+    """
+
+    def __init__(self, keep_last: int = 10):
+        self.lock = threading.Lock()
+        self.generations = 0
+        self.tokens = 0
+        self.stop_reasons: collections.Counter[StopReason] = collections.Counter()
+        self.queue_wait = LatencyHistogram()
+        self.ttft = LatencyHistogram()
+        self.inter_token = LatencyHistogram()
+        self.last: collections.deque[GenerationStats] = collections.deque(maxlen=keep_last)
+
+    def __call__(self, stats: GenerationStats) -> None:
+        with self.lock:
+            self.generations += 1
+            self.tokens += stats.tokens
+            self.stop_reasons[stats.stop_reason] += 1
+            self.queue_wait.observe(stats.queue_wait)
+            if stats.ttft is not None:
+                self.ttft.observe(stats.ttft)
+            self.inter_token.merge(stats.inter_token)
+            self.last.append(stats)
+
+
+class GenerationRecorder:
+    """
+    Records the timings of one generation:
+
+        recorder = GenerationRecorder(name=..., max_tokens=..., sinks=[...])
+        generator = chat_context.generate(..., on_start=recorder.start)
+        for token in generator:
+            recorder.token()
+        stats = recorder.finish()
+
+    `queued_at` is the time (of `clock`) at which the generation was submitted, default: the creation time.
+    `start()` should be called, if the generation got the model, so the wait for the model lock
+    and the scheduler slot is counted as queue wait and not as time to first token.
+    """
+
+    def __init__(
+        self,
+        *,
+        name: str,
+        max_tokens: int,
+        sinks: Iterable[Callable[[GenerationStats], None]] = (),
+        queued_at: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.max_tokens = max_tokens
+        self.sinks = sinks
+        self.clock = clock
+
+        self.queued_at = self.clock() if queued_at is None else queued_at
+        self.start_time: float | None = None
+        self.first_token_time: float | None = None
+        self.last_token_time: float | None = None
+        self.tokens = 0
+        self.inter_token = LatencyHistogram()
+
+    def start(self) -> None:
+        self.start_time = self.clock()
+
+    def token(self) -> None:
+        now = self.clock()
+        if self.last_token_time is None:
+            self.first_token_time = now
+        else:
+            self.inter_token.observe(now - self.last_token_time)
+        self.last_token_time = now
+        self.tokens += 1
+
+    def finish(self, stop_reason: StopReason | None = None) -> GenerationStats:
+        """
+        Pass the stats to all sinks. Without `stop_reason` it is END or LENGTH.
+        """
+        if self.start_time is None:
+            self.start_time = self.clock()
+        if stop_reason is None:
+            stop_reason = StopReason.LENGTH if self.tokens >= self.max_tokens else StopReason.END
+
+        stats = GenerationStats(
+            name=self.name,
+            queue_wait=self.start_time - self.queued_at,
+            ttft=None if self.first_token_time is None else self.first_token_time - self.start_time,
+            duration=self.clock() - self.start_time,
+            tokens=self.tokens,
+            stop_reason=stop_reason,
+            inter_token=self.inter_token,
+        )
+        for sink in self.sinks:
+            try:
+                sink(stats)
+            except Exception:
+                logger.exception('Sink %r failed', sink)
+        return stats
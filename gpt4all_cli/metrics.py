@@ -0,0 +1,121 @@
+"""
+    Counters and the Prometheus text format for the /metrics route of the web UI
+"""
+import math
+import threading
+
+from gpt4all_cli.instrumentation import LatencyHistogram
+
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+# Upper bounds of the model load time buckets in seconds:
+LOAD_TIME_BUCKETS = (1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, float('inf'))
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        with self.lock:
+            self.value += amount
+
+
+class SynchronizedHistogram(LatencyHistogram):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self.lock:
+            super().observe(seconds)
+
+
+def format_value(value: float) -> str:
+    """
+    >>> format_value(1), format_value(0.5), format_value(float('inf'))
+    ('1', '0.5', '+Inf')
+    """
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(labels: dict[str, str] | None) -> str:
+    """
+    >>> format_labels({'room': 'a"b'})
+    '{room="a\\\\"b"}'
+    """
+    if not labels:
+        return ''
+    items = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        items.append(f'{key}="{value}"')
+    return '{' + ','.join(items) + '}'
+
+
+class MetricsWriter:
+    """
+    Build the Prometheus text exposition format.
+
+    >>> writer = MetricsWriter()
+    >>> writer.gauge('rooms', 'Number of rooms', 2)
+    >>> histogram = LatencyHistogram(buckets=(0.1, float('inf')))
+    >>> histogram.observe(0.05)
+    >>> writer.histogram('ttft_seconds', 'Time to first token', histogram)
+    >>> print(writer.text(), end='')
+    # HELP rooms Number of rooms
+    # TYPE rooms gauge
+    rooms 2
+    # HELP ttft_seconds Time to first token
+    # TYPE ttft_seconds histogram
+    ttft_seconds_bucket{le="0.1"} 1
+    ttft_seconds_bucket{le="+Inf"} 1
+    ttft_seconds_sum 0.05
+    ttft_seconds_count 1
+    """
+
+    def __init__(self, prefix: str = ''):
+        self.prefix = prefix
+        self.lines: list[str] = []
+
+    def _header(self, name: str, help: str, type: str) -> str:
+        name = f'{self.prefix}{name}'
+        self.lines.append(f'# HELP {name} {help}')
+        self.lines.append(f'# TYPE {name} {type}')
+        return name
+
+    def _samples(self, name: str, type: str, help: str, samples) -> None:
+        name = self._header(name, help, type)
+        if not isinstance(samples, dict):
+            samples = {(): samples}
+        for labels, value in samples.items():
+            self.lines.append(f'{name}{format_labels(dict(labels))} {format_value(value)}')
+
+    def counter(self, name: str, help: str, samples) -> None:
+        """
+        `samples` is a value or a dict of: tuple of (label, value) pairs -> value
+        """
+        self._samples(name, 'counter', help, samples)
+
+    def gauge(self, name: str, help: str, samples) -> None:
+        self._samples(name, 'gauge', help, samples)
+
+    def histogram(self, name: str, help: str, histogram: LatencyHistogram) -> None:
+        name = self._header(name, help, 'histogram')
+        # Copy the values, the histogram may be changed by other threads in the meantime:
+        counts, count, sum = list(histogram.counts), histogram.count, histogram.sum
+        cumulative = 0
+        for upper_bound, bucket_count in zip(histogram.buckets, counts):
+            cumulative += bucket_count
+            self.lines.append(f'{name}_bucket{format_labels({"le": format_value(upper_bound)})} {cumulative}')
+        self.lines.append(f'{name}_sum {format_value(sum)}')
+        self.lines.append(f'{name}_count {count}')
+
+    def text(self) -> str:
+        return '\n'.join(self.lines) + '\n'
@@ -0,0 +1,176 @@
+"""
+    Local cache of the GPT4All model catalogue (the list of downloadable models)
+"""
+import dataclasses
+import hashlib
+import json
+import logging
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from gpt4all_cli.constants import CACHE_PATH, MODEL_DIRECTORY
+
+
+logger = logging.getLogger(__name__)
+
+MODELS_URL = 'https://gpt4all.io/models/models2.json'  # Same as GPT4All.list_models()
+CATALOGUE_PATH = CACHE_PATH / 'models.json'
+CATALOGUE_TTL = 24 * 60 * 60  # seconds
+FETCH_TIMEOUT = 10  # seconds
+
+
+@dataclasses.dataclass
+class LocalModel:
+    filename: str
+    size: int  # bytes
+    md5sum: str
+    catalogue: dict | None = None  # The entry in the catalogue, if it exists
+
+    @property
+    def checksum_ok(self) -> bool | None:
+        """
+        None, if the catalogue has no checksum for this file
+        """
+        if not self.catalogue or not self.catalogue.get('md5sum'):
+            return None
+        return self.catalogue['md5sum'] == self.md5sum
+
+
+def get_md5sum(path: Path) -> str:
+    with path.open('rb') as f:
+        return hashlib.file_digest(f, 'md5').hexdigest()
+
+
+class ModelCatalogue:
+    """
+    The catalogue is fetched again, if it's older than `ttl` seconds: With a conditional request,
+    so an unchanged catalogue is not downloaded again. If fetching fails, the cached catalogue is used.
+    """
+
+    def __init__(
+        self,
+        *,
+        path: Path = CATALOGUE_PATH,
+        url: str = MODELS_URL,
+        ttl: float = CATALOGUE_TTL,
+        get: Callable | None = None,  # Default: requests.get
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.url = url
+        self.ttl = ttl
+        self.get = get
+        self.clock = clock
+
+        try:
+            self.data = json.loads(path.read_text())
+        except FileNotFoundError:
+            self.data = {}
+        except ValueError:
+            logger.warning('Ignore invalid catalogue cache: %s', path)
+            self.data = {}
+
+    @property
+    def models(self) -> list[dict]:
+        return self.data.get('models', [])
+
+    @property
+    def fetched(self) -> float | None:
+        return self.data.get('fetched')
+
+    def is_fresh(self) -> bool:
+        return self.fetched is not None and self.clock() - self.fetched < self.ttl
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.data))
+        tmp_path.replace(self.path)
+
+    def set_models(self, models: list[dict], *, etag: str | None = None, last_modified: str | None = None) -> None:
+        if not isinstance(models, list):
+            raise ValueError(f'The catalogue must be a list of models, not: {type(models).__name__}')
+        self.data.update(models=models, fetched=self.clock(), etag=etag, last_modified=last_modified)
+        self.save()
+
+    def refresh(self) -> bool:
+        """
+        Fetch the catalogue, if it was changed. Returns True, if a new catalogue was downloaded.
+        """
+        headers = {}
+        if self.models:
+            if etag := self.data.get('etag'):
+                headers['If-None-Match'] = etag
+            if last_modified := self.data.get('last_modified'):
+                headers['If-Modified-Since'] = last_modified
+
+        get = self.get
+        if get is None:
+            import requests  # Not needed, if the cache is fresh
+
+            get = requests.get
+        response = get(self.url, headers=headers, timeout=FETCH_TIMEOUT)
+        if response.status_code == 304:
+            logger.info('Model catalogue is not modified')
+            self.data['fetched'] = self.clock()
+            self.save()
+            return False
+        if response.status_code != 200:
+            raise ValueError(f'Request failed: HTTP {response.status_code} {response.reason}')
+
+        self.set_models(
+            response.json(),
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+        )
+        return True
+
+    def get_models(self, *, offline: bool = False, refresh: bool = False) -> list[dict]:
+        if offline or (self.is_fresh() and not refresh):
+            return self.models
+        try:
+            self.refresh()
+        except (OSError, ValueError) as err:  # requests.RequestException is an OSError
+            if not self.models:
+                raise
+            logger.warning('Fetching the model catalogue failed: %s (Use the cached catalogue)', err)
+        return self.models
+
+    def seed(self, source: Path) -> int:
+        """
+        Fill the cache from a file, e.g. a downloaded models2.json. Returns the number of models.
+        """
+        models = json.loads(source.read_text())
+        self.set_models(models)
+        return len(models)
+
+    def get_local_models(self, model_dir: Path = MODEL_DIRECTORY) -> list[LocalModel]:
+        """
+        All gguf files in `model_dir`. The checksums are cached, until the file is changed.
+        """
+        catalogue = {model.get('filename'): model for model in self.models}
+        old_checksums = self.data.get('checksums', {})
+        checksums = {}
+        local_models = []
+        for path in sorted(Path(model_dir).glob('*.gguf')):
+            stat = path.stat()
+            file_key = f'{path}:{stat.st_size}:{stat.st_mtime_ns}'
+            md5sum = old_checksums.get(file_key)
+            if md5sum is None:
+                logger.info('Calculate checksum of %s...', path)
+                md5sum = get_md5sum(path)
+            checksums[file_key] = md5sum
+            local_models.append(
+                LocalModel(
+                    filename=path.name,
+                    size=stat.st_size,
+                    md5sum=md5sum,
+                    catalogue=catalogue.get(path.name),
+                )
+            )
+
+        if checksums != old_checksums:
+            self.data['checksums'] = checksums
+            self.save()
+        return local_models
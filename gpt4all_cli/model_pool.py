@@ -0,0 +1,500 @@
+"""
+    Share loaded GPT4All models between chat rooms
+"""
+import collections
+import contextlib
+import logging
+import multiprocessing
+import os
+import threading
+from collections.abc import Callable, Iterator
+from typing import Protocol
+
+from gpt4all import GPT4All
+
+from gpt4all_cli.model_state import restore_model_state, save_model_state, supports_model_state
+from gpt4all_cli.prefix_cache import PrefixCache, get_prefix_key
+from gpt4all_cli.scheduler import InferenceScheduler, ModelWorker, Priority
+
+
+logger = logging.getLogger(__name__)
+
+
+def empty_response_callback(token_id: int, response: str) -> bool:
+    return True
+
+
+# Same defaults as GPT4All.generate():
+GENERATE_DEFAULTS = dict(
+    top_k=40,
+    top_p=0.4,
+    repeat_penalty=1.18,
+    repeat_last_n=64,
+    n_batch=8,
+)
+
+
+def format_chat_prompt(*, prompt_template: str, messages: list[dict], header: str = '') -> str:
+    """
+    Build the prompt for the model from chat messages, like GPT4All does in a chat session.
+
+    >>> format_chat_prompt(
+    ...     prompt_template='Q: {0}\\nA: ',
+    ...     messages=[
+    ...         {'role': 'user', 'content': 'Hi'},
+    ...         {'role': 'assistant', 'content': 'Hello!'},
+    ...         {'role': 'user', 'content': 'Bye'},
+    ...     ],
+    ...     header='Be nice.',
+    ... )
+    'Be nice.\\n\\nQ: Hi\\nA: Hello!\\nQ: Bye\\nA: '
+    """
+    full_prompt = f'{header}\n\n' if header else ''
+    for message in messages:
+        if message['role'] == 'user':
+            full_prompt += prompt_template.format(message['content'])
+        elif message['role'] == 'assistant':
+            full_prompt += f'{message["content"]}\n'
+    return full_prompt
+
+
+def get_model_size(gpt4all) -> int:
+    """
+    Size of the model file in bytes. The weights are mapped into RAM, so this is a good estimation
+    of the resident memory that a loaded model needs.
+    """
+    try:
+        return os.path.getsize(gpt4all.config['path'])
+    except (KeyError, OSError):
+        return 0
+
+
+def get_total_ram() -> int | None:
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class PooledModel:
+    """
+    A loaded GPT4All model that is shared by all chat contexts using the same model file.
+    """
+
+    def __init__(self, *, model_name: str, gpt4all: GPT4All):
+        self.model_name = model_name
+        self.gpt4all = gpt4all
+        self.size = get_model_size(gpt4all)
+
+        self.ref_count = 0
+
+        # The native model is not thread-safe and holds only one KV cache:
+        self.lock = threading.Lock()
+        self.active_context: ChatContext | None = None
+
+        # Runs the queued generations of all rooms that use this model:
+        self.worker = ModelWorker(name=model_name)
+
+    @property
+    def config(self) -> dict:
+        return self.gpt4all.config
+
+    @property
+    def model(self):
+        return self.gpt4all.model
+
+    def __repr__(self):
+        return f'<PooledModel {self.model_name} refs={self.ref_count} size={self.size}>'
+
+
+class ChatSession(Protocol):
+    """
+    The interface of a local `ChatContext` and a `RemoteChatContext` of the model daemon.
+    """
+
+    current_chat_session: list[dict]
+
+    @property
+    def config(self) -> dict: ...
+
+    @property
+    def model_name(self) -> str: ...
+
+    @property
+    def last_thread_count(self) -> int | None: ...
+
+    @property
+    def worker(self) -> ModelWorker | None: ...
+
+    def thread_count(self) -> int: ...
+
+    def generate(
+        self,
+        prompt: str,
+        *,
+        streaming=True,
+        max_tokens=200,
+        temp=0.7,
+        callback: Callable[[int, str], bool] | None = None,
+        priority: Priority = Priority.INTERACTIVE,
+        on_start: Callable[[], None] | None = None,
+    ) -> Iterator[str] | str: ...
+
+    def append_answer(self, prompt: str, answer: str) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class ChatContext:
+    """
+    A lightweight chat session on a shared model.
+
+    Can be used like the object from `GPT4All.chat_session()`: It has `generate()`, `config` and `model`.
+    Every chat context holds its own history. If the model was used by another context in the meantime,
+    the complete history is evaluated again, before the new answer is generated.
+
+    A `detached` context (e.g. for welcome messages) doesn't take over the model: The state of the active
+    context is saved before and restored after every generation, if the model supports it.
+    """
+
+    def __init__(self, *, pool: 'ModelPool', pooled_model: PooledModel, detached: bool = False):
+        self.pool = pool
+        self.pooled_model = pooled_model
+        self.detached = detached
+
+        config = pooled_model.config
+        self.prompt_template = config['promptTemplate']
+        self.current_chat_session: list[dict] = [{'role': 'system', 'content': config['systemPrompt']}]
+
+        self.last_thread_count: int | None = None  # Assigned by the scheduler
+        self.closed = False
+
+    @property
+    def config(self) -> dict:
+        return self.pooled_model.config
+
+    @property
+    def model(self):
+        return self.pooled_model.model
+
+    @property
+    def model_name(self) -> str:
+        return self.pooled_model.model_name
+
+    @property
+    def worker(self) -> ModelWorker:
+        return self.pooled_model.worker
+
+    def thread_count(self) -> int:
+        return self.last_thread_count or self.model.thread_count()
+
+    def generate(
+        self,
+        prompt: str,
+        *,
+        streaming=True,
+        max_tokens=200,
+        temp=0.7,
+        callback: Callable[[int, str], bool] | None = None,
+        priority: Priority = Priority.INTERACTIVE,
+        on_start: Callable[[], None] | None = None,
+        n_threads: int | None = None,
+    ) -> Iterator[str] | str:
+        """
+        Generate the answer. `callback(token_id, response)` can stop the generation by returning False.
+        `on_start()` is called, if the model lock and the scheduler slot are acquired.
+        With `n_threads` no scheduler slot is acquired: The thread count was granted by the caller.
+        """
+        tokens = self._generate(
+            prompt,
+            max_tokens=max_tokens,
+            temp=temp,
+            callback=callback,
+            priority=priority,
+            on_start=on_start,
+            n_threads=n_threads,
+        )
+        if streaming:
+            return tokens
+        return ''.join(tokens)
+
+    def _generate(
+        self, prompt: str, *, max_tokens: int, temp: float, callback, priority, on_start, n_threads
+    ) -> Iterator[str]:
+        assert not self.closed, 'Chat context is closed'
+
+        pooled_model = self.pooled_model
+        slot = self.pool.generation_slot(pooled_model, priority=priority, n_threads=n_threads)
+        with pooled_model.lock, slot as n_threads:
+            if on_start:
+                on_start()
+            self.last_thread_count = n_threads
+
+            previous_context = pooled_model.active_context
+            saved_state = None
+            if self.detached and previous_context not in (None, self):
+                saved_state = save_model_state(pooled_model.model)
+
+            reset_context = previous_context is not self
+            pooled_model.active_context = self
+
+            self.current_chat_session.append({'role': 'user', 'content': prompt})
+            if reset_context:
+                # The model evaluated another chat before (or nothing): Evaluate the complete history:
+                logger.debug('Reset model context: replay %i messages', len(self.current_chat_session))
+                full_prompt, reset_context = self._replay_prompt()
+            else:
+                full_prompt = format_chat_prompt(
+                    prompt_template=self.prompt_template,
+                    messages=self.current_chat_session[-1:],
+                )
+
+            answer = {'role': 'assistant', 'content': ''}
+            self.current_chat_session.append(answer)
+
+            cancelled = False
+
+            def keep_generating(token_id: int, response: str) -> bool:
+                if cancelled:
+                    return False
+                return callback is None or callback(token_id, response)
+
+            generator = pooled_model.model.prompt_model_streaming(
+                prompt=full_prompt,
+                callback=keep_generating,
+                n_predict=max_tokens,
+                temp=temp,
+                reset_context=reset_context,
+                **GENERATE_DEFAULTS,
+            )
+            try:
+                for token in generator:
+                    answer['content'] += token
+                    yield token
+            finally:
+                # Stopped by the consumer (e.g. KeyboardInterrupt): The prompt runs in an own thread of gpt4all.
+                # Cancel it and wait for its end, before the next generation can use the model:
+                cancelled = True
+                for token in generator:
+                    answer['content'] += token
+
+                if saved_state is not None and restore_model_state(pooled_model.model, saved_state):
+                    # The previous context continues without replaying its history:
+                    pooled_model.active_context = previous_context
+
+    def append_answer(self, prompt: str, answer: str) -> None:
+        """
+        Add a prompt with an answer, that was not generated by the model (e.g. a cached answer).
+        """
+        with self.pooled_model.lock:
+            self.current_chat_session.append({'role': 'user', 'content': prompt})
+            self.current_chat_session.append({'role': 'assistant', 'content': answer})
+            if self.pooled_model.active_context is self:
+                # The model must evaluate the complete history before the next answer:
+                self.pooled_model.active_context = None
+
+    def prefill(self, *, priority: Priority = Priority.BACKGROUND) -> None:
+        """
+        Evaluate the complete history, without generating an answer: The next answer starts without delay.
+        """
+        assert not self.closed, 'Chat context is closed'
+
+        pooled_model = self.pooled_model
+        with pooled_model.lock, self.pool.generation_slot(pooled_model, priority=priority) as n_threads:
+            self.last_thread_count = n_threads
+            pooled_model.active_context = self
+
+            logger.debug('Prefill %i messages', len(self.current_chat_session))
+            full_prompt, reset_context = self._replay_prompt()
+            for _ in pooled_model.model.prompt_model_streaming(
+                prompt=full_prompt,
+                callback=empty_response_callback,
+                n_predict=0,
+                temp=0.0,
+                reset_context=reset_context,
+                **GENERATE_DEFAULTS,
+            ):
+                pass
+
+    def _replay_prompt(self) -> tuple[str, bool]:
+        """
+        The prompt to evaluate the complete history and if the model context must be reset before.
+        Uses the prefix cache for the system prompt. Must be called with the model lock.
+        """
+        header = self.current_chat_session[0]['content']
+        model = self.pooled_model.model
+        prefix_cache = self.pool.prefix_cache
+        if prefix_cache is not None and header and supports_model_state(model):
+            key = get_prefix_key(
+                model_path=self.config.get('path', self.pooled_model.model_name),
+                system_prompt=header,
+                prompt_template=self.prompt_template,
+            )
+            prefix_cache.apply(
+                model,
+                key=key,
+                prefix=format_chat_prompt(prompt_template=self.prompt_template, messages=[], header=header),
+                callback=empty_response_callback,
+                temp=0.0,
+                **GENERATE_DEFAULTS,
+            )
+            # The model evaluated the system prompt, the rest follows without reset:
+            header = ''
+            reset_context = False
+        else:
+            reset_context = True
+
+        full_prompt = format_chat_prompt(
+            prompt_template=self.prompt_template,
+            messages=self.current_chat_session[1:],
+            header=header,
+        )
+        return full_prompt, reset_context
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self.pooled_model.active_context is self:
+            self.pooled_model.active_context = None
+        self.pool.release(self.pooled_model)
+
+
+class ModelPool:
+    """
+    Process-wide pool of loaded models: Every model file is loaded only once.
+
+    Rooms get a `ChatContext` via `chat_context()` and must `close()` it if the room is closed.
+    A model is unloaded if the last chat context is closed. If `keep_idle` is set, unused models
+    stay resident until the total size of all resident models exceeds `max_ram`.
+    The least recently used idle model is unloaded first.
+
+    If a `scheduler` is given, every generation waits for a free slot and uses the thread count
+    assigned by the scheduler.
+
+    With a `prefix_cache`, new chat contexts restore the state after the system prompt
+    instead of evaluating it again.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_ram: int | None = None,
+        keep_idle: bool = False,
+        scheduler: InferenceScheduler | None = None,
+        loader: Callable[..., GPT4All] = GPT4All,
+        prefix_cache: PrefixCache | None = None,
+        n_threads: int | None = None,  # Without a scheduler, default: all CPUs
+    ):
+        self.max_ram = max_ram
+        self.keep_idle = keep_idle
+        self.scheduler = scheduler
+        self.loader = loader
+        self.prefix_cache = prefix_cache
+
+        if scheduler:
+            self.n_threads = scheduler.fair_share
+        else:
+            self.n_threads = n_threads or multiprocessing.cpu_count()
+
+        self.models: collections.OrderedDict[str, PooledModel] = collections.OrderedDict()  # LRU first
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()  # Load only one model at the same time
+
+    @property
+    def resident_size(self) -> int:
+        return sum(pooled_model.size for pooled_model in self.models.values())
+
+    @contextlib.contextmanager
+    def generation_slot(
+        self, pooled_model: PooledModel, *, priority: Priority, n_threads: int | None = None
+    ) -> Iterator[int]:
+        if n_threads is not None:
+            # The caller holds a slot of another scheduler, e.g. the web server of the model worker processes
+            pooled_model.model.set_thread_count(n_threads)
+            yield n_threads
+            return
+
+        if self.scheduler is None:
+            yield pooled_model.model.thread_count()
+            return
+
+        with self.scheduler.slot(name=pooled_model.model_name, priority=priority) as n_threads:
+            pooled_model.model.set_thread_count(n_threads)
+            yield n_threads
+
+    def chat_context(self, model_name: str, *, allow_download: bool = True, detached: bool = False) -> ChatContext:
+        pooled_model = self.acquire(model_name, allow_download=allow_download)
+        return ChatContext(pool=self, pooled_model=pooled_model, detached=detached)
+
+    def resident_chat_context(self, model_name: str, *, detached: bool = False) -> ChatContext | None:
+        """
+        Create a chat context only if the model is already loaded.
+        """
+        with self.lock:
+            pooled_model = self._get(model_name)
+        if pooled_model is None:
+            return None
+        return ChatContext(pool=self, pooled_model=pooled_model, detached=detached)
+
+    def _get(self, model_name: str) -> PooledModel | None:
+        pooled_model = self.models.get(model_name)
+        if pooled_model is not None:
+            pooled_model.ref_count += 1
+            self.models.move_to_end(model_name)
+        return pooled_model
+
+    def acquire(self, model_name: str, *, allow_download: bool = True) -> PooledModel:
+        with self.lock:
+            if pooled_model := self._get(model_name):
+                return pooled_model
+
+        with self.load_lock:
+            with self.lock:
+                if pooled_model := self._get(model_name):
+                    # Was loaded by another thread in the meantime
+                    return pooled_model
+
+            logger.info('Load model %r with %i threads...', model_name, self.n_threads)
+            gpt4all = self.loader(model_name, n_threads=self.n_threads, verbose=True, allow_download=allow_download)
+            pooled_model = PooledModel(model_name=model_name, gpt4all=gpt4all)
+
+            with self.lock:
+                self.models[model_name] = pooled_model
+                pooled_model.ref_count += 1
+                self._evict()
+
+        logger.info('Model loaded: %r (resident models: %i bytes)', pooled_model, self.resident_size)
+        return pooled_model
+
+    def release(self, pooled_model: PooledModel) -> None:
+        with self.lock:
+            assert pooled_model.ref_count > 0, f'{pooled_model!r} is not in use'
+            pooled_model.ref_count -= 1
+            if pooled_model.ref_count == 0 and not self.keep_idle:
+                self._unload(pooled_model)
+            else:
+                self._evict()
+
+    def _unload(self, pooled_model: PooledModel) -> None:
+        logger.info('Unload model: %r', pooled_model)
+        del self.models[pooled_model.model_name]
+        pooled_model.gpt4all = None  # The native model will be freed by LLModel.__del__()
+        pooled_model.active_context = None
+
+    def _evict(self) -> None:
+        if self.max_ram is None:
+            return
+
+        while self.resident_size > self.max_ram:
+            for pooled_model in self.models.values():
+                if pooled_model.ref_count == 0:
+                    self._unload(pooled_model)
+                    break
+            else:
+                logger.warning(
+                    'Resident models need %i bytes, limit is %i bytes, but all models are in use!',
+                    self.resident_size,
+                    self.max_ram,
+                )
+                return
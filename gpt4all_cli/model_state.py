@@ -0,0 +1,100 @@
+"""
+    Save and restore the state of a loaded model, e.g. the KV cache, via the state API of libllmodel
+"""
+import ctypes
+import dataclasses
+import logging
+
+from gpt4all import LLModel
+from gpt4all.pyllmodel import llmodel
+
+
+logger = logging.getLogger(__name__)
+
+
+try:
+    llmodel.llmodel_get_state_size.argtypes = [ctypes.c_void_p]
+    llmodel.llmodel_get_state_size.restype = ctypes.c_uint64
+    llmodel.llmodel_save_state_data.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint8)]
+    llmodel.llmodel_save_state_data.restype = ctypes.c_uint64
+    llmodel.llmodel_restore_state_data.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint8)]
+    llmodel.llmodel_restore_state_data.restype = ctypes.c_uint64
+except AttributeError:
+    # The library has no state API
+    NATIVE_STATE = False
+else:
+    NATIVE_STATE = True
+
+
+@dataclasses.dataclass
+class ModelState:
+    """
+    The native model state and the prompt context, that is not part of it.
+    """
+
+    data: bytes
+    n_past: int
+    tokens: list[int]
+
+
+def supports_native_state(model) -> bool:
+    return NATIVE_STATE and isinstance(model, LLModel) and model.model is not None
+
+
+def supports_model_state(model) -> bool:
+    return hasattr(model, 'save_state') or supports_native_state(model)
+
+
+def save_model_state(model) -> ModelState | None:
+    """
+    Returns None, if the state can't be saved.
+    Models with own `save_state()` and `restore_state()` methods are supported, too. e.g.: FakeLLModel
+    """
+    if hasattr(model, 'save_state'):
+        return model.save_state()
+    if not supports_native_state(model) or model.context is None:
+        return None
+
+    size = llmodel.llmodel_get_state_size(model.model)
+    buffer = (ctypes.c_uint8 * size)()
+    written = llmodel.llmodel_save_state_data(model.model, buffer)
+    context = model.context
+    return ModelState(
+        data=ctypes.string_at(buffer, written),
+        n_past=context.n_past,
+        tokens=list(context.tokens[: context.tokens_size]),
+    )
+
+
+def restore_model_state(model, state: ModelState) -> bool:
+    if hasattr(model, 'restore_state'):
+        return model.restore_state(state)
+    if not supports_native_state(model):
+        return False
+
+    # The max. size of the state: Only the used part of the KV cache is saved, so the data is smaller.
+    size = llmodel.llmodel_get_state_size(model.model)
+    if len(state.data) > size:
+        # e.g.: Saved with another model or another context size
+        logger.warning('Can not restore model state: Size is %i bytes, max. %i bytes', len(state.data), size)
+        return False
+
+    buffer = (ctypes.c_uint8 * size)()
+    ctypes.memmove(buffer, state.data, len(state.data))
+    read = llmodel.llmodel_restore_state_data(model.model, buffer)
+    if read != len(state.data):
+        logger.warning('Restore model state failed: Read %i bytes of %i bytes', read, len(state.data))
+        return False
+
+    if model.context is None:
+        model._set_context()
+    context = model.context
+    assert context is not None
+
+    # The library copies the tokens into its own buffer on the next prompt:
+    tokens = (ctypes.c_int32 * len(state.tokens))(*state.tokens)
+    model.restored_tokens = tokens  # Keep the array alive until then
+    context.tokens = ctypes.cast(tokens, ctypes.POINTER(ctypes.c_int32))
+    context.tokens_size = len(state.tokens)
+    context.n_past = state.n_past
+    return True
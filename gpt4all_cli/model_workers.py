@@ -0,0 +1,322 @@
+"""
+    Run every model in an own worker process: A crash of the native library or a generation that holds
+    the GIL does not stall the web server. The worker processes use the protocol of the model daemon.
+"""
+import collections
+import logging
+import multiprocessing
+import multiprocessing.process
+import os
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from gpt4all import GPT4All
+
+from gpt4all_cli.constants import CACHE_PATH
+from gpt4all_cli.daemon import JsonConnection, ModelDaemon, RemoteChatContext, RemoteError, connect, get_status
+from gpt4all_cli.model_pool import ModelPool
+from gpt4all_cli.scheduler import InferenceScheduler, ModelWorker
+
+
+logger = logging.getLogger(__name__)
+
+WORKERS_PATH = CACHE_PATH / 'workers'  # The sockets of the worker processes
+SUPERVISE_INTERVAL = 1  # seconds
+RESTART_DELAY = 1  # seconds, doubled after every crash in a row
+MAX_RESTART_DELAY = 60  # seconds
+
+
+def run_worker(
+    *,
+    model_name: str,
+    socket_path: Path,
+    n_threads: int,
+    max_concurrent: int,
+    loader: Callable[..., GPT4All],
+    log_level: int,
+    ready,
+) -> None:
+    """
+    The target of the worker process: Load the model and serve the chat contexts until the parent stops us.
+    """
+    logging.basicConfig(level=log_level, format=f'%(levelname)s worker {os.getpid()}: %(message)s')
+    model_pool = ModelPool(
+        scheduler=InferenceScheduler(thread_budget=n_threads, max_concurrent=max_concurrent),
+        loader=loader,
+    )
+    with ModelDaemon(model_pool=model_pool, socket_path=socket_path) as server:
+        server.preload(model_name)
+        ready.set()
+        server.serve_forever()
+
+
+class WorkerProcess:
+    """
+    One model in a worker process. Restarted by the supervisor of the `WorkerPool`, if it crashes.
+    """
+
+    def __init__(self, *, pool: 'WorkerPool', model_name: str, socket_path: Path):
+        self.pool = pool
+        self.model_name = model_name
+        self.socket_path = socket_path
+
+        self.process: multiprocessing.process.BaseProcess | None = None
+        self.size = 0
+        self.ref_count = 0
+        self.crashes = 0  # In a row
+        self.restarts = 0
+        self.started = 0.0  # monotonic time
+        self.next_start = 0.0
+        self.lock = threading.Lock()  # Start and stop only once at the same time
+
+        # Runs the queued generations of all rooms that use this model:
+        self.worker = ModelWorker(name=model_name)
+
+    def __repr__(self):
+        pid = self.process.pid if self.process else None
+        return f'<WorkerProcess {self.model_name} {pid=} refs={self.ref_count} restarts={self.restarts}>'
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def start(self) -> None:
+        """
+        Start the process and wait until the model is loaded. Must be called with the lock.
+        """
+        context = multiprocessing.get_context('spawn')
+        ready = context.Event()
+        self.process = context.Process(
+            target=run_worker,
+            kwargs=dict(
+                model_name=self.model_name,
+                socket_path=self.socket_path,
+                n_threads=self.pool.n_threads,
+                max_concurrent=self.pool.max_concurrent,
+                loader=self.pool.loader,
+                log_level=logging.getLogger().getEffectiveLevel(),
+                ready=ready,
+            ),
+            name=f'model-worker-{self.model_name}',
+            daemon=True,
+        )
+        self.process.start()
+        logger.info('Started %r', self)
+        while not ready.wait(timeout=0.1):
+            if not self.process.is_alive():
+                raise RuntimeError(f'Worker of {self.model_name!r} exited with code {self.process.exitcode}')
+
+        status = get_status(self.socket_path)
+        self.size = status['sizes'].get(self.model_name, 0) if status else 0
+
+    def stop(self) -> None:
+        with self.lock:
+            if self.process is None:
+                return
+            logger.info('Stop %r', self)
+            self.process.terminate()
+            self.process.join(timeout=10)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+            self.process = None
+            self.socket_path.unlink(missing_ok=True)
+
+    def connect(self) -> JsonConnection:
+        """
+        Connect to the worker. Waits, if the worker is restarted.
+        """
+        with self.lock:
+            if not self.alive:
+                self.restart()
+            if connection := connect(self.socket_path):
+                return connection
+        raise RemoteError(f'Worker of {self.model_name!r} is not running')
+
+    def restart(self) -> None:
+        """
+        Start a new process after a crash. Must be called with the lock.
+        """
+        if self.process is not None:
+            self.crashes += 1
+            self.restarts += 1
+            self.pool.restarts += 1
+            logger.error('%r exited with code %s', self, self.process.exitcode)
+            self.process = None
+            self.socket_path.unlink(missing_ok=True)
+            delay = min(RESTART_DELAY * 2 ** (self.crashes - 1), MAX_RESTART_DELAY)
+            self.next_start = time.monotonic() + delay
+
+        if (delay := self.next_start - time.monotonic()) > 0:
+            logger.info('Restart %r in %.1f sec.', self.model_name, delay)
+            time.sleep(delay)
+        self.start()
+        self.started = self.next_start = time.monotonic()
+
+    def supervise(self) -> None:
+        if self.lock.locked():
+            return  # Is starting or stopping
+        with self.lock:
+            if self.process is None:
+                return
+            if self.alive:
+                if self.crashes and time.monotonic() - self.started > MAX_RESTART_DELAY:
+                    self.crashes = 0  # Runs stable again
+                return
+            try:
+                self.restart()
+            except Exception:
+                logger.exception('Restart of %r failed', self.model_name)
+
+
+class WorkerPool:
+    """
+    Like the `ModelPool`, but every model is loaded in an own worker process and the chat contexts
+    are `RemoteChatContext`s connected to it. A worker is stopped, if the last chat context is closed.
+    If `keep_idle` is set, unused workers keep running until the total size of all resident models
+    exceeds `max_ram`. The least recently used idle worker is stopped first.
+
+    A supervisor thread restarts crashed workers. The chat contexts reconnect and send their history
+    to the new worker, so the chats can be continued.
+
+    With a `scheduler` the generations of all workers share its thread budget: The chat contexts wait
+    for a slot and the worker uses the granted thread count instead of its own scheduler.
+    """
+
+    def __init__(
+        self,
+        *,
+        n_threads: int | None = None,
+        max_concurrent: int = 1,
+        max_ram: int | None = None,
+        keep_idle: bool = False,
+        scheduler: InferenceScheduler | None = None,
+        loader: Callable[..., GPT4All] = GPT4All,
+        path: Path = WORKERS_PATH,
+    ):
+        self.n_threads = n_threads or multiprocessing.cpu_count()  # Per worker process
+        self.max_concurrent = max_concurrent
+        self.max_ram = max_ram
+        self.keep_idle = keep_idle
+        self.scheduler = scheduler
+        self.loader = loader
+        self.path = path
+
+        self.models: collections.OrderedDict[str, WorkerProcess] = collections.OrderedDict()  # LRU first
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.restarts = 0  # Of all workers
+
+        self.stopped = threading.Event()
+        self.supervisor = threading.Thread(target=self.supervise, name='worker-supervisor', daemon=True)
+        self.supervisor.start()
+
+    @property
+    def resident_size(self) -> int:
+        return sum(worker_process.size for worker_process in self.models.values())
+
+    def supervise(self) -> None:
+        while not self.stopped.wait(SUPERVISE_INTERVAL):
+            with self.lock:
+                worker_processes = list(self.models.values())
+            for worker_process in worker_processes:
+                worker_process.supervise()
+
+    def acquire(self, model_name: str) -> WorkerProcess:
+        with self.lock:
+            worker_process = self.models.get(model_name)
+            if worker_process is None:
+                self.path.mkdir(parents=True, exist_ok=True)
+                # Short names: The path of a Unix socket has a length limit
+                socket_path = self.path / f'{os.getpid()}-{self.next_id}.sock'
+                self.next_id += 1
+                worker_process = WorkerProcess(pool=self, model_name=model_name, socket_path=socket_path)
+                self.models[model_name] = worker_process
+            else:
+                self.models.move_to_end(model_name)
+            worker_process.ref_count += 1
+        return worker_process
+
+    def release(self, worker_process: WorkerProcess) -> None:
+        with self.lock:
+            assert worker_process.ref_count > 0, f'{worker_process!r} is not in use'
+            worker_process.ref_count -= 1
+            if worker_process.ref_count:
+                return
+            if self.keep_idle:
+                evicted = self._evict()
+            else:
+                del self.models[worker_process.model_name]
+                evicted = [worker_process]
+        for evicted_process in evicted:
+            evicted_process.stop()
+
+    def _evict(self) -> list[WorkerProcess]:
+        """
+        Remove the least recently used idle workers until the resident models fit into `max_ram`.
+        Must be called with the lock, the caller stops the returned workers.
+        """
+        evicted: list[WorkerProcess] = []
+        if self.max_ram is None:
+            return evicted
+
+        while self.resident_size > self.max_ram:
+            for worker_process in self.models.values():
+                if worker_process.ref_count == 0:
+                    del self.models[worker_process.model_name]
+                    evicted.append(worker_process)
+                    break
+            else:
+                logger.warning(
+                    'Resident models need %i bytes, limit is %i bytes, but all workers are in use!',
+                    self.resident_size,
+                    self.max_ram,
+                )
+                break
+        return evicted
+
+    def chat_context(self, model_name: str, *, detached: bool = False) -> RemoteChatContext:
+        """
+        Blocks until the model is loaded in the worker process.
+        """
+        worker_process = self.acquire(model_name)
+        try:
+            chat_context = RemoteChatContext(
+                worker_process.connect(),
+                model_name=model_name,
+                reconnect=worker_process.connect,
+                worker=worker_process.worker,
+                on_close=lambda: self.release(worker_process),
+                scheduler=self.scheduler,
+                detached=detached,
+            )
+        except Exception:
+            self.release(worker_process)
+            raise
+
+        # The size of a model is known after the worker loaded it:
+        with self.lock:
+            evicted = self._evict()
+        for evicted_process in evicted:
+            evicted_process.stop()
+        return chat_context
+
+    def resident_chat_context(self, model_name: str, *, detached: bool = False) -> RemoteChatContext | None:
+        """
+        Create a chat context only if the worker is running.
+        """
+        with self.lock:
+            worker_process = self.models.get(model_name)
+            if worker_process is None or not worker_process.alive:
+                return None
+        return self.chat_context(model_name, detached=detached)
+
+    def close(self) -> None:
+        self.stopped.set()
+        with self.lock:
+            worker_processes = list(self.models.values())
+            self.models.clear()
+        for worker_process in worker_processes:
+            worker_process.stop()
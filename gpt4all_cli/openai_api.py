@@ -0,0 +1,426 @@
+"""
+    OpenAI compatible HTTP API: /v1/chat/completions and /v1/completions with SSE streaming
+
+    The views are plain aiohttp handlers, so they can be used as Lona "http pass through" routes
+    and share the loaded models with the chat rooms.
+"""
+import asyncio
+import dataclasses
+import json
+import logging
+import threading
+from collections.abc import AsyncIterator, Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from uuid import uuid4
+
+from aiohttp import web
+
+from gpt4all_cli.instrumentation import GenerationRecorder, GenerationStats, StopReason
+from gpt4all_cli.model_pool import ChatContext, ModelPool
+from gpt4all_cli.scheduler import Priority
+
+
+logger = logging.getLogger(__name__)
+
+API_MAX_CONCURRENT_REQUESTS = 4  # More requests at the same time get a "429 Too Many Requests"
+API_DEFAULT_MAX_TOKENS = 200
+API_MAX_TOKENS = 4096
+API_DEFAULT_TEMPERATURE = 0.7
+
+FINISH_REASONS = {
+    StopReason.END: 'stop',
+    StopReason.LENGTH: 'length',
+    StopReason.CANCELLED: 'stop',
+    StopReason.ERROR: 'stop',
+}
+
+_DONE = object()  # End of the token stream
+
+
+class ApiError(Exception):
+    def __init__(
+        self, message: str, *, status: int = 400, type: str = 'invalid_request_error', code: str | None = None
+    ):
+        super().__init__(message)
+        self.status = status
+        self.type = type
+        self.code = code
+
+    def as_dict(self) -> dict:
+        error = {'message': str(self), 'type': self.type}
+        if self.code:
+            error['code'] = self.code
+        return {'error': error}
+
+    def response(self) -> web.Response:
+        return web.json_response(self.as_dict(), status=self.status)
+
+
+class ModelNotFound(ApiError):
+    def __init__(self, model_name: str):
+        super().__init__(f'The model {model_name!r} is not served', status=404, code='model_not_found')
+
+
+def get_content(message: dict) -> str:
+    """
+    >>> get_content({'role': 'user', 'content': 'Hi'})
+    'Hi'
+    >>> get_content({'role': 'user', 'content': [{'type': 'text', 'text': 'Hi'}, {'type': 'text', 'text': 'there'}]})
+    'Hi\\nthere'
+    """
+    content = message.get('content') or ''
+    if isinstance(content, list):
+        content = '\n'.join(part.get('text', '') for part in content if part.get('type') == 'text')
+    if not isinstance(content, str):
+        raise ApiError(f'Invalid message content: {content!r}')
+    return content
+
+
+def get_number(data: dict, key: str, *, default, min_value, max_value, type=float):
+    """
+    >>> get_number({'max_tokens': 10}, 'max_tokens', default=1, min_value=1, max_value=100, type=int)
+    10
+    >>> get_number({}, 'temperature', default=0.7, min_value=0, max_value=2)
+    0.7
+    >>> get_number({'temperature': 3}, 'temperature', default=0.7, min_value=0, max_value=2)
+    Traceback (most recent call last):
+    ...
+    gpt4all_cli.openai_api.ApiError: "temperature" must be between 0 and 2
+    """
+    value = data.get(key)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not (min_value <= value <= max_value):
+        raise ApiError(f'"{key}" must be between {min_value} and {max_value}')
+    return type(value)
+
+
+@dataclasses.dataclass
+class CompletionRequest:
+    model: str
+    prompt: str
+    system_prompt: str | None = None  # None: Use the system prompt of the model
+    history: list[dict] = dataclasses.field(default_factory=list)
+    raw: bool = False  # Pass the prompt without the prompt template to the model
+    max_tokens: int = API_DEFAULT_MAX_TOKENS
+    temperature: float = API_DEFAULT_TEMPERATURE
+    stream: bool = False
+
+    @classmethod
+    def _from_data(cls, data, **kwargs) -> 'CompletionRequest':
+        model = data.get('model')
+        if not model or not isinstance(model, str):
+            raise ApiError('"model" is required')
+        return cls(
+            model=model,
+            max_tokens=get_number(
+                data, 'max_tokens', default=API_DEFAULT_MAX_TOKENS, min_value=1, max_value=API_MAX_TOKENS, type=int
+            ),
+            temperature=get_number(data, 'temperature', default=API_DEFAULT_TEMPERATURE, min_value=0, max_value=2),
+            stream=bool(data.get('stream', False)),
+            **kwargs,
+        )
+
+    @classmethod
+    def from_chat(cls, data: dict) -> 'CompletionRequest':
+        """
+        >>> CompletionRequest.from_chat({
+        ...     'model': 'a-model.gguf',
+        ...     'messages': [
+        ...         {'role': 'system', 'content': 'Be nice.'},
+        ...         {'role': 'user', 'content': 'Hi'},
+        ...         {'role': 'assistant', 'content': 'Hello!'},
+        ...         {'role': 'user', 'content': 'Bye'},
+        ...     ],
+        ...     'max_tokens': 10,
+        ... })
+        ... # doctest: +NORMALIZE_WHITESPACE
+        CompletionRequest(model='a-model.gguf', prompt='Bye', system_prompt='Be nice.',
+            history=[{'role': 'user', 'content': 'Hi'}, {'role': 'assistant', 'content': 'Hello!'}],
+            raw=False, max_tokens=10, temperature=0.7, stream=False)
+        """
+        messages = data.get('messages')
+        if not messages or not isinstance(messages, list):
+            raise ApiError('"messages" is required')
+
+        system_prompt = None
+        history = []
+        for message in messages[:-1]:
+            role = message.get('role')
+            if role == 'system':
+                system_prompt = get_content(message)
+            elif role in ('user', 'assistant'):
+                history.append({'role': role, 'content': get_content(message)})
+            else:
+                raise ApiError(f'Unsupported message role: {role!r}')
+
+        if messages[-1].get('role') != 'user':
+            raise ApiError('The last message must be a "user" message')
+
+        return cls._from_data(data, prompt=get_content(messages[-1]), system_prompt=system_prompt, history=history)
+
+    @classmethod
+    def from_completion(cls, data: dict) -> 'CompletionRequest':
+        """
+        >>> CompletionRequest.from_completion({'model': 'a-model.gguf', 'prompt': 'Once upon', 'stream': True})
+        ... # doctest: +NORMALIZE_WHITESPACE
+        CompletionRequest(model='a-model.gguf', prompt='Once upon', system_prompt='', history=[],
+            raw=True, max_tokens=200, temperature=0.7, stream=True)
+        """
+        prompt = data.get('prompt')
+        if isinstance(prompt, list) and len(prompt) == 1:
+            prompt = prompt[0]
+        if not isinstance(prompt, str):
+            raise ApiError('"prompt" must be a string')
+        return cls._from_data(data, prompt=prompt, system_prompt='', raw=True)
+
+
+def sse_event(data: dict | str) -> bytes:
+    """
+    >>> sse_event({'a': 1})
+    b'data: {"a": 1}\\n\\n'
+    >>> sse_event('[DONE]')
+    b'data: [DONE]\\n\\n'
+    """
+    if not isinstance(data, str):
+        data = json.dumps(data)
+    return f'data: {data}\n\n'.encode()
+
+
+class OpenAIApi:
+    """
+    Serve OpenAI compatible completions from the models of a ModelPool.
+
+    Only the models loaded with `preload()` are served, until `close()` is called:
+    Clients can't load (or download) other models, requests for them get a 404.
+    The generations run in a thread pool and are scheduled like the generations of the chat rooms.
+    """
+
+    def __init__(
+        self,
+        *,
+        model_pool: ModelPool,
+        stats_sinks: Iterable[Callable[[GenerationStats], None]] = (),
+        max_concurrent: int = API_MAX_CONCURRENT_REQUESTS,
+    ):
+        self.model_pool = model_pool
+        self.stats_sinks = stats_sinks
+        self.max_concurrent = max_concurrent
+        self.active_requests = 0  # Only changed in the event loop
+
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='openai_api')
+        self.resident: dict[str, ChatContext] = {}
+        self.lock = threading.Lock()
+
+    def add_routes(self, app) -> None:
+        """
+        Register the API views as "http pass through" routes of a Lona app.
+        """
+        app.route('/v1/models', name='api_models', http_pass_through=True)(self.models)
+        app.route('/v1/chat/completions', name='api_chat_completions', http_pass_through=True)(self.chat_completions)
+        app.route('/v1/completions', name='api_completions', http_pass_through=True)(self.completions)
+
+    def preload(self, model_name: str) -> None:
+        """
+        Load the model and hold it resident. Blocks until the model is loaded.
+        The model file must be downloaded already.
+        """
+        with self.lock:
+            if model_name not in self.resident:
+                self.resident[model_name] = self.model_pool.chat_context(model_name, allow_download=False)
+
+    def check_model(self, model_name: str) -> None:
+        with self.lock:
+            served = model_name in self.resident
+        if not served:
+            raise ModelNotFound(model_name)
+
+    def chat_context(self, model_name: str) -> ChatContext:
+        """
+        A new chat context of a served model. Never loads a model.
+        """
+        with self.lock:
+            if model_name not in self.resident:
+                raise ModelNotFound(model_name)  # e.g.: close() was called in the meantime
+            chat_context = self.model_pool.resident_chat_context(model_name)
+        assert chat_context is not None, f'{model_name!r} is resident'
+        return chat_context
+
+    def close(self) -> None:
+        with self.lock:
+            for chat_context in self.resident.values():
+                chat_context.close()
+            self.resident.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def models(self, request: web.Request) -> web.Response:
+        with self.lock:
+            model_names = list(self.resident)
+        return web.json_response(
+            {
+                'object': 'list',
+                'data': [{'id': name, 'object': 'model', 'owned_by': 'gpt4all'} for name in model_names],
+            }
+        )
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        return await self.handle(request, parse=CompletionRequest.from_chat, chat=True)
+
+    async def completions(self, request: web.Request) -> web.StreamResponse:
+        return await self.handle(request, parse=CompletionRequest.from_completion, chat=False)
+
+    async def handle(self, request: web.Request, *, parse, chat: bool) -> web.StreamResponse:
+        if request.method != 'POST':
+            return ApiError('Only POST requests are allowed', status=405).response()
+        if self.active_requests >= self.max_concurrent:
+            return ApiError('Too many requests, try again later', status=429, type='rate_limit_error').response()
+
+        self.active_requests += 1
+        try:
+            try:
+                data = await request.json()
+                if not isinstance(data, dict):
+                    raise ApiError('The request body must be a JSON object')
+                completion_request = parse(data)
+            except json.JSONDecodeError as err:
+                raise ApiError(f'Invalid JSON: {err}') from err
+            self.check_model(completion_request.model)
+
+            if completion_request.stream:
+                return await self.stream_response(request, completion_request, chat=chat)
+            return await self.json_response(completion_request, chat=chat)
+        except ApiError as err:
+            return err.response()
+        finally:
+            self.active_requests -= 1
+
+    def generate(self, completion_request: CompletionRequest, *, put: Callable, stop: threading.Event):
+        """
+        Runs in the thread pool: Pass every token to `put()` and returns the GenerationStats.
+        """
+        chat_context = self.chat_context(completion_request.model)
+        try:
+            if completion_request.raw:
+                chat_context.prompt_template = '{0}'
+            if completion_request.system_prompt is not None:
+                chat_context.current_chat_session[0]['content'] = completion_request.system_prompt
+            chat_context.current_chat_session.extend(completion_request.history)
+
+            recorder = GenerationRecorder(
+                name=completion_request.model,
+                max_tokens=completion_request.max_tokens,
+                sinks=self.stats_sinks,
+            )
+            try:
+                for token in chat_context.generate(
+                    completion_request.prompt,
+                    streaming=True,
+                    max_tokens=completion_request.max_tokens,
+                    temp=completion_request.temperature,
+                    callback=lambda token_id, response: not stop.is_set(),
+                    priority=Priority.INTERACTIVE,
+                    on_start=recorder.start,
+                ):
+                    recorder.token()
+                    put(token)
+            except Exception:
+                recorder.finish(StopReason.ERROR)
+                raise
+            return recorder.finish(StopReason.CANCELLED if stop.is_set() else None)
+        finally:
+            chat_context.close()
+
+    async def iter_tokens(self, completion_request: CompletionRequest, stats: list) -> AsyncIterator[str]:
+        """
+        Run the generation in the thread pool and yield the tokens in the event loop.
+        The GenerationStats are appended to `stats`. Stops the generation, if the iteration is aborted.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+
+        def put(item) -> None:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        def run() -> None:
+            try:
+                stats.append(self.generate(completion_request, put=put, stop=stop))
+            except Exception as err:
+                logger.exception('Generation with %r failed', completion_request.model)
+                put(err)
+            finally:
+                put(_DONE)
+
+        future = loop.run_in_executor(self.executor, run)
+        try:
+            while (item := await queue.get()) is not _DONE:
+                if isinstance(item, Exception):
+                    raise ApiError(f'Generation failed: {item}', status=500, type='server_error')
+                yield item
+            await future
+        finally:
+            stop.set()  # e.g.: The client closed the connection
+
+    def response_data(self, completion_request: CompletionRequest, *, chat: bool, stream: bool) -> dict:
+        if chat:
+            prefix = 'chatcmpl'
+            object = 'chat.completion.chunk' if stream else 'chat.completion'
+        else:
+            prefix = 'cmpl'
+            object = 'text_completion'
+        return {
+            'id': f'{prefix}-{uuid4().hex}',
+            'object': object,
+            'created': int(time()),
+            'model': completion_request.model,
+        }
+
+    async def json_response(self, completion_request: CompletionRequest, *, chat: bool) -> web.Response:
+        stats: list[GenerationStats] = []
+        text = ''.join([token async for token in self.iter_tokens(completion_request, stats)])
+        finish_reason = FINISH_REASONS[stats[0].stop_reason]
+
+        data = self.response_data(completion_request, chat=chat, stream=False)
+        if chat:
+            choice = {'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': finish_reason}
+        else:
+            choice = {'index': 0, 'text': text, 'logprobs': None, 'finish_reason': finish_reason}
+        data['choices'] = [choice]
+        data['usage'] = {'completion_tokens': stats[0].tokens}
+        return web.json_response(data)
+
+    async def stream_response(
+        self, request: web.Request, completion_request: CompletionRequest, *, chat: bool
+    ) -> web.StreamResponse:
+        # No "Connection: close": The connection can be reused by the client after the last event.
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+
+        data = self.response_data(completion_request, chat=chat, stream=True)
+
+        def chunk(*, token: str | None = None, finish_reason: str | None = None) -> bytes:
+            if chat:
+                if token is None:
+                    delta = {} if finish_reason else {'role': 'assistant'}
+                else:
+                    delta = {'content': token}
+                choice = {'index': 0, 'delta': delta, 'finish_reason': finish_reason}
+            else:
+                choice = {'index': 0, 'text': token or '', 'logprobs': None, 'finish_reason': finish_reason}
+            return sse_event({**data, 'choices': [choice]})
+
+        stats: list[GenerationStats] = []
+        try:
+            if chat:
+                await response.write(chunk())
+            async for token in self.iter_tokens(completion_request, stats):
+                await response.write(chunk(token=token))
+        except ApiError as err:
+            # The status code was already sent:
+            await response.write(sse_event(err.as_dict()))
+        else:
+            await response.write(chunk(finish_reason=FINISH_REASONS[stats[0].stop_reason]))
+        await response.write(sse_event('[DONE]'))
+        await response.write_eof()
+        return response
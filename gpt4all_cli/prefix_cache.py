@@ -0,0 +1,129 @@
+"""
+    Cache the model state after the evaluation of the system prompt
+"""
+import collections
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+from gpt4all_cli.model_state import ModelState, restore_model_state, save_model_state
+
+
+logger = logging.getLogger(__name__)
+
+PREFIX_CACHE_SIZE = 4  # Max. number of prefix states in memory
+
+
+def get_prefix_key(*, model_path: str, system_prompt: str, prompt_template: str) -> str:
+    """
+    >>> get_prefix_key(model_path='/models/a.gguf', system_prompt='Be nice.', prompt_template='Q: {0}')
+    'f79954ff9baabd98ed1a7b61fad4538b4c621f104e3968a55248543b43c7661c'
+    """
+    try:
+        stat = os.stat(model_path)
+    except OSError:
+        file_info = None
+    else:
+        # A changed model file must not use the old states:
+        file_info = [stat.st_size, stat.st_mtime_ns]
+    data = json.dumps([model_path, file_info, system_prompt, prompt_template])
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def encode_state(state: ModelState) -> bytes:
+    """
+    >>> encode_state(ModelState(data=b'abc', n_past=2, tokens=[1, 2]))
+    b'{"n_past": 2, "tokens": [1, 2]}\\nabc'
+    >>> decode_state(_)
+    ModelState(data=b'abc', n_past=2, tokens=[1, 2])
+    """
+    header = json.dumps({'n_past': state.n_past, 'tokens': state.tokens})
+    return header.encode() + b'\n' + state.data
+
+
+def decode_state(content: bytes) -> ModelState:
+    header, data = content.split(b'\n', 1)
+    return ModelState(data=data, **json.loads(header))
+
+
+class PrefixCache:
+    """
+    LRU cache of model states after the evaluation of a system prompt.
+
+    A new chat session restores the state instead of evaluating the system prompt again.
+    With a `path` the states are stored on disk, too, so other processes can use them.
+    """
+
+    def __init__(self, *, max_entries: int = PREFIX_CACHE_SIZE, path: Path | None = None):
+        self.max_entries = max_entries
+        self.path = path
+
+        self.states: collections.OrderedDict[str, ModelState] = collections.OrderedDict()  # LRU first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_file_path(self, key: str) -> Path:
+        assert self.path is not None, 'Prefix cache without a path'
+        return self.path / f'{key}.prefix'
+
+    def get(self, key: str) -> ModelState | None:
+        with self.lock:
+            state = self.states.get(key)
+            if state is not None:
+                self.states.move_to_end(key)
+                return state
+
+        if self.path is None:
+            return None
+        try:
+            state = decode_state(self.get_file_path(key).read_bytes())
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.exception('Loading the prefix state %s failed', key)
+            return None
+
+        self._put_memory(key, state)
+        return state
+
+    def _put_memory(self, key: str, state: ModelState) -> None:
+        with self.lock:
+            self.states[key] = state
+            self.states.move_to_end(key)
+            while len(self.states) > self.max_entries:
+                self.states.popitem(last=False)
+
+    def put(self, key: str, state: ModelState) -> None:
+        self._put_memory(key, state)
+        if self.path is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            file_path = self.get_file_path(key)
+            tmp_path = file_path.with_suffix('.tmp')
+            tmp_path.write_bytes(encode_state(state))
+            tmp_path.replace(file_path)
+
+    def apply(self, model, *, key: str, prefix: str, **prompt_kwargs) -> bool:
+        """
+        Bring the model into the state after the evaluation of `prefix`: Restore the cached state
+        or evaluate the prefix and cache the state. Returns True on a cache hit.
+        Must be called with the model lock.
+        """
+        state = self.get(key)
+        hit = state is not None and restore_model_state(model, state)
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if hit:
+            return True
+
+        for _ in model.prompt_model_streaming(prompt=prefix, n_predict=0, reset_context=True, **prompt_kwargs):
+            pass
+        if state := save_model_state(model):
+            self.put(key, state)
+        return False
@@ -0,0 +1,180 @@
+"""
+    Opt-in cache for complete answers: An identical prompt with identical history, model
+    and generation arguments gets the cached answer, replayed as token stream.
+
+    Only deterministic answers (temp=0) are cached: A sampled answer would be replayed forever,
+    as if it was the only possible one. Use `ResponseCache(cache_sampled=True)` to cache them anyway.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections.abc import Callable, Generator
+from pathlib import Path
+
+from gpt4all_cli.constants import RESPONSE_CACHE_PATH
+from gpt4all_cli.model_pool import ChatSession
+
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_MAX_ENTRIES = 10_000
+RESPONSE_CACHE_TTL = 7 * 24 * 60 * 60  # seconds
+
+
+def get_response_key(*, model_name: str, history: list[dict], prompt: str, generate_kwargs: dict) -> str:
+    """
+    >>> key = get_response_key(
+    ...     model_name='a.gguf', history=[{'role': 'system', 'content': ''}], prompt='Hi',
+    ...     generate_kwargs={'max_tokens': 10, 'temp': 0.0},
+    ... )
+    >>> key == get_response_key(
+    ...     model_name='a.gguf', history=[{'role': 'system', 'content': ''}], prompt='Hi',
+    ...     generate_kwargs={'temp': 0.0, 'max_tokens': 10},
+    ... )
+    True
+    >>> key == get_response_key(
+    ...     model_name='a.gguf', history=[{'role': 'system', 'content': ''}], prompt='Hi',
+    ...     generate_kwargs={'max_tokens': 10, 'temp': 0.5},
+    ... )
+    False
+    """
+    data = json.dumps([model_name, history, prompt, generate_kwargs], sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Size-bounded SQLite store of answers: Entries expire after `ttl` seconds and the least
+    recently used entries are removed, if there are more than `max_entries`.
+    Can be used by many threads and processes.
+    With `cache_sampled` answers with a temperature > 0 are cached, too.
+    """
+
+    def __init__(
+        self,
+        *,
+        path: Path | str = RESPONSE_CACHE_PATH,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        ttl: float = RESPONSE_CACHE_TTL,
+        clock: Callable[[], float] = time.time,
+        cache_sampled: bool = False,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.cache_sampled = cache_sampled
+
+        if path != ':memory:':
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses'
+            ' (key TEXT PRIMARY KEY, tokens TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> list[str] | None:
+        now = self.clock()
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT tokens FROM responses WHERE key = ? AND created > ?',
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute('UPDATE responses SET last_used = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+
+    def put(self, key: str, tokens: list[str]) -> None:
+        now = self.clock()
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO responses (key, tokens, created, last_used) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(tokens), now, now),
+            )
+            self.connection.execute('DELETE FROM responses WHERE created <= ?', (now - self.ttl,))
+            self.connection.execute(
+                'DELETE FROM responses WHERE key IN'
+                ' (SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,),
+            )
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+def cached_generate(
+    chat_context: ChatSession,
+    prompt: str,
+    *,
+    response_cache: ResponseCache | None,
+    max_tokens: int = 200,
+    temp: float = 0.7,
+    callback: Callable[[int, str], bool] | None = None,
+    on_start: Callable[[], None] | None = None,
+    **kwargs,
+) -> Generator[str, None, None]:
+    """
+    Like `chat_context.generate(prompt, streaming=True, ...)`, but a cached answer is replayed.
+    Only complete answers are stored: Not cancelled and without errors.
+    """
+    if response_cache is None or (temp != 0 and not response_cache.cache_sampled):
+        yield from chat_context.generate(
+            prompt, streaming=True, max_tokens=max_tokens, temp=temp, callback=callback, on_start=on_start, **kwargs
+        )
+        return
+
+    key = get_response_key(
+        model_name=chat_context.model_name,
+        history=chat_context.current_chat_session,
+        prompt=prompt,
+        generate_kwargs={'max_tokens': max_tokens, 'temp': temp},
+    )
+    tokens = response_cache.get(key)
+    if tokens is not None:
+        logger.debug('Response cache hit: %s', key)
+        if on_start:
+            on_start()
+        replayed = []
+        try:
+            for token_id, token in enumerate(tokens):
+                if callback and not callback(token_id, token):
+                    return
+                replayed.append(token)
+                yield token
+        finally:
+            # The history contains only the tokens that the consumer got:
+            chat_context.append_answer(prompt, ''.join(replayed))
+        return
+
+    cancelled = False
+
+    def keep_generating(token_id: int, response: str) -> bool:
+        nonlocal cancelled
+        if callback is None or callback(token_id, response):
+            return True
+        cancelled = True
+        return False
+
+    tokens = []
+    for token in chat_context.generate(
+        prompt, streaming=True, max_tokens=max_tokens, temp=temp, callback=keep_generating, on_start=on_start, **kwargs
+    ):
+        tokens.append(token)
+        yield token
+
+    if not cancelled:
+        response_cache.put(key, tokens)
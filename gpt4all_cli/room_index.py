@@ -0,0 +1,108 @@
+import dataclasses
+import threading
+import time
+from collections.abc import Callable
+
+from gpt4all_cli.data_classes import RoomData
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class RoomRow:
+    """
+    A room, as listed in the lobby.
+    """
+
+    gpt_model_name: str
+    state: str
+    user_count: int
+
+
+def get_room_rows(rooms: dict[str, RoomData]) -> dict[str, RoomRow]:
+    return {
+        room_name: RoomRow(
+            gpt_model_name=room_data.gpt_model_name,
+            state=str(room_data.state),
+            user_count=len(room_data.users),
+        )
+        for room_name, room_data in list(rooms.items())  # The rooms are changed by other threads
+    }
+
+
+def diff_rooms(old: dict[str, RoomRow], new: dict[str, RoomRow]) -> dict[str, RoomRow | None]:
+    """
+    Returns the new and changed rooms and None for removed rooms.
+
+    >>> old = {'a': RoomRow('m', 'free', 1), 'b': RoomRow('m', 'free', 0)}
+    >>> new = {'a': RoomRow('m', 'free', 2), 'b': RoomRow('m', 'free', 0), 'c': RoomRow('m', 'loading', 0)}
+    >>> diff_rooms(old, new)  # doctest: +NORMALIZE_WHITESPACE
+    {'a': RoomRow(gpt_model_name='m', state='free', user_count=2),
+     'c': RoomRow(gpt_model_name='m', state='loading', user_count=0)}
+    >>> diff_rooms(new, {'c': new['c']})
+    {'a': None, 'b': None}
+    >>> diff_rooms(new, new)
+    {}
+    """
+    changes: dict[str, RoomRow | None] = {name: None for name in old.keys() - new.keys()}
+    for name, row in new.items():
+        if old.get(name) != row:
+            changes[name] = row
+    return dict(sorted(changes.items()))
+
+
+class RoomIndex:
+    """
+    Send the changes of the room list as diffs to `send_func`.
+
+    Call `touch()` after every change of a room: A new or closed room, a changed state or user count.
+    All changes within `interval` seconds are merged into one diff, so the lobby is not updated on
+    every change and rooms that changed back and forth are not sent at all.
+    """
+
+    def __init__(
+        self,
+        *,
+        send_func: Callable[[dict[str, RoomRow | None]], None],
+        interval: float,
+        clock: Callable[[], float] = time.monotonic,
+        timer_factory: Callable[..., threading.Timer] = threading.Timer,
+    ):
+        self.send_func = send_func
+        self.interval = interval
+        self.clock = clock
+        self.timer_factory = timer_factory
+
+        self.rows: dict[str, RoomRow] = {}  # As last sent
+        self.rooms: dict[str, RoomData] | None = None
+        self.timer: threading.Timer | None = None
+        self.last_publish: float | None = None
+        self.lock = threading.Lock()
+
+        self.touch_count = 0
+        self.publish_count = 0
+
+    def touch(self, rooms: dict[str, RoomData]) -> None:
+        with self.lock:
+            self.rooms = rooms
+            self.touch_count += 1
+            if self.timer is not None:
+                return  # Will be published with the pending diff
+
+            if self.last_publish is None:
+                delay = 0.0
+            else:
+                delay = max(0.0, self.last_publish + self.interval - self.clock())
+            self.timer = self.timer_factory(delay, self.publish)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def publish(self) -> None:
+        with self.lock:
+            self.timer = None
+            self.last_publish = self.clock()
+            rows = get_room_rows(self.rooms or {})
+            changes = diff_rooms(self.rows, rows)
+            self.rows = rows
+            if changes:
+                self.publish_count += 1
+        if changes:
+            self.send_func(changes)
@@ -0,0 +1,275 @@
+"""
+    Queue and schedule GPT generations
+"""
+import collections
+import contextlib
+import enum
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections.abc import Callable, Iterator
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class GenerationJob:
+    """
+    A queued generation: `func(job)` is called in the model worker thread.
+    """
+
+    def __init__(self, *, func: Callable[['GenerationJob'], None], owner: str | None = None, name: str = ''):
+        self.func = func
+        self.owner = owner
+        self.name = name
+        self.cancelled = False
+        self.created = time.monotonic()  # To measure the time in the queue
+
+    def __repr__(self):
+        return f'<GenerationJob {self.name!r} owner={self.owner!r} cancelled={self.cancelled}>'
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+    def keep_generating(self, token_id: int, response: str) -> bool:
+        """
+        Callback for generate(): Stop the generation, if the job was cancelled.
+        """
+        return not self.cancelled
+
+
+class GenerationQueue:
+    """
+    FIFO queue of the generation jobs of one room.
+
+    `on_change` is called with the waiting jobs, every time the queue changed.
+    """
+
+    def __init__(
+        self,
+        *,
+        worker: 'ModelWorker',
+        max_depth: int,
+        on_change: Callable[[list[GenerationJob]], None] | None = None,
+    ):
+        self.worker = worker
+        self.max_depth = max_depth
+        self.on_change = on_change
+
+        self.jobs: collections.deque[GenerationJob] = collections.deque()
+        worker.add_queue(self)
+
+    def is_full(self) -> bool:
+        return len(self.jobs) >= self.max_depth
+
+    def submit(self, job: GenerationJob) -> int:
+        """
+        Add the job to the queue and return its position (1 == next job)
+        """
+        with self.worker.condition:
+            if self.is_full():
+                raise QueueFullError(f'{len(self.jobs)} prompts are waiting, please try again later.')
+            self.jobs.append(job)
+            position = len(self.jobs)
+            self.worker.condition.notify()
+
+        logger.debug('Queued %r at position %i', job, position)
+        self.changed()
+        return position
+
+    def cancel(self, *, owner: str) -> None:
+        """
+        Remove all waiting jobs of the owner and cancel its running job.
+        """
+        with self.worker.condition:
+            cancelled = [job for job in self.jobs if job.owner == owner]
+            for job in cancelled:
+                self.jobs.remove(job)
+
+            current_job = self.worker.current_job
+            if current_job and current_job.owner == owner and self.worker.current_queue is self:
+                cancelled.append(current_job)
+
+        for job in cancelled:
+            logger.info('Cancel %r', job)
+            job.cancel()
+
+        if cancelled:
+            self.changed()
+
+    def changed(self) -> None:
+        if self.on_change:
+            self.on_change(list(self.jobs))
+
+    def close(self) -> None:
+        with self.worker.condition:
+            for job in self.jobs:
+                job.cancel()
+            self.jobs.clear()
+        self.worker.remove_queue(self)
+
+
+class ModelWorker:
+    """
+    Runs the jobs of all queues of one model in a single thread, because a model can't generate
+    two answers at the same time. The queues are served round-robin, so a busy room can't block
+    the other rooms.
+    """
+
+    def __init__(self, *, name: str):
+        self.name = name
+
+        self.condition = threading.Condition()
+        self.queues: list[GenerationQueue] = []
+        self.next_index = 0
+
+        self.current_queue: GenerationQueue | None = None
+        self.current_job: GenerationJob | None = None
+        self.thread: threading.Thread | None = None
+
+    def __repr__(self):
+        return f'<ModelWorker {self.name!r} queues={len(self.queues)}>'
+
+    def add_queue(self, queue: GenerationQueue) -> None:
+        with self.condition:
+            self.queues.append(queue)
+            if self.thread is None:
+                # Start the thread on demand. It ends if the last queue is removed.
+                self.thread = threading.Thread(target=self.run, name=f'model_worker-{self.name}', daemon=True)
+                self.thread.start()
+
+    def remove_queue(self, queue: GenerationQueue) -> None:
+        with self.condition:
+            self.queues.remove(queue)
+            self.condition.notify()
+
+    def _next_job(self) -> tuple[GenerationQueue, GenerationJob] | None:
+        for offset in range(len(self.queues)):
+            index = (self.next_index + offset) % len(self.queues)
+            queue = self.queues[index]
+            if queue.jobs:
+                self.next_index = index + 1
+                return queue, queue.jobs.popleft()
+        return None
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while not (next_job := self._next_job()):
+                    if not self.queues:
+                        self.thread = None
+                        return
+                    self.condition.wait()
+
+                queue, job = next_job
+                self.current_queue, self.current_job = queue, job
+
+            queue.changed()
+            try:
+                if not job.cancelled:
+                    job.func(job)
+            except Exception:
+                logger.exception('Error running %r', job)
+            finally:
+                with self.condition:
+                    self.current_queue = self.current_job = None
+
+
+class Priority(enum.IntEnum):
+    INTERACTIVE = 0  # A user waits for the answer
+    BACKGROUND = 1  # e.g.: A welcome message that is not needed right now
+
+
+class ThreadPolicy(enum.StrEnum):
+    # Every generation gets the same share of the thread budget:
+    FAIR = enum.auto()
+    # An interactive generation gets all free threads, if no other generation is waiting.
+    # (A single generation with all cores often has a better throughput than parallel ones)
+    GREEDY = enum.auto()
+
+
+class InferenceScheduler:
+    """
+    Owns the CPU thread budget of all generations in this process:
+    Limits how many generations run at the same time and assigns their thread count.
+    Waiting interactive generations always start before background generations.
+
+    >>> InferenceScheduler(thread_budget=8, max_concurrent=2).fair_share
+    4
+    >>> InferenceScheduler(thread_budget=8, max_concurrent=3).fair_share
+    2
+    """
+
+    def __init__(self, *, thread_budget: int, max_concurrent: int = 1, policy: ThreadPolicy = ThreadPolicy.FAIR):
+        self.thread_budget = max(1, thread_budget)
+        self.max_concurrent = max(1, min(max_concurrent, self.thread_budget))
+        self.policy = policy
+
+        self.condition = threading.Condition()
+        self.sequence = itertools.count()
+        self.waiting: list[tuple[Priority, int]] = []  # heap of (priority, sequence number)
+        self.running: dict[tuple[Priority, int], int] = {}  # -> thread count
+
+    def __repr__(self):
+        return (
+            f'<InferenceScheduler {self.policy} budget={self.thread_budget} threads'
+            f' max_concurrent={self.max_concurrent}>'
+        )
+
+    @property
+    def fair_share(self) -> int:
+        return max(1, self.thread_budget // self.max_concurrent)
+
+    @property
+    def free_threads(self) -> int:
+        return self.thread_budget - sum(self.running.values())
+
+    def _can_start(self, key) -> bool:
+        return self.waiting[0] == key and len(self.running) < self.max_concurrent and self.free_threads > 0
+
+    def _get_thread_count(self, priority: Priority) -> int:
+        if self.policy == ThreadPolicy.GREEDY and priority == Priority.INTERACTIVE and not self.waiting:
+            n_threads = self.free_threads
+        else:
+            n_threads = self.fair_share
+        return max(1, min(n_threads, self.free_threads))
+
+    @contextlib.contextmanager
+    def slot(self, *, name: str, priority: Priority = Priority.INTERACTIVE) -> Iterator[int]:
+        """
+        Wait until the generation can start and yield its thread count.
+        """
+        key = (priority, next(self.sequence))
+        start_time = time.monotonic()
+        with self.condition:
+            heapq.heappush(self.waiting, key)
+            while not self._can_start(key):
+                self.condition.wait()
+            heapq.heappop(self.waiting)
+
+            n_threads = self._get_thread_count(priority)
+            self.running[key] = n_threads
+            running, waiting = len(self.running), len(self.waiting)
+            self.condition.notify_all()  # The next one may start, too
+
+        logger.info(
+            'Start %s generation %r with %i threads after %.1f sec. (running: %i, waiting: %i)',
+            priority.name,
+            name,
+            n_threads,
+            time.monotonic() - start_time,
+            running,
+            waiting,
+        )
+        try:
+            yield n_threads
+        finally:
+            with self.condition:
+                del self.running[key]
+                self.condition.notify_all()
@@ -0,0 +1,167 @@
+"""
+    Save chat sessions to disk and restore them
+
+    If the native library supports it, the model state (e.g. the KV cache) is saved, too.
+    Otherwise the complete history is evaluated again on restore.
+"""
+import copy
+import dataclasses
+import json
+import logging
+import re
+import time
+from pathlib import Path
+from uuid import uuid4
+
+from gpt4all_cli.constants import CACHE_PATH
+from gpt4all_cli.model_pool import ChatContext
+from gpt4all_cli.model_state import ModelState, restore_model_state, save_model_state
+
+
+logger = logging.getLogger(__name__)
+
+SESSIONS_PATH = CACHE_PATH / 'sessions'
+SESSION_ID = re.compile(r'^[a-zA-Z0-9-_]{1,100}$')
+SNAPSHOT_VERSION = 1
+
+
+def new_session_id() -> str:
+    return f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid4().hex[:6]}'
+
+
+@dataclasses.dataclass
+class SessionSnapshot:
+    session_id: str
+    model_name: str
+    history: list[dict]  # The chat history of the model, starts with the system prompt
+    messages: list = dataclasses.field(default_factory=list)  # e.g.: Encoded ChatMessages of a room
+    saved: float = 0.0  # Unix timestamp
+    state: ModelState | None = None
+
+    @staticmethod
+    def get_paths(session_id: str, path: Path) -> tuple[Path, Path]:
+        if not SESSION_ID.match(session_id):
+            raise ValueError(f'Invalid session id: {session_id!r}')
+        return path / f'{session_id}.json', path / f'{session_id}.state'
+
+    def save(self, path: Path = SESSIONS_PATH) -> None:
+        json_path, state_path = self.get_paths(self.session_id, path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        data = dataclasses.asdict(self)
+        state = data.pop('state')
+        if state:
+            tmp_path = state_path.with_suffix('.tmp')
+            tmp_path.write_bytes(state.pop('data'))
+            tmp_path.replace(state_path)
+        else:
+            state_path.unlink(missing_ok=True)
+        data['version'] = SNAPSHOT_VERSION
+        data['state'] = state  # Without the data
+
+        tmp_path = json_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(data))
+        tmp_path.replace(json_path)
+
+    @classmethod
+    def load(cls, session_id: str, path: Path = SESSIONS_PATH) -> 'SessionSnapshot':
+        """
+        Raises FileNotFoundError, if the session does not exist.
+        """
+        json_path, state_path = cls.get_paths(session_id, path)
+        data = json.loads(json_path.read_text())
+        if data.pop('version', None) != SNAPSHOT_VERSION:
+            raise ValueError(f'Unsupported snapshot version in {json_path}')
+
+        state = data.pop('state')
+        snapshot = cls(**data)
+        if state:
+            try:
+                snapshot.state = ModelState(data=state_path.read_bytes(), **state)
+            except FileNotFoundError:
+                logger.warning('Model state file %s is missing', state_path)
+        return snapshot
+
+    @property
+    def message_count(self) -> int:
+        return len(self.history) - 1  # Without the system prompt
+
+
+def save_session(
+    chat_context: ChatContext,
+    *,
+    session_id: str,
+    messages: list | None = None,
+    path: Path = SESSIONS_PATH,
+) -> SessionSnapshot:
+    """
+    Save the history of the chat context. The model state is saved, too, if the model
+    evaluated this chat as last one and the library supports it.
+    """
+    pooled_model = chat_context.pooled_model
+    with pooled_model.lock:
+        history = copy.deepcopy(chat_context.current_chat_session)
+        state = None
+        if pooled_model.active_context is chat_context:
+            state = save_model_state(pooled_model.model)
+
+    snapshot = SessionSnapshot(
+        session_id=session_id,
+        model_name=pooled_model.model_name,
+        history=history,
+        messages=messages or [],
+        saved=time.time(),
+        state=state,
+    )
+    snapshot.save(path)
+    logger.info(
+        'Session %r saved to %s (%i messages, model state: %s)',
+        session_id,
+        path,
+        snapshot.message_count,
+        f'{len(state.data)} bytes' if state else 'no',
+    )
+    return snapshot
+
+
+@dataclasses.dataclass
+class RestoreResult:
+    messages: int
+    native: bool  # Was the model state restored, or the history evaluated again?
+    duration: float  # seconds
+
+    def summary(self) -> str:
+        """
+        >>> RestoreResult(messages=4, native=False, duration=2.5).summary()
+        'Replayed 4 messages in 2.5 sec. (prefill)'
+        """
+        if self.native:
+            return f'Restored {self.messages} messages from the saved model state in {self.duration:.1f} sec.'
+        return f'Replayed {self.messages} messages in {self.duration:.1f} sec. (prefill)'
+
+
+def restore_session(chat_context: ChatContext, snapshot: SessionSnapshot) -> RestoreResult:
+    """
+    Restore the history into the chat context and bring the model into the state after the last answer.
+    """
+    chat_context.current_chat_session = copy.deepcopy(snapshot.history)
+    pooled_model = chat_context.pooled_model
+    start_time = time.monotonic()
+
+    if snapshot.state:
+        with pooled_model.lock:
+            if restore_model_state(pooled_model.model, snapshot.state):
+                pooled_model.active_context = chat_context
+                return RestoreResult(
+                    messages=snapshot.message_count,
+                    native=True,
+                    duration=time.monotonic() - start_time,
+                )
+
+    if snapshot.message_count:
+        chat_context.prefill()
+    return RestoreResult(
+        messages=snapshot.message_count,
+        native=False,
+        duration=time.monotonic() - start_time,
+    )
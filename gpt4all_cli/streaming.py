@@ -0,0 +1,84 @@
+import time
+from collections.abc import Callable
+
+
+class TokenCoalescer:
+    """
+    Collect streamed GPT tokens and pass them in batches to `flush_func`.
+
+    The first token is flushed immediately, so the "time to first token" is not delayed.
+    After that, the collected tokens are flushed if `interval` seconds are elapsed since
+    the last flush or if the collected text is bigger than `max_bytes`.
+
+    >>> now = 0.0
+    >>> batches = []
+    >>> coalescer = TokenCoalescer(flush_func=batches.append, interval=0.05, max_bytes=10, clock=lambda: now)
+    >>> coalescer.add('Hello')
+    >>> batches
+    ['Hello']
+    >>> coalescer.add(' World')
+    >>> coalescer.add('!')
+    >>> batches
+    ['Hello']
+    >>> coalescer.add(' How are')
+    >>> batches
+    ['Hello', ' World! How are']
+
+    >>> coalescer.add(' you')
+    >>> now = 0.1
+    >>> coalescer.add('?')
+    >>> batches
+    ['Hello', ' World! How are', ' you?']
+
+    Remaining tokens must be flushed at the end:
+
+    >>> coalescer.add(' Bye.')
+    >>> coalescer.flush()
+    >>> coalescer.flush()
+    >>> batches
+    ['Hello', ' World! How are', ' you?', ' Bye.']
+    >>> coalescer.token_count, coalescer.flush_count
+    (7, 4)
+    """
+
+    def __init__(
+        self,
+        *,
+        flush_func: Callable[[str], None],
+        interval: float,
+        max_bytes: int,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.flush_func = flush_func
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.clock = clock
+
+        self.tokens: list[str] = []
+        self.size = 0
+        self.last_flush: float | None = None
+
+        self.token_count = 0
+        self.flush_count = 0
+
+    def add(self, token: str) -> None:
+        self.tokens.append(token)
+        self.size += len(token.encode('utf-8'))
+        self.token_count += 1
+
+        if self.last_flush is None or self.size >= self.max_bytes:
+            self.flush()
+        elif self.clock() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.tokens:
+            return
+
+        text = ''.join(self.tokens)
+        self.tokens.clear()
+        self.size = 0
+        self.last_flush = self.clock()
+        self.flush_count += 1
+
+        self.flush_func(text)
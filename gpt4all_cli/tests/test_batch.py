@@ -0,0 +1,63 @@
+import io
+import json
+import tempfile
+from functools import partial
+from pathlib import Path
+from unittest import TestCase
+
+from gpt4all_cli.batch import prepare_resume, read_prompts, run_batch
+from gpt4all_cli.benchmarks.fake_gpt4all import FakeGPT4All
+
+
+class BatchTestCase(TestCase):
+    def test_run_batch(self):
+        lines = [json.dumps({'id': f'prompt-{number}', 'prompt': f'Prompt {number}'}) for number in range(5)]
+        lines.append(json.dumps({'prompt': 'Without id', 'max_tokens': 2}))
+        output = io.StringIO()
+        results = []
+        count = run_batch(
+            prompts=read_prompts(lines),
+            output=output,
+            model_name='fake-model',
+            workers=2,
+            n_threads=1,
+            max_tokens=3,
+            temperature=0.0,
+            skip_ids={'prompt-1'},
+            loader=partial(FakeGPT4All, tokens_per_second=1000),
+            on_result=results.append,
+        )
+        self.assertEqual(count, 5)
+
+        written = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(written, results)
+        self.assertEqual(
+            {result['id'] for result in written},
+            {'prompt-0', 'prompt-2', 'prompt-3', 'prompt-4', 6},
+        )
+        for result in written:
+            if result['id'] == 6:
+                self.assertEqual(result['response'], 'Hello there')
+                self.assertEqual(result['tokens'], 2)
+            else:
+                self.assertEqual(result['response'], 'Hello there!')
+                self.assertEqual(result['stop_reason'], 'length')
+
+    def test_prepare_resume(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = Path(temp_dir, 'output.jsonl')
+            self.assertEqual(prepare_resume(output_path), set())
+
+            output_path.write_text('{"id": 1, "response": "A"}\n{"id": "two", "response": "B"}\n{"id": 3, "resp')
+            self.assertEqual(prepare_resume(output_path), {1, 'two'})
+            # The partially written line is removed:
+            self.assertEqual(output_path.read_text(), '{"id": 1, "response": "A"}\n{"id": "two", "response": "B"}\n')
+
+            output_path.write_text('{"id": 1, "re')
+            self.assertEqual(prepare_resume(output_path), set())
+            self.assertEqual(output_path.read_text(), '')
+
+            # Failed prompts are answered again:
+            output_path.write_text('{"id": 1, "error": "Boom"}\n{"id": 2, "response": "B"}\n')
+            self.assertEqual(prepare_resume(output_path), {2})
+            self.assertEqual(output_path.read_text(), '{"id": 2, "response": "B"}\n')
@@ -0,0 +1,23 @@
+from functools import partial
+from unittest import TestCase
+
+from gpt4all_cli.bench import run_bench
+from gpt4all_cli.benchmarks.fake_gpt4all import FakeGPT4All
+
+
+class BenchTestCase(TestCase):
+    def test_run_bench(self):
+        results = run_bench(
+            model_name='fake-model',
+            thread_counts=[1, 2],
+            prompts=('Hello World',),
+            max_tokens=5,
+            loader=partial(FakeGPT4All, tokens_per_second=1000),
+        )
+        self.assertEqual([result.n_threads for result in results], [1, 2])
+        for result in results:
+            self.assertEqual(result.generated_tokens, 5)
+            # The fake model counts every word of the full prompt (with system prompt + template):
+            self.assertEqual(result.prompt_tokens, 12)
+            self.assertGreater(result.decode_tokens_per_second, 0)
+            self.assertGreater(result.peak_rss, 0)
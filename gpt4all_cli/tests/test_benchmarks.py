@@ -0,0 +1,27 @@
+from unittest import TestCase
+
+from gpt4all_cli.benchmarks.import_time import IMPORT_TIME_BUDGETS, measure_import_time
+from gpt4all_cli.benchmarks.streaming_pipeline import benchmark_cli, benchmark_web_ui
+
+
+class StreamingPipelineTestCase(TestCase):
+    def test_web_ui(self):
+        result = benchmark_web_ui(rooms=2, clients=3, prompts=2, tokens=5, tokens_per_second=1000)
+        # Every client received every token:
+        self.assertEqual(result['delivered_tokens'], 2 * 3 * 2 * 5)
+        self.assertGreater(result['channel_messages_per_second'], 0)
+        self.assertEqual(set(result['latency']), {'p50', 'p90', 'p99', 'max'})
+
+    def test_cli(self):
+        result = benchmark_cli(prompts=2, tokens=5, tokens_per_second=1000)
+        self.assertEqual(result['delivered_tokens'], 10)
+
+
+class ImportTimeTestCase(TestCase):
+    def test_lazy_imports(self):
+        # Only check the imported modules, the timing depends on the machine:
+        for name in ('version', 'list-models'):
+            with self.subTest(name):
+                result = measure_import_time(name, IMPORT_TIME_BUDGETS[name], repeat=1)
+                self.assertIn('gpt4all_cli.cli.cli_app', result.modules)
+                self.assertEqual(result.forbidden_imports, [])
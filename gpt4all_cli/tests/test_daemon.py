@@ -0,0 +1,101 @@
+import tempfile
+import threading
+from functools import partial
+from pathlib import Path
+from unittest import TestCase
+
+from gpt4all_cli.benchmarks.fake_gpt4all import FakeGPT4All
+from gpt4all_cli.daemon import ModelDaemon, RemoteChatContext, RemoteError, connect, get_status, stop_daemon
+from gpt4all_cli.model_pool import ModelPool
+from gpt4all_cli.scheduler import InferenceScheduler
+from gpt4all_cli.sessions import SessionSnapshot
+
+
+class ModelDaemonTestCase(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_path = Path(temp_dir.name)
+        self.socket_path = self.temp_path / 'daemon.sock'
+
+        self.model_pool = ModelPool(loader=partial(FakeGPT4All, tokens_per_second=1000))
+        self.server = ModelDaemon(
+            model_pool=self.model_pool,
+            socket_path=self.socket_path,
+            sessions_path=self.temp_path,
+        )
+        self.server.preload('fake-model')
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.addCleanup(self.stop)
+
+    def stop(self):
+        if self.thread.is_alive():
+            self.server.shutdown()
+            self.thread.join()
+        self.server.server_close()
+
+    def test_chat(self):
+        self.assertIsNone(connect(self.temp_path / 'not-running.sock'))
+        with self.assertRaisesRegex(RuntimeError, 'already running'):
+            ModelDaemon(model_pool=self.model_pool, socket_path=self.socket_path)
+        self.assertEqual(get_status(self.socket_path)['models'], ['fake-model'])
+
+        chat_context = RemoteChatContext(connect(self.socket_path), model_name='fake-model')
+        self.assertEqual(chat_context.config['promptTemplate'], '### User:\n{0}\n### Response:\n')
+        self.assertEqual(list(chat_context.generate('Hi', max_tokens=3)), ['Hello', ' there', '!'])
+        self.assertEqual(
+            chat_context.current_chat_session[1:],
+            [{'role': 'user', 'content': 'Hi'}, {'role': 'assistant', 'content': 'Hello there!'}],
+        )
+
+        # Stopped by the callback:
+        tokens = list(chat_context.generate('Stop', max_tokens=9, callback=lambda token_id, response: token_id < 1))
+        self.assertEqual(tokens, ['Hello'])
+        self.assertTrue(chat_context.current_chat_session[-1]['content'].startswith('Hello'))
+
+        # Stopped by the consumer: The next answer is not mixed with the old tokens
+        generator = chat_context.generate('Break', max_tokens=9)
+        self.assertEqual(next(generator), 'Hello')
+        generator.close()
+        self.assertEqual(chat_context.generate('Again', streaming=False, max_tokens=2), 'Hello there')
+
+        # The daemon saves the session with the model state:
+        snapshot = chat_context.save(session_id='test', path=self.temp_path)
+        self.assertEqual(snapshot.message_count, 8)
+        self.assertIsNotNone(snapshot.state)
+        chat_context.close()
+
+        chat_context = RemoteChatContext(connect(self.socket_path), model_name='fake-model')
+        result = chat_context.restore(SessionSnapshot.load('test', path=self.temp_path))
+        self.assertTrue(result.native)
+        self.assertEqual(chat_context.current_chat_session, snapshot.history)
+
+        with self.assertLogs('gpt4all_cli.daemon', level='ERROR'):
+            chat_context.connection.send({'command': 'foo'})
+            with self.assertRaisesRegex(RemoteError, "Unknown command: 'foo'"):
+                chat_context.receive('ok')
+        chat_context.close()
+
+        self.assertTrue(stop_daemon(self.socket_path))
+        self.thread.join(timeout=5)
+        self.assertFalse(self.thread.is_alive())
+        self.assertFalse(self.socket_path.exists())
+        self.assertFalse(stop_daemon(self.socket_path))
+
+    def test_client_scheduler(self):
+        scheduler = InferenceScheduler(thread_budget=5, max_concurrent=1)
+        chat_context = RemoteChatContext(connect(self.socket_path), model_name='fake-model', scheduler=scheduler)
+        self.addCleanup(chat_context.close)
+
+        # The daemon uses the thread count of the slot in this process:
+        generator = chat_context.generate('Hi', max_tokens=9)
+        self.assertEqual(next(generator), 'Hello')
+        self.assertEqual(list(scheduler.running.values()), [5])
+        self.assertEqual(self.model_pool.models['fake-model'].model.n_threads, 5)
+        generator.close()
+        self.assertEqual(scheduler.running, {})
+
+        self.assertEqual(chat_context.generate('Again', streaming=False, max_tokens=2), 'Hello there')
+        self.assertEqual(chat_context.last_thread_count, 5)
+        self.assertEqual(scheduler.running, {})
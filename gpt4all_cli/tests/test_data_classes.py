@@ -0,0 +1,35 @@
+from unittest import TestCase
+
+from gpt4all_cli.data_classes import ChatMessage, MessageTypeEnum, RoomData
+
+
+class RoomDataTestCase(TestCase):
+    def test_bounded_history(self):
+        room_data = RoomData(gpt_model_name='model', back_log=2)
+        for number in range(3):
+            room_data.logs.append(
+                ChatMessage(id=str(number), type=MessageTypeEnum.MESSAGE, text=f'Message {number}', user_name='user')
+            )
+        self.assertEqual([entry.text for entry in room_data.logs], ['Message 1', 'Message 2'])
+
+
+class ChatMessageTestCase(TestCase):
+    def test_encode(self):
+        message = ChatMessage(
+            id='abc',
+            type=MessageTypeEnum.MESSAGE,
+            text='Hello',
+            user_name='user',
+            timestamp=1.5,
+        )
+        self.assertEqual(message.encode(), ['abc', 'message', 'Hello', 'user', 1.5])
+        self.assertEqual(ChatMessage.decode(message.encode()), message)
+
+        # Only trailing default values are omitted:
+        message = ChatMessage(id='abc', type=MessageTypeEnum.WAIT, user_name='GPT')
+        self.assertEqual(message.encode(), ['abc', 'wait', '', 'GPT'])
+        self.assertEqual(ChatMessage.decode(message.encode()), message)
+
+    def test_slots(self):
+        message = ChatMessage(id='abc', type=MessageTypeEnum.APPEND)
+        self.assertFalse(hasattr(message, '__dict__'))
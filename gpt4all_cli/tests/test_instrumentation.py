@@ -0,0 +1,56 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from gpt4all_cli.instrumentation import GenerationRecorder, JsonLinesSink, MemorySink, StopReason
+
+
+class GenerationRecorderTestCase(TestCase):
+    def test_recorder(self):
+        # start(), 3x token(), finish():
+        times = iter([10.0, 10.5, 10.52, 10.6, 10.6])
+        memory_sink = MemorySink()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            json_sink = JsonLinesSink(Path(temp_dir) / 'stats.jsonl')
+            recorder = GenerationRecorder(
+                name='model',
+                max_tokens=3,
+                sinks=[memory_sink, json_sink],
+                queued_at=9.0,
+                clock=lambda: next(times),
+            )
+            recorder.start()
+            for _ in range(3):
+                recorder.token()
+            stats = recorder.finish()
+
+            self.assertEqual(stats.queue_wait, 1.0)
+            self.assertEqual(stats.ttft, 0.5)
+            self.assertAlmostEqual(stats.duration, 0.6)
+            self.assertEqual(stats.tokens, 3)
+            self.assertEqual(stats.stop_reason, StopReason.LENGTH)
+            self.assertEqual(stats.inter_token.count, 2)
+            self.assertEqual(stats.inter_token.as_dict()['0.025'], 1)
+            self.assertEqual(stats.inter_token.as_dict()['0.1'], 1)
+
+            data = json.loads(json_sink.path.read_text())
+            self.assertEqual(data['stop_reason'], 'length')
+            self.assertEqual(data['tokens'], 3)
+
+        self.assertEqual(memory_sink.generations, 1)
+        self.assertEqual(memory_sink.tokens, 3)
+        self.assertEqual(memory_sink.inter_token.count, 2)
+        self.assertIs(memory_sink.last[-1], stats)
+
+    def test_stop_reason(self):
+        recorder = GenerationRecorder(name='model', max_tokens=3)
+        recorder.start()
+        recorder.token()
+        stats = recorder.finish()
+        self.assertEqual(stats.stop_reason, StopReason.END)
+
+        recorder = GenerationRecorder(name='model', max_tokens=3)
+        stats = recorder.finish(StopReason.CANCELLED)
+        self.assertEqual(stats.stop_reason, StopReason.CANCELLED)
+        self.assertIsNone(stats.ttft)
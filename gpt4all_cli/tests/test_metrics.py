@@ -0,0 +1,21 @@
+from types import SimpleNamespace
+from unittest import TestCase
+
+from gpt4all_cli.data_classes import RoomData, RoomState
+from gpt4all_cli.web_ui import MetricsView, app, render_metrics
+
+
+class MetricsTestCase(TestCase):
+    def test_route_order(self):
+        views = [route.view for route in app.routes]
+        # "/<room>(/)" would match "/metrics", too:
+        self.assertLess(views.index(MetricsView), [route.raw_pattern for route in app.routes].index('/<room>(/)'))
+
+    def test_render_metrics(self):
+        room_data = RoomData(gpt_model_name='model', state=RoomState.LOADING, users=['alice', 'bob'])
+        server = SimpleNamespace(state={'rooms': {'test': room_data}})
+        text = render_metrics(server)
+        self.assertIn('gpt4all_rooms{state="loading"} 1\n', text)
+        self.assertIn('gpt4all_users 2\n', text)
+        self.assertIn('# TYPE gpt4all_ttft_seconds histogram\n', text)
+        self.assertIn('gpt4all_inter_token_seconds_bucket{le="+Inf"} ', text)
@@ -0,0 +1,113 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import requests
+
+from gpt4all_cli.model_catalogue import ModelCatalogue
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, models=None, headers=None):
+        self.status_code = status_code
+        self.reason = 'OK' if status_code == 200 else 'Error'
+        self.models = models
+        self.headers = headers or {}
+
+    def json(self):
+        return self.models
+
+
+class FakeGet:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def __call__(self, url, *, headers, timeout):
+        self.requests.append(headers)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class ModelCatalogueTestCase(TestCase):
+    def test_ttl_and_conditional_refresh(self):
+        now = 0.0
+        models = [{'filename': 'a.gguf', 'md5sum': 'abc'}]
+        get = FakeGet(
+            FakeResponse(200, models, headers={'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}),
+            FakeResponse(304),
+            requests.ConnectionError('offline'),
+        )
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / 'models.json'
+            catalogue = ModelCatalogue(path=path, ttl=10, get=get, clock=lambda: now)
+            self.assertEqual(catalogue.get_models(), models)
+            self.assertEqual(get.requests, [{}])
+
+            # Fresh: no request
+            now = 5.0
+            self.assertEqual(ModelCatalogue(path=path, ttl=10, get=get, clock=lambda: now).get_models(), models)
+            self.assertEqual(len(get.requests), 1)
+
+            # Expired: conditional request
+            now = 15.0
+            catalogue = ModelCatalogue(path=path, ttl=10, get=get, clock=lambda: now)
+            self.assertEqual(catalogue.get_models(), models)
+            self.assertEqual(
+                get.requests[1],
+                {'If-None-Match': '"v1"', 'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'},
+            )
+            self.assertEqual(catalogue.fetched, 15.0)
+
+            # Fetching fails: The cache is used
+            self.assertEqual(catalogue.get_models(refresh=True), models)
+            self.assertEqual(catalogue.fetched, 15.0)
+
+            # Offline: never fetch
+            now = 100.0
+            self.assertEqual(catalogue.get_models(offline=True), models)
+            self.assertEqual(len(get.requests), 3)
+
+    def test_fetch_error_without_cache(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            catalogue = ModelCatalogue(path=Path(temp_dir) / 'models.json', get=FakeGet(FakeResponse(500)))
+            with self.assertRaises(ValueError):
+                catalogue.get_models()
+
+    def test_seed_and_local_models(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir)
+            model_dir = temp_path / 'models'
+            model_dir.mkdir()
+            (model_dir / 'a.gguf').write_bytes(b'A')
+            (model_dir / 'b.gguf').write_bytes(b'B')
+            (model_dir / 'c.gguf').write_bytes(b'C')
+            (model_dir / 'notes.txt').write_text('ignored')
+
+            source = temp_path / 'models2.json'
+            source.write_text(
+                json.dumps(
+                    [
+                        {'filename': 'a.gguf', 'md5sum': '7fc56270e7a70fa81a5935b72eacbe29'},  # md5 of b'A'
+                        {'filename': 'b.gguf', 'md5sum': 'wrong'},
+                    ]
+                )
+            )
+            catalogue = ModelCatalogue(path=temp_path / 'models.json', get=FakeGet())
+            self.assertEqual(catalogue.seed(source), 2)
+            self.assertTrue(catalogue.is_fresh())
+
+            local_models = catalogue.get_local_models(model_dir)
+            self.assertEqual([model.filename for model in local_models], ['a.gguf', 'b.gguf', 'c.gguf'])
+            self.assertEqual([model.checksum_ok for model in local_models], [True, False, None])
+            self.assertEqual(local_models[0].size, 1)
+
+            # The checksums are cached:
+            catalogue = ModelCatalogue(path=temp_path / 'models.json', get=FakeGet())
+            self.assertEqual(len(catalogue.data['checksums']), 3)
+            checksums = {value: 'cached' for value in catalogue.data['checksums']}
+            catalogue.data['checksums'] = checksums
+            self.assertEqual({model.md5sum for model in catalogue.get_local_models(model_dir)}, {'cached'})
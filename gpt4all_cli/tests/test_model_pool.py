@@ -0,0 +1,208 @@
+import queue
+import threading
+import time
+from functools import partial
+from unittest import TestCase
+
+from gpt4all_cli.benchmarks.fake_gpt4all import FakeGPT4All as BenchmarkGPT4All
+from gpt4all_cli.instrumentation import GenerationRecorder
+from gpt4all_cli.model_pool import ModelPool
+from gpt4all_cli.scheduler import InferenceScheduler
+
+
+class FakeLLModel:
+    def __init__(self, n_threads):
+        self.n_threads = n_threads
+        self.prompts = []
+
+    def thread_count(self):
+        return self.n_threads
+
+    def set_thread_count(self, n_threads):
+        self.n_threads = n_threads
+
+    def prompt_model_streaming(self, *, prompt, reset_context, callback, **kwargs):
+        self.prompts.append((prompt, reset_context))
+        yield from ('Hello', ' World')
+
+
+class ThreadedLLModel(FakeLLModel):
+    """
+    Runs the prompt in an own thread, like `prompt_model_streaming()` of gpt4all
+    """
+
+    def __init__(self, n_threads):
+        super().__init__(n_threads)
+        self.running = 0
+        self.overlaps = 0
+        self.lock = threading.Lock()
+
+    def prompt_model_streaming(self, *, prompt, reset_context, callback, n_predict, **kwargs):
+        self.prompts.append((prompt, reset_context))
+        output = queue.SimpleQueue()
+
+        def run():
+            with self.lock:
+                self.running += 1
+                self.overlaps += self.running > 1
+            try:
+                for token_id in range(n_predict):
+                    time.sleep(0.001)
+                    if not callback(token_id, ' token'):
+                        return
+                    output.put(' token')
+            finally:
+                with self.lock:
+                    self.running -= 1
+                output.put(None)
+
+        threading.Thread(target=run).start()
+        while (token := output.get()) is not None:
+            yield token
+
+
+class FakeGPT4All:
+    def __init__(self, model_name, n_threads, *, model_class=FakeLLModel, **kwargs):
+        self.model_name = model_name
+        self.config = {'systemPrompt': 'System', 'promptTemplate': 'Q: {0}\n'}
+        self.model = model_class(n_threads)
+
+
+class ModelPoolTestCase(TestCase):
+    def test_shared_model(self):
+        pool = ModelPool(loader=FakeGPT4All)
+
+        room1 = pool.chat_context('model-a')
+        room2 = pool.chat_context('model-a')
+        room3 = pool.chat_context('model-b')
+        self.assertIs(room1.pooled_model, room2.pooled_model)
+        self.assertIsNot(room1.pooled_model, room3.pooled_model)
+        self.assertEqual(list(pool.models), ['model-a', 'model-b'])
+        self.assertEqual(room1.pooled_model.ref_count, 2)
+
+        room1.close()
+        room1.close()  # Closing twice doesn't release twice
+        self.assertEqual(room2.pooled_model.ref_count, 1)
+        self.assertEqual(list(pool.models), ['model-a', 'model-b'])
+
+        room2.close()
+        self.assertEqual(list(pool.models), ['model-b'])
+
+        room3.close()
+        self.assertEqual(list(pool.models), [])
+
+    def test_keep_idle_lru(self):
+        pool = ModelPool(loader=FakeGPT4All, keep_idle=True, max_ram=20)
+        sizes = {'model-a': 10, 'model-b': 10, 'model-c': 10}
+
+        def acquire(model_name):
+            chat_context = pool.chat_context(model_name)
+            chat_context.pooled_model.size = sizes[model_name]
+            return chat_context
+
+        acquire('model-a').close()
+        acquire('model-b').close()
+        self.assertEqual(list(pool.models), ['model-a', 'model-b'])
+
+        room = acquire('model-a')  # Use "model-a" again -> "model-b" is the least recently used one
+        acquire('model-c').close()
+        self.assertEqual(list(pool.models), ['model-a', 'model-c'])
+
+        room.close()
+        self.assertEqual(list(pool.models), ['model-a', 'model-c'])
+
+    def test_replay_history_on_context_switch(self):
+        pool = ModelPool(loader=FakeGPT4All)
+        room1 = pool.chat_context('model')
+        room2 = pool.chat_context('model')
+        fake_model = room1.model
+
+        self.assertEqual(''.join(room1.generate('1')), 'Hello World')
+        self.assertEqual(room1.generate('2', streaming=False), 'Hello World')
+        self.assertEqual(room2.generate('3', streaming=False), 'Hello World')
+        self.assertEqual(room1.generate('4', streaming=False), 'Hello World')
+
+        self.assertEqual(
+            fake_model.prompts,
+            [
+                ('System\n\nQ: 1\n', True),
+                ('Q: 2\n', False),
+                ('System\n\nQ: 3\n', True),
+                ('System\n\nQ: 1\nHello World\nQ: 2\nHello World\nQ: 4\n', True),
+            ],
+        )
+        self.assertEqual(
+            room1.current_chat_session[-2:],
+            [{'role': 'user', 'content': '4'}, {'role': 'assistant', 'content': 'Hello World'}],
+        )
+
+    def test_scheduler_thread_count(self):
+        pool = ModelPool(loader=FakeGPT4All, scheduler=InferenceScheduler(thread_budget=6, max_concurrent=3))
+        room = pool.chat_context('model')
+        self.assertEqual(room.model.thread_count(), 2)
+        self.assertIsNone(room.last_thread_count)
+
+        room.generate('1', streaming=False)
+        self.assertEqual(room.last_thread_count, 2)
+
+    def test_resident_chat_context(self):
+        pool = ModelPool(loader=FakeGPT4All)
+        self.assertIsNone(pool.resident_chat_context('model'))
+
+        room = pool.chat_context('model')
+        welcome = pool.resident_chat_context('model')
+        self.assertIs(welcome.pooled_model, room.pooled_model)
+        self.assertEqual(room.pooled_model.ref_count, 2)
+
+        welcome.close()
+        room.close()
+        self.assertEqual(list(pool.models), [])
+
+    def test_queue_wait_until_model_lock(self):
+        now = 0.0
+        pool = ModelPool(loader=FakeGPT4All)
+        room = pool.chat_context('model')
+        recorder = GenerationRecorder(name='model', max_tokens=10, clock=lambda: now)
+
+        tokens = room.generate('1', on_start=recorder.start)
+        with room.pooled_model.lock:
+            now = 5.0  # Another room generates
+        for _ in tokens:
+            now += 0.5
+            recorder.token()
+        stats = recorder.finish()
+        self.assertEqual((stats.queue_wait, stats.ttft, stats.tokens), (5.0, 0.5, 2))
+
+    def test_cancel_prompt_thread_on_close(self):
+        pool = ModelPool(loader=partial(FakeGPT4All, model_class=ThreadedLLModel))
+        first = pool.chat_context('model')
+        second = pool.chat_context('model')
+        model = first.model
+
+        tokens = first.generate('1', max_tokens=10_000)
+        self.assertEqual(next(tokens), ' token')
+        tokens.close()  # e.g. KeyboardInterrupt in the CLI chat
+        self.assertEqual(model.running, 0)
+        self.assertLess(len(first.current_chat_session[-1]['content']), 10_000 * len(' token'))
+
+        self.assertEqual(second.generate('2', streaming=False, max_tokens=3), ' token token token')
+        self.assertEqual(model.overlaps, 0)
+
+    def test_detached_context(self):
+        pool = ModelPool(loader=partial(BenchmarkGPT4All, tokens_per_second=1000))
+        room = pool.chat_context('fake-model')
+        self.assertEqual(room.generate('Hi', streaming=False, max_tokens=2), 'Hello there')
+        model = room.model
+        n_past = model.context.n_past
+
+        # e.g. a welcome message: Evaluated from scratch, but the room continues without replay
+        welcome = pool.resident_chat_context('fake-model', detached=True)
+        self.assertEqual(welcome.generate('Welcome', streaming=False, max_tokens=3), 'Hello there!')
+        welcome.close()
+        self.assertIs(room.pooled_model.active_context, room)
+        self.assertEqual(model.context.n_past, n_past)
+
+        evaluated = model.evaluated
+        room.generate('Again', streaming=False, max_tokens=2)
+        self.assertEqual(model.evaluated - evaluated, len('### User:\nAgain\n### Response:\n'.split()))
+        room.close()
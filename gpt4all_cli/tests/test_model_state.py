@@ -0,0 +1,60 @@
+import ctypes
+from unittest import TestCase
+from unittest.mock import patch
+
+from gpt4all import LLModel
+
+from gpt4all_cli import model_state
+from gpt4all_cli.model_state import ModelState, restore_model_state, save_model_state
+
+
+class FakeLibrary:
+    """
+    The state API of libllmodel: The state size is the max. size, the saved data is smaller.
+    """
+
+    def __init__(self, *, max_size: int, data: bytes):
+        self.max_size = max_size
+        self.data = data
+        self.restored = None
+
+    def llmodel_get_state_size(self, model):
+        return self.max_size
+
+    def llmodel_save_state_data(self, model, buffer):
+        ctypes.memmove(buffer, self.data, len(self.data))
+        return len(self.data)
+
+    def llmodel_restore_state_data(self, model, buffer):
+        self.restored = ctypes.string_at(buffer, len(self.data))
+        return len(self.data)
+
+
+class NativeModelStateTestCase(TestCase):
+    def setUp(self):
+        self.library = FakeLibrary(max_size=100, data=b'KV cache')
+        patcher = patch.multiple(model_state, llmodel=self.library, NATIVE_STATE=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.model = LLModel()
+        self.model.model = 1  # The pointer to the native model
+        self.addCleanup(setattr, self.model, 'model', None)  # Don't destroy it
+        self.model._set_context(n_predict=0)
+
+    def test_save_and_restore(self):
+        self.model.context.n_past = 3
+        state = save_model_state(self.model)
+        self.assertEqual(state.data, b'KV cache')
+        self.assertEqual(state.n_past, 3)
+
+        self.model.context.n_past = 0
+        self.assertTrue(restore_model_state(self.model, state))
+        self.assertEqual(self.library.restored, b'KV cache')
+        self.assertEqual(self.model.context.n_past, 3)
+
+    def test_too_big(self):
+        state = ModelState(data=b'x' * 101, n_past=3, tokens=[])
+        with self.assertLogs(model_state.logger, 'WARNING'):
+            self.assertFalse(restore_model_state(self.model, state))
+        self.assertIsNone(self.library.restored)
@@ -0,0 +1,102 @@
+import os
+import signal
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+from unittest import TestCase, mock
+
+from gpt4all_cli import model_workers, web_ui
+from gpt4all_cli.benchmarks.fake_gpt4all import FakeGPT4All
+from gpt4all_cli.daemon import RemoteError
+from gpt4all_cli.model_workers import WorkerPool
+
+
+class WorkerPoolTestCase(TestCase):
+    def wait_for(self, condition, timeout=20):
+        end_time = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), end_time, 'Timeout')
+            time.sleep(0.05)
+
+    @mock.patch.object(model_workers, 'RESTART_DELAY', 0.01)
+    @mock.patch.object(model_workers, 'SUPERVISE_INTERVAL', 0.05)
+    def test_restart_crashed_worker(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            worker_pool = WorkerPool(
+                n_threads=1,
+                loader=partial(FakeGPT4All, tokens_per_second=1000),
+                path=Path(temp_dir),
+            )
+            self.assertIsNone(worker_pool.resident_chat_context('fake-model'))
+
+            chat_context = worker_pool.chat_context('fake-model')
+            self.assertEqual(chat_context.config['type'], 'fake')
+            self.assertEqual(chat_context.generate('Hi', streaming=False, max_tokens=3), 'Hello there!')
+            worker_process = worker_pool.models['fake-model']
+            self.assertIs(chat_context.worker, worker_process.worker)
+            self.assertNotEqual(worker_process.process.pid, os.getpid())
+
+            # A crash during the generation:
+            with self.assertLogs('gpt4all_cli', level='ERROR'):
+                generator = chat_context.generate('Crash', max_tokens=9999)
+                self.assertEqual(next(generator), 'Hello')
+                os.kill(worker_process.process.pid, signal.SIGKILL)
+                with self.assertRaises(RemoteError):
+                    list(generator)
+
+                # Restarted by the supervisor:
+                self.wait_for(lambda: worker_process.restarts == 1 and worker_process.alive)
+            self.assertEqual(worker_pool.restarts, 1)
+
+            # The chat context reconnects and continues the chat with its history:
+            self.assertEqual(chat_context.generate('Again', streaming=False, max_tokens=2), 'Hello there')
+            self.assertEqual(
+                [message['content'] for message in chat_context.current_chat_session[1:3]], ['Hi', 'Hello there!']
+            )
+            self.assertEqual(len(chat_context.current_chat_session), 7)
+
+            other_context = worker_pool.resident_chat_context('fake-model')
+            self.assertEqual(worker_process.ref_count, 2)
+            other_context.close()
+            chat_context.close()
+
+            # The last chat context stops the worker:
+            self.assertEqual(worker_pool.models, {})
+            self.assertIsNone(worker_process.process)
+            worker_pool.close()
+
+    def test_evict_idle_workers(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            worker_pool = WorkerPool(max_ram=100, keep_idle=True, path=Path(temp_dir))
+            self.addCleanup(worker_pool.close)
+
+            # Not started: Only the sizes of the workers are needed
+            first = worker_pool.acquire('first')
+            second = worker_pool.acquire('second')
+            first.size = second.size = 40
+            worker_pool.release(first)
+            worker_pool.release(second)
+            self.assertEqual(list(worker_pool.models), ['first', 'second'])  # Idle, but within the limit
+
+            self.assertIs(worker_pool.acquire('first'), first)  # Now the most recently used one
+            third = worker_pool.acquire('third')
+            third.size = 40
+            worker_pool.release(first)
+            self.assertEqual(list(worker_pool.models), ['first', 'third'])
+
+            # Workers in use are never stopped:
+            worker_pool.acquire('first')
+            third.size = 80
+            with self.assertLogs('gpt4all_cli', level='WARNING'):
+                worker_pool.release(worker_pool.acquire('fourth'))
+            self.assertEqual(list(worker_pool.models), ['third', 'first'])
+
+    def test_model_workers_setting(self):
+        with mock.patch.object(web_ui, 'worker_pool', None):
+            self.assertIs(web_ui.get_room_model_pool(), web_ui.model_pool)
+            with mock.patch.object(web_ui, 'MODEL_WORKERS', True):
+                worker_pool = web_ui.get_room_model_pool()
+                self.addCleanup(worker_pool.close)
+                self.assertIsInstance(worker_pool, WorkerPool)
+                self.assertIs(web_ui.get_room_model_pool(), worker_pool)
@@ -0,0 +1,114 @@
+import json
+from functools import partial
+from unittest import IsolatedAsyncioTestCase
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from gpt4all_cli.benchmarks.fake_gpt4all import FakeGPT4All
+from gpt4all_cli.instrumentation import MemorySink
+from gpt4all_cli.model_pool import ModelPool
+from gpt4all_cli.openai_api import OpenAIApi
+
+
+class OpenAIApiTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.model_pool = ModelPool(loader=partial(FakeGPT4All, tokens_per_second=1000))
+        self.stats = MemorySink()
+        self.api = OpenAIApi(model_pool=self.model_pool, stats_sinks=[self.stats], max_concurrent=2)
+        self.api.preload('fake-model')
+
+        app = web.Application()
+        app.router.add_get('/v1/models', self.api.models)
+        app.router.add_post('/v1/chat/completions', self.api.chat_completions)
+        app.router.add_post('/v1/completions', self.api.completions)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        self.api.close()
+        self.assertEqual(self.model_pool.models, {})
+
+    async def test_chat_completion(self):
+        response = await self.client.post(
+            '/v1/chat/completions',
+            json={
+                'model': 'fake-model',
+                'messages': [
+                    {'role': 'system', 'content': 'Be short.'},
+                    {'role': 'user', 'content': 'Hi'},
+                ],
+                'max_tokens': 3,
+            },
+        )
+        self.assertEqual(response.status, 200)
+        data = await response.json()
+        self.assertEqual(data['object'], 'chat.completion')
+        self.assertEqual(
+            data['choices'],
+            [{'index': 0, 'message': {'role': 'assistant', 'content': 'Hello there!'}, 'finish_reason': 'length'}],
+        )
+        self.assertEqual(data['usage'], {'completion_tokens': 3})
+        self.assertEqual(self.stats.generations, 1)
+
+        # The model stays loaded:
+        response = await self.client.get('/v1/models')
+        data = await response.json()
+        self.assertEqual([model['id'] for model in data['data']], ['fake-model'])
+
+    async def test_streaming_completion(self):
+        response = await self.client.post(
+            '/v1/completions',
+            json={'model': 'fake-model', 'prompt': 'Once upon a time', 'max_tokens': 2, 'stream': True},
+        )
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers['Content-Type'], 'text/event-stream')
+        body = await response.text()
+        events = [line.removeprefix('data: ') for line in body.split('\n\n') if line]
+        self.assertEqual(events[-1], '[DONE]')
+        chunks = [json.loads(event) for event in events[:-1]]
+        self.assertEqual([chunk['choices'][0]['text'] for chunk in chunks], ['Hello', ' there', ''])
+        self.assertEqual(chunks[-1]['choices'][0]['finish_reason'], 'length')
+
+        # The raw prompt is used, without system prompt and template:
+        pooled_model = self.model_pool.models['fake-model']
+        self.assertEqual(pooled_model.model.context.n_past, 4 + 2)
+
+    async def test_streaming_chat_completion(self):
+        response = await self.client.post(
+            '/v1/chat/completions',
+            json={'model': 'fake-model', 'messages': [{'role': 'user', 'content': 'Hi'}], 'stream': True},
+        )
+        body = await response.text()
+        events = [line.removeprefix('data: ') for line in body.split('\n\n') if line]
+        self.assertEqual(events[-1], '[DONE]')
+        deltas = [json.loads(event)['choices'][0]['delta'] for event in events[:-1]]
+        self.assertEqual(deltas[0], {'role': 'assistant'})
+        self.assertEqual(deltas[-1], {})
+        self.assertEqual(len(deltas), 200 + 2)
+
+    async def test_errors(self):
+        response = await self.client.post('/v1/chat/completions', json={'model': 'fake-model', 'messages': []})
+        self.assertEqual(response.status, 400)
+        data = await response.json()
+        self.assertEqual(data['error'], {'message': '"messages" is required', 'type': 'invalid_request_error'})
+
+        response = await self.client.post('/v1/completions', data='no json')
+        self.assertEqual(response.status, 400)
+
+        self.api.active_requests = 2
+        response = await self.client.post('/v1/completions', json={'model': 'fake-model', 'prompt': 'Hi'})
+        self.assertEqual(response.status, 429)
+        self.api.active_requests = 0
+
+    async def test_model_not_served(self):
+        for stream in (False, True):
+            response = await self.client.post(
+                '/v1/completions', json={'model': 'other-model', 'prompt': 'Hi', 'stream': stream}
+            )
+            self.assertEqual(response.status, 404)
+            data = await response.json()
+            self.assertEqual(data['error']['code'], 'model_not_found')
+        # Not loaded (or downloaded):
+        self.assertEqual(list(self.model_pool.models), ['fake-model'])
@@ -0,0 +1,83 @@
+import tempfile
+from functools import partial
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from gpt4all import LLModel
+
+from gpt4all_cli import model_state
+from gpt4all_cli.bench import run_prefix_cache_bench
+from gpt4all_cli.benchmarks.fake_gpt4all import FakeGPT4All
+from gpt4all_cli.model_pool import ModelPool
+from gpt4all_cli.model_state import ModelState
+from gpt4all_cli.prefix_cache import PrefixCache
+from gpt4all_cli.tests.test_model_state import FakeLibrary
+
+
+class PrefixCacheTestCase(TestCase):
+    def test_new_sessions(self):
+        prefix_cache = PrefixCache()
+        model_pool = ModelPool(loader=partial(FakeGPT4All, tokens_per_second=1000), prefix_cache=prefix_cache)
+        keep_loaded = model_pool.chat_context('fake-model')
+        model = keep_loaded.model
+
+        first = model_pool.chat_context('fake-model')
+        self.assertEqual(first.generate('Hi', streaming=False, max_tokens=3), 'Hello there!')
+        self.assertEqual((prefix_cache.hits, prefix_cache.misses), (0, 1))
+        # System prompt (6 words) + prompt with template (5 words):
+        self.assertEqual(model.evaluated, 6 + 5)
+        n_past = model.context.n_past
+
+        second = model_pool.chat_context('fake-model')
+        self.assertEqual(second.generate('Hi', streaming=False, max_tokens=3), 'Hello there!')
+        self.assertEqual((prefix_cache.hits, prefix_cache.misses), (1, 1))
+        # Only the prompt was evaluated:
+        self.assertEqual(model.evaluated, 6 + 5 + 5)
+        self.assertEqual(model.context.n_past, n_past)
+
+        # The first session replays its history after the cached system prompt:
+        first.generate('Bye', streaming=False, max_tokens=2)
+        self.assertEqual((prefix_cache.hits, prefix_cache.misses), (2, 1))
+        self.assertEqual(model.evaluated, 6 + 5 + 5 + (5 + 2 + 5))
+
+        for chat_context in (first, second, keep_loaded):
+            chat_context.close()
+
+    def test_lru_and_disk(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir)
+            prefix_cache = PrefixCache(max_entries=1, path=path)
+            prefix_cache.put('a', ModelState(data=b'A', n_past=1, tokens=[1]))
+            prefix_cache.put('b', ModelState(data=b'B', n_past=2, tokens=[2]))
+            self.assertEqual(list(prefix_cache.states), ['b'])
+
+            # Loaded from disk:
+            other_cache = PrefixCache(path=path)
+            self.assertEqual(other_cache.get('a'), ModelState(data=b'A', n_past=1, tokens=[1]))
+            self.assertEqual(list(other_cache.states), ['a'])
+            self.assertIsNone(other_cache.get('c'))
+
+    def test_bench(self):
+        result = run_prefix_cache_bench(
+            model_name='fake-model',
+            n_threads=1,
+            loader=partial(FakeGPT4All, tokens_per_second=1000, prompt_tokens_per_second=200),
+        )
+        self.assertLess(result.cache_hit, result.without_cache)
+        self.assertLess(result.cache_hit, result.cache_miss)
+
+    def test_native_state_hit(self):
+        # The saved state is smaller than the max. state size of the library:
+        library = FakeLibrary(max_size=100, data=b'System prompt')
+        model = LLModel()
+        model.model = 1  # The pointer to the native model
+        self.addCleanup(setattr, model, 'model', None)  # Don't destroy it
+
+        prefix_cache = PrefixCache()
+        prefix_cache.put('key', ModelState(data=b'System prompt', n_past=6, tokens=[1, 2]))
+        with patch.multiple(model_state, llmodel=library, NATIVE_STATE=True):
+            self.assertTrue(prefix_cache.apply(model, key='key', prefix='System prompt'))
+        self.assertEqual((prefix_cache.hits, prefix_cache.misses), (1, 0))
+        self.assertEqual(library.restored, b'System prompt')
+        self.assertEqual(model.context.n_past, 6)
@@ -0,0 +1,97 @@
+from functools import partial
+from unittest import TestCase
+
+from gpt4all_cli.benchmarks.fake_gpt4all import FakeGPT4All
+from gpt4all_cli.model_pool import ModelPool
+from gpt4all_cli.response_cache import ResponseCache, cached_generate
+
+
+class ResponseCacheTestCase(TestCase):
+    def test_ttl_and_lru(self):
+        now = 0.0
+        response_cache = ResponseCache(path=':memory:', max_entries=2, ttl=10, clock=lambda: now)
+        response_cache.put('a', ['A'])
+        now = 1.0
+        response_cache.put('b', ['B'])
+        now = 2.0
+        self.assertEqual(response_cache.get('a'), ['A'])  # "a" is now newer than "b"
+        response_cache.put('c', ['C'])
+        self.assertEqual(len(response_cache), 2)
+        self.assertIsNone(response_cache.get('b'))
+        self.assertEqual(response_cache.get('c'), ['C'])
+
+        now = 12.5
+        self.assertIsNone(response_cache.get('a'))  # expired
+        self.assertEqual((response_cache.hits, response_cache.misses), (2, 2))
+        response_cache.close()
+
+    def test_cached_generate(self):
+        response_cache = ResponseCache(path=':memory:')
+        model_pool = ModelPool(loader=partial(FakeGPT4All, tokens_per_second=1000))
+        keep_loaded = model_pool.chat_context('fake-model')
+        model = keep_loaded.model
+
+        first = model_pool.chat_context('fake-model')
+        tokens = list(cached_generate(first, 'Hi', response_cache=response_cache, max_tokens=3, temp=0.0))
+        self.assertEqual(tokens, ['Hello', ' there', '!'])
+        self.assertEqual((response_cache.hits, response_cache.misses), (0, 1))
+        evaluated = model.evaluated
+
+        # Same prompt with the same history: The answer is replayed
+        second = model_pool.chat_context('fake-model')
+        tokens = list(cached_generate(second, 'Hi', response_cache=response_cache, max_tokens=3, temp=0.0))
+        self.assertEqual(tokens, ['Hello', ' there', '!'])
+        self.assertEqual((response_cache.hits, response_cache.misses), (1, 1))
+        self.assertEqual(model.evaluated, evaluated)
+        self.assertEqual(second.current_chat_session, first.current_chat_session)
+
+        # Other generation arguments or another history are not cached:
+        list(cached_generate(second, 'Hi', response_cache=response_cache, max_tokens=4, temp=0.0))
+        self.assertEqual((response_cache.hits, response_cache.misses), (1, 2))
+        self.assertGreater(model.evaluated, evaluated)
+
+        # Sampled answers are not cached, without the opt-in:
+        for _ in range(2):
+            list(cached_generate(second, 'Hi', response_cache=response_cache, max_tokens=3, temp=0.5))
+        self.assertEqual((response_cache.hits, response_cache.misses), (1, 2))
+        response_cache.cache_sampled = True
+        for _ in range(2):
+            chat_context = model_pool.chat_context('fake-model')
+            list(cached_generate(chat_context, 'Sampled', response_cache=response_cache, max_tokens=3, temp=0.5))
+            chat_context.close()
+        self.assertEqual((response_cache.hits, response_cache.misses), (2, 3))
+        response_cache.cache_sampled = False
+
+        # A cancelled answer is not stored:
+        third = model_pool.chat_context('fake-model')
+        tokens = list(
+            cached_generate(
+                third,
+                'Stop',
+                response_cache=response_cache,
+                max_tokens=5,
+                temp=0.0,
+                callback=lambda token_id, response: token_id < 1,
+            )
+        )
+        self.assertEqual(tokens, ['Hello'])
+        self.assertEqual(len(response_cache), 3)
+
+        # A cancelled replay: The history contains only the replayed tokens
+        fourth = model_pool.chat_context('fake-model')
+        tokens = list(
+            cached_generate(
+                fourth,
+                'Hi',
+                response_cache=response_cache,
+                max_tokens=3,
+                temp=0.0,
+                callback=lambda token_id, response: token_id < 2,
+            )
+        )
+        self.assertEqual(tokens, ['Hello', ' there'])
+        self.assertEqual((response_cache.hits, response_cache.misses), (3, 4))
+        self.assertEqual(fourth.current_chat_session[-1], {'role': 'assistant', 'content': 'Hello there'})
+
+        for chat_context in (first, second, third, fourth, keep_loaded):
+            chat_context.close()
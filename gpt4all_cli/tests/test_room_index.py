@@ -0,0 +1,76 @@
+from unittest import TestCase
+
+from gpt4all_cli.data_classes import RoomData, RoomState
+from gpt4all_cli.room_index import RoomIndex, RoomRow
+
+
+class FakeTimer:
+    def __init__(self, timers: list):
+        self.timers = timers
+
+    def __call__(self, delay, func):
+        self.timers.append((delay, func))
+        return self
+
+    def start(self):
+        pass
+
+
+class RoomIndexTestCase(TestCase):
+    def test_debounce(self):
+        now = 0.0
+        timers = []
+        diffs = []
+        room_index = RoomIndex(
+            send_func=diffs.append,
+            interval=0.5,
+            clock=lambda: now,
+            timer_factory=FakeTimer(timers),
+        )
+        rooms = {'a': RoomData(gpt_model_name='model', state=RoomState.LOADING)}
+
+        # The first change is sent immediately:
+        room_index.touch(rooms)
+        self.assertEqual([delay for delay, _ in timers], [0.0])
+        timers.pop()[1]()
+        self.assertEqual(diffs, [{'a': RoomRow(gpt_model_name='model', state='loading', user_count=0)}])
+
+        # Changes within the interval are merged into one diff:
+        now = 0.1
+        rooms['a'].state = RoomState.FREE
+        room_index.touch(rooms)
+        for user_name in ('foo', 'bar'):
+            rooms['a'].users.append(user_name)
+            room_index.touch(rooms)
+        rooms['b'] = RoomData(gpt_model_name='model')
+        room_index.touch(rooms)
+        self.assertEqual([delay for delay, _ in timers], [0.4])
+        now = 0.5
+        timers.pop()[1]()
+        self.assertEqual(
+            diffs[1],
+            {
+                'a': RoomRow(gpt_model_name='model', state='free', user_count=2),
+                'b': RoomRow(gpt_model_name='model', state='free', user_count=0),
+            },
+        )
+
+        # Nothing is sent, if the rooms are changed back:
+        now = 2.0
+        rooms['a'].state = RoomState.GPT_WRITES
+        room_index.touch(rooms)
+        rooms['a'].state = RoomState.FREE
+        room_index.touch(rooms)
+        self.assertEqual([delay for delay, _ in timers], [0.0])
+        timers.pop()[1]()
+        self.assertEqual(len(diffs), 2)
+
+        # Closed rooms:
+        now = 2.1
+        del rooms['b']
+        room_index.touch(rooms)
+        now = 2.5
+        timers.pop()[1]()
+        self.assertEqual(diffs[2], {'b': None})
+
+        self.assertEqual((room_index.touch_count, room_index.publish_count), (8, 3))
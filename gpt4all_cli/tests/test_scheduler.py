@@ -0,0 +1,125 @@
+import threading
+import time
+from unittest import TestCase
+
+from gpt4all_cli.scheduler import (
+    GenerationJob,
+    GenerationQueue,
+    InferenceScheduler,
+    ModelWorker,
+    Priority,
+    QueueFullError,
+    ThreadPolicy,
+)
+
+
+class SchedulerTestCase(TestCase):
+    def test_queues(self):
+        worker = ModelWorker(name='test')
+        started = threading.Event()
+        release = threading.Event()
+        done = threading.Event()
+        calls = []
+
+        def blocking_job(job):
+            started.set()
+            release.wait(timeout=5)
+            calls.append(job.name)
+
+        def job(job):
+            calls.append(job.name)
+            if job.name == 'last':
+                done.set()
+
+        changes = []
+        room1 = GenerationQueue(worker=worker, max_depth=2, on_change=lambda jobs: changes.append(len(jobs)))
+        room2 = GenerationQueue(worker=worker, max_depth=2)
+
+        room1.submit(GenerationJob(func=blocking_job, name='block'))
+        self.assertTrue(started.wait(timeout=5))
+        changes.clear()
+
+        # The worker is busy -> jobs are waiting:
+        self.assertEqual(room1.submit(GenerationJob(func=job, name='1a', owner='alice')), 1)
+        self.assertEqual(room1.submit(GenerationJob(func=job, name='1b', owner='bob')), 2)
+        with self.assertRaises(QueueFullError):
+            room1.submit(GenerationJob(func=job, name='1c'))
+        self.assertTrue(room1.is_full())
+
+        room2.submit(GenerationJob(func=job, name='2a'))
+        room2.submit(GenerationJob(func=job, name='last'))
+
+        room1.cancel(owner='bob')
+        self.assertEqual([job.name for job in room1.jobs], ['1a'])
+
+        release.set()
+        self.assertTrue(done.wait(timeout=5))
+
+        # Round robin between the rooms, FIFO in every room:
+        self.assertEqual(calls, ['block', '2a', '1a', 'last'])
+        self.assertEqual(changes, [1, 2, 1, 0])
+
+        thread = worker.thread
+        room1.close()
+        room2.close()
+        thread.join(timeout=5)
+        self.assertIsNone(worker.thread)
+
+    def test_cancel_running_job(self):
+        worker = ModelWorker(name='test')
+        queue = GenerationQueue(worker=worker, max_depth=1)
+        running = threading.Event()
+        cancelled = threading.Event()
+
+        def job(job):
+            running.set()
+            while job.keep_generating(token_id=0, response=''):
+                pass
+            cancelled.set()
+
+        queue.submit(GenerationJob(func=job, owner='alice'))
+        self.assertTrue(running.wait(timeout=5))
+        queue.cancel(owner='alice')
+        self.assertTrue(cancelled.wait(timeout=5))
+        queue.close()
+
+
+class InferenceSchedulerTestCase(TestCase):
+    def test_fair(self):
+        scheduler = InferenceScheduler(thread_budget=8, max_concurrent=2)
+        with scheduler.slot(name='a') as n_threads:
+            self.assertEqual(n_threads, 4)
+            with scheduler.slot(name='b', priority=Priority.BACKGROUND) as n_threads:
+                self.assertEqual(n_threads, 4)
+                self.assertEqual(scheduler.free_threads, 0)
+        self.assertEqual(scheduler.free_threads, 8)
+
+    def test_greedy(self):
+        scheduler = InferenceScheduler(thread_budget=8, max_concurrent=2, policy=ThreadPolicy.GREEDY)
+        with scheduler.slot(name='a') as n_threads:
+            self.assertEqual(n_threads, 8)
+        with scheduler.slot(name='b', priority=Priority.BACKGROUND) as n_threads:
+            self.assertEqual(n_threads, 4)
+
+    def test_max_concurrent_and_priority(self):
+        scheduler = InferenceScheduler(thread_budget=4, max_concurrent=1)
+        order = []
+
+        def generate(name, priority):
+            with scheduler.slot(name=name, priority=priority):
+                order.append(name)
+
+        with scheduler.slot(name='first'):
+            threads = [
+                threading.Thread(target=generate, args=('background', Priority.BACKGROUND)),
+                threading.Thread(target=generate, args=('interactive', Priority.INTERACTIVE)),
+            ]
+            for thread in threads:
+                thread.start()
+                while len(scheduler.waiting) < threads.index(thread) + 1:
+                    time.sleep(0.001)
+
+        for thread in threads:
+            thread.join(timeout=5)
+
+        self.assertEqual(order, ['interactive', 'background'])
@@ -0,0 +1,82 @@
+import tempfile
+from functools import partial
+from pathlib import Path
+from unittest import TestCase
+
+from gpt4all_cli.benchmarks.fake_gpt4all import FakeGPT4All
+from gpt4all_cli.model_pool import ModelPool
+from gpt4all_cli.sessions import ModelState, SessionSnapshot, restore_session, save_session
+
+
+class SessionsTestCase(TestCase):
+    def setUp(self):
+        self.model_pool = ModelPool(loader=partial(FakeGPT4All, tokens_per_second=1000))
+
+    def test_save_and_restore(self):
+        chat_context = self.model_pool.chat_context('fake-model')
+        self.assertEqual(chat_context.generate('Hi', streaming=False, max_tokens=3), 'Hello there!')
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir)
+            snapshot = save_session(chat_context, session_id='test', messages=[['abc', 'message', 'Hi']], path=path)
+            self.assertEqual(snapshot.state.n_past, 14)
+            self.assertEqual(snapshot.message_count, 2)
+            chat_context.close()
+
+            snapshot = SessionSnapshot.load('test', path=path)
+
+        self.assertEqual(snapshot.model_name, 'fake-model')
+        self.assertEqual(snapshot.messages, [['abc', 'message', 'Hi']])
+        self.assertEqual(
+            snapshot.history[1:],
+            [{'role': 'user', 'content': 'Hi'}, {'role': 'assistant', 'content': 'Hello there!'}],
+        )
+
+        chat_context = self.model_pool.chat_context('fake-model')
+        result = restore_session(chat_context, snapshot)
+        self.assertEqual(result.messages, 2)
+        self.assertTrue(result.native)
+
+        # The model state was restored, nothing was evaluated:
+        pooled_model = chat_context.pooled_model
+        self.assertIs(pooled_model.active_context, chat_context)
+        self.assertEqual(pooled_model.model.context.n_past, 14)
+        self.assertEqual(pooled_model.model.evaluated, 0)
+
+        # The next answer continues the restored context:
+        chat_context.generate('Bye', streaming=False, max_tokens=2)
+        self.assertEqual(pooled_model.model.context.n_past, 14 + 5 + 2)  # Only the new prompt + answer
+        self.assertEqual(len(chat_context.current_chat_session), 5)
+        chat_context.close()
+
+        # Without a model state, the history is evaluated again:
+        snapshot.state = None
+        chat_context = self.model_pool.chat_context('fake-model')
+        result = restore_session(chat_context, snapshot)
+        self.assertFalse(result.native)
+        pooled_model = chat_context.pooled_model
+        self.assertIs(pooled_model.active_context, chat_context)
+        self.assertEqual(pooled_model.model.evaluated, 13)
+        chat_context.close()
+
+    def test_model_state_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir)
+            snapshot = SessionSnapshot(
+                session_id='with-state',
+                model_name='a-model',
+                history=[{'role': 'system', 'content': ''}],
+                state=ModelState(data=b'\x00\x01', n_past=2, tokens=[1, 2]),
+            )
+            snapshot.save(path)
+            self.assertEqual(sorted(item.name for item in path.iterdir()), ['with-state.json', 'with-state.state'])
+            self.assertEqual(SessionSnapshot.load('with-state', path=path), snapshot)
+
+            snapshot.state = None
+            snapshot.save(path)
+            self.assertEqual(sorted(item.name for item in path.iterdir()), ['with-state.json'])
+
+            with self.assertRaises(FileNotFoundError):
+                SessionSnapshot.load('unknown', path=path)
+            with self.assertRaisesRegex(ValueError, 'Invalid session id'):
+                SessionSnapshot.load('../etc', path=path)
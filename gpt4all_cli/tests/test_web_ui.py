@@ -0,0 +1,130 @@
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import TestCase, mock
+
+from gpt4all_cli import web_ui
+from gpt4all_cli.data_classes import ChatMessage, MessageTypeEnum, RoomData, RoomState
+from gpt4all_cli.web_ui import (
+    GPT_WRITE_ELLIPSIS,
+    ChatLine,
+    MessageScrollerDiv,
+    Span,
+    StreamingText,
+    get_history_lines,
+    history_cache_hits,
+    history_cache_misses,
+    schedule_room_close,
+)
+
+
+class StreamingTextTestCase(TestCase):
+    def test_append_text(self):
+        text = StreamingText()
+        self.assertEqual(text.get_text(), GPT_WRITE_ELLIPSIS)
+
+        text.append_text('Hello')
+        text.append_text(' <World>')
+        self.assertEqual(text.text, 'Hello <World>')
+        # Only new text nodes are added in front of the ellipsis:
+        self.assertEqual([str(node) for node in text.nodes[:2]], ['Hello', ' <World>'])
+        self.assertIs(text.nodes[2], text.ellipsis)
+
+        text.complete()
+        self.assertEqual(len(text.nodes), 2)
+        self.assertNotIn(GPT_WRITE_ELLIPSIS, text.get_text())
+
+    def test_no_answer(self):
+        text = StreamingText()
+        text.complete()
+        self.assertEqual(text.get_text(), '<No answer from GPT>')
+
+
+class MessageScrollerDivTestCase(TestCase):
+    def test_index(self):
+        scroller = MessageScrollerDiv(lines=2)
+
+        def add_message(message_id, index=None):
+            line = ChatLine(message_id=message_id, user_name='user', dt=datetime.now(), text=Span(message_id))
+            return scroller.add_message(line, index=index)
+
+        self.assertTrue(add_message('b'))
+        self.assertTrue(add_message('a', index=0))
+        self.assertFalse(add_message('b'))  # Already displayed
+        self.assertEqual(list(scroller.messages), ['b', 'a'])
+
+        # The oldest line is trimmed and removed from the index:
+        self.assertTrue(add_message('c'))
+        self.assertEqual(sorted(scroller.messages), ['b', 'c'])
+        self.assertIsNone(scroller.get_message('a'))
+        self.assertEqual(scroller.get_message('c').text.get_text(), 'c')
+        self.assertEqual([line.message_id for line in scroller.body.nodes], ['b', 'c'])
+
+    def test_add_history(self):
+        scroller = MessageScrollerDiv(lines=3)
+
+        def get_line(message_id):
+            return ChatLine(message_id=message_id, user_name='user', dt=datetime.now(), text=Span(message_id))
+
+        # A message that was received, before the history was loaded:
+        scroller.add_message(get_line('c'))
+
+        self.assertEqual(scroller.add_history([get_line('a'), get_line('b'), get_line('c')]), 2)
+        self.assertEqual([line.message_id for line in scroller.body.nodes], ['a', 'b', 'c'])
+        self.assertEqual(scroller.add_history([get_line('b')]), 0)
+
+        # The oldest lines are trimmed:
+        self.assertEqual(scroller.add_history([get_line('x'), get_line('y')]), 2)
+        self.assertEqual([line.message_id for line in scroller.body.nodes], ['a', 'b', 'c'])
+        self.assertEqual(sorted(scroller.messages), ['a', 'b', 'c'])
+
+
+class HistoryLinesTestCase(TestCase):
+    def test_cache(self):
+        room_data = RoomData(gpt_model_name='model', back_log=2)
+        self.assertEqual(get_history_lines(room_data), ())
+
+        room_data.logs.append(ChatMessage(id='1', type=MessageTypeEnum.JOIN, text='Joined', user_name='foo'))
+        room_data.logs.append(ChatMessage(id='2', type=MessageTypeEnum.MESSAGE, text='Hi', user_name='foo'))
+        hits, misses = history_cache_hits.value, history_cache_misses.value
+        lines = get_history_lines(room_data)
+        self.assertIs(get_history_lines(room_data), lines)
+        self.assertEqual((history_cache_hits.value - hits, history_cache_misses.value - misses), (1, 1))
+        self.assertEqual([(line.text, line.color) for line in lines], [('*Joined*', 'lime'), ('Hi', None)])
+
+        # Every view gets its own nodes:
+        chat_line = lines[0].get_chat_line()
+        self.assertIsNot(lines[0].get_chat_line(), chat_line)
+        self.assertEqual(chat_line.text.style['color'], 'lime')
+
+        # A new message invalidates the cache, even if the history is full:
+        room_data.logs.append(ChatMessage(id='3', type=MessageTypeEnum.LEAVE, text='Left', user_name='foo'))
+        self.assertEqual([line.message_id for line in get_history_lines(room_data)], ['2', '3'])
+
+
+@mock.patch.object(web_ui, 'ROOM_CLOSE_DELAY', 0.01)
+@mock.patch.object(web_ui.room_index, 'touch')
+class RoomCloseTestCase(TestCase):
+    def test_close_unused_room(self, touch):
+        room_data = RoomData(gpt_model_name='model', state=RoomState.LOADING)
+        server = SimpleNamespace(state={'rooms': {'room': room_data}})
+
+        # Not closed while the model is loading, nobody can join before:
+        schedule_room_close(server=server, room_name='room', room_data=room_data)
+        time.sleep(0.1)
+        self.assertIs(server.state['rooms']['room'], room_data)
+
+        room_data.state = RoomState.FREE
+        for _ in range(100):
+            if not server.state['rooms']:
+                break
+            time.sleep(0.01)
+        self.assertEqual(server.state['rooms'], {})
+
+    def test_joined_room(self, touch):
+        room_data = RoomData(gpt_model_name='model')
+        server = SimpleNamespace(state={'rooms': {'room': room_data}})
+        schedule_room_close(server=server, room_name='room', room_data=room_data)
+        room_data.users.append('foo')
+        room_data.close_timer.join()
+        self.assertIs(server.state['rooms']['room'], room_data)
@@ -0,0 +1,50 @@
+from unittest import TestCase
+
+from gpt4all_cli.welcome_cache import WelcomeCache
+
+
+class SyncExecutor:
+    def submit(self, func):
+        func()
+
+
+class WelcomeCacheTestCase(TestCase):
+    def test_basic(self):
+        now = 0
+        texts = iter(['Hi!', 'Hello!', 'Welcome!'])
+        cache = WelcomeCache(
+            generate_func=lambda: next(texts, None),
+            size=2,
+            ttl=60,
+            executor=SyncExecutor(),
+            clock=lambda: now,
+        )
+
+        # The first call can't return a message, but fills the cache:
+        self.assertIsNone(cache.get())
+        self.assertEqual([cache.get(), cache.get(), cache.get()], ['Hi!', 'Hello!', 'Hi!'])
+
+        # Expired messages are replaced:
+        now = 100
+        self.assertIsNone(cache.get())
+        self.assertEqual([cache.get(), cache.get()], ['Welcome!', 'Welcome!'])
+        self.assertFalse(cache.refilling)
+
+    def test_expire_rotated(self):
+        now = 0
+        cache = WelcomeCache(
+            generate_func=lambda: 'New!',
+            size=2,
+            ttl=60,
+            executor=SyncExecutor(),
+            clock=lambda: now,
+        )
+        cache.messages.extend([(0, 'Old!'), (30, 'Hi!')])
+
+        now = 50
+        self.assertEqual(cache.get(), 'Old!')  # Rotated behind the newer message
+
+        # The expired message is dropped, even if it's not the first one, and a new message is generated:
+        now = 70
+        self.assertEqual(cache.get(), 'Hi!')
+        self.assertEqual([text for _, text in cache.messages], ['Hi!', 'New!'])
@@ -1,14 +1,20 @@
+import collections
+import dataclasses
 import html
 import logging
 import multiprocessing
 import re
 import socket
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from time import time
+from functools import partial
+from pathlib import Path
+from threading import Lock, Timer
+from time import monotonic, time
 from uuid import uuid1, uuid4
 
-from gpt4all import GPT4All, LLModel
-from lona import App, Channel, RedirectResponse, View
+from bx_py_utils.humanize.time import human_timedelta
+from lona import App, Channel, RedirectResponse, Response, View
 from lona.channels import Message
 from lona.html import H2, Option2, Select2
 from lona_picocss import install_picocss
@@ -19,6 +25,7 @@ from lona_picocss.html import (
     Br,
     Div,
     InlineButton,
+    NumberInput,
     P,
     ScrollerDiv,
     Span,
@@ -33,100 +40,457 @@ from lona_picocss.html import (
     Tr,
 )
 
+from gpt4all_cli.daemon import RemoteChatContext
 from gpt4all_cli.data_classes import ChatMessage, MessageTypeEnum, RoomData, RoomState
+from gpt4all_cli.instrumentation import GenerationRecorder, JsonLinesSink, LogSink, MemorySink, StopReason
+from gpt4all_cli.metrics import (
+    LOAD_TIME_BUCKETS,
+    PROMETHEUS_CONTENT_TYPE,
+    Counter,
+    MetricsWriter,
+    SynchronizedHistogram,
+)
+from gpt4all_cli.model_pool import ModelPool, PooledModel, get_total_ram
+from gpt4all_cli.model_workers import WorkerPool, WorkerProcess
+from gpt4all_cli.openai_api import OpenAIApi
+from gpt4all_cli.prefix_cache import PREFIX_CACHE_SIZE, PrefixCache
+from gpt4all_cli.response_cache import ResponseCache, cached_generate
+from gpt4all_cli.room_index import RoomIndex, RoomRow, get_room_rows
+from gpt4all_cli.scheduler import (
+    GenerationJob,
+    GenerationQueue,
+    InferenceScheduler,
+    Priority,
+    QueueFullError,
+    ThreadPolicy,
+)
+from gpt4all_cli.sessions import SessionSnapshot, restore_session, save_session
+from gpt4all_cli.streaming import TokenCoalescer
+from gpt4all_cli.welcome_cache import WelcomeCache
 
 
 logger = logging.getLogger(__name__)
 
 
 NAME = re.compile(r'^([a-zA-Z0-9-_]{1,})$')
-MESSAGE_BACK_LOG = 10
+MESSAGE_BACK_LOG = 10  # Default number of messages in the room history
+MAX_MESSAGE_BACK_LOG = 1000
+HISTORY_MESSAGE_TYPES = (MessageTypeEnum.MESSAGE, MessageTypeEnum.JOIN, MessageTypeEnum.LEAVE)
+HISTORY_COLORS = {MessageTypeEnum.JOIN: 'lime', MessageTypeEnum.LEAVE: 'red'}
 GPT_WRITE_ELLIPSIS = '\N{MIDLINE HORIZONTAL ELLIPSIS}'  # U+22EF
-# GPT_WRITE_ELLIPSIS = '\N{HORIZONTAL ELLIPSIS}'  # U+2026
 
 WELCOME_PROMPT = 'Create a nice, short welcoming message to a new visitor of this chat.'
 WELCOME_MAX_TOKENS = 50
+WELCOME_MESSAGE = True  # Send a welcome message on every join?
+# Pre-generate welcome messages per model in the background.
+# Set size to 0 to generate a new message on every join with the room chat session:
+WELCOME_CACHE_SIZE = 5
+WELCOME_CACHE_TTL = 60 * 60  # seconds
+WELCOME_FALLBACK_MESSAGE = 'Welcome to this chat!'  # If no cached message exists, yet
 MAX_TOKENS = 100
 
+# Send the streamed GPT tokens in batches to the clients:
+TOKEN_FLUSH_INTERVAL = 0.05  # seconds
+TOKEN_FLUSH_MAX_BYTES = 256
+
+# Max. number of waiting prompts per room:
+MAX_QUEUE_DEPTH = 5
+
+# Close a room (and unload the model, if no other room uses it) if nobody joined it again:
+ROOM_CLOSE_DELAY = 60  # seconds
+
+# Models are shared between rooms. Keep unused models loaded, until the limit is reached?
+MODEL_POOL_KEEP_IDLE = False
+TOTAL_RAM = get_total_ram()
+MODEL_POOL_MAX_RAM = int(TOTAL_RAM * 0.75) if TOTAL_RAM else None
+
+# All generations of all rooms share the CPU threads:
+THREAD_BUDGET = multiprocessing.cpu_count()
+MAX_CONCURRENT_GENERATIONS = 2
+THREAD_POLICY = ThreadPolicy.FAIR
+
+scheduler = InferenceScheduler(
+    thread_budget=THREAD_BUDGET,
+    max_concurrent=MAX_CONCURRENT_GENERATIONS,
+    policy=THREAD_POLICY,
+)
+# New rooms restore the model state after the system prompt from this cache:
+prefix_cache = PrefixCache(max_entries=PREFIX_CACHE_SIZE)
+model_pool = ModelPool(
+    max_ram=MODEL_POOL_MAX_RAM,
+    keep_idle=MODEL_POOL_KEEP_IDLE,
+    scheduler=scheduler,
+    prefix_cache=prefix_cache,
+)
+
+# Load the models of the rooms in worker processes: A crash of a model doesn't stop the server
+# and the generations don't hold the GIL of the server process.
+# The models of the OpenAI compatible API are still loaded in the server process: A model that is
+# used by rooms and the API is resident twice, max. RAM and idle models are handled per pool.
+MODEL_WORKERS = False
+worker_pool: WorkerPool | None = None  # Started on first use
+worker_pool_lock = Lock()
+
+
+def get_room_model_pool() -> ModelPool | WorkerPool:
+    global worker_pool
+
+    if not MODEL_WORKERS:
+        return model_pool
+    with worker_pool_lock:
+        if worker_pool is None:
+            # The worker processes don't schedule on their own: All generations share the THREAD_BUDGET
+            worker_pool = WorkerPool(
+                n_threads=scheduler.fair_share,
+                scheduler=scheduler,
+                max_ram=MODEL_POOL_MAX_RAM,
+                keep_idle=MODEL_POOL_KEEP_IDLE,
+            )
+        return worker_pool
+
+
+# Timings of all generations: Logged and aggregated for the stats table.
+# Set a path to store every generation as JSON line, too:
+GENERATION_STATS_FILE: Path | None = None
+generation_stats = MemorySink()
+GENERATION_STATS_SINKS: list = [LogSink(), generation_stats]
+if GENERATION_STATS_FILE:
+    GENERATION_STATS_SINKS.append(JsonLinesSink(GENERATION_STATS_FILE))
+
+# Opt-in: Replay the cached answer, if a room gets an identical prompt with identical history.
+# The rooms sample their answers (temp > 0), these are only cached with RESPONSE_CACHE_SAMPLED:
+# The first sampled answer of a prompt is replayed forever.
+RESPONSE_CACHE = False
+RESPONSE_CACHE_SAMPLED = False
+response_cache = ResponseCache(cache_sampled=RESPONSE_CACHE_SAMPLED) if RESPONSE_CACHE else None
+
+# Metrics for the /metrics route:
+channel_messages = Counter()
+history_cache_hits = Counter()
+history_cache_misses = Counter()
+model_load_time = SynchronizedHistogram(buckets=LOAD_TIME_BUCKETS)
+
+# The lobby gets the changes of the room list as diffs, at most once per interval:
+ROOM_INDEX_CHANNEL = 'lobby.rooms'  # Must not match the 'chat.room.*' channels
+ROOM_INDEX_INTERVAL = 0.5  # seconds
+
+
+def send_room_index(changes: dict[str, RoomRow | None]) -> None:
+    send_to_room(Channel(ROOM_INDEX_CHANNEL), {'rooms': changes})
+
+
+room_index = RoomIndex(send_func=send_room_index, interval=ROOM_INDEX_INTERVAL)
+
+# Save the chat session of a room on close and restore it, if a room with the same name is created:
+ROOM_SNAPSHOTS = True
+
+# Models are loaded in the background, so that the Lona view threads are not blocked:
+room_loader = ThreadPoolExecutor(max_workers=2, thread_name_prefix='room_loader')
+
+welcome_cache_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='welcome_cache')
+welcome_caches: dict[str, WelcomeCache] = {}
+welcome_caches_lock = Lock()
+
+
+def generate_welcome_message(gpt_model_name: str) -> str | None:
+    # Use a separate chat context: The chat history of the rooms should not contain welcome messages.
+    # It's detached: The next answer of a room continues with the model state of its chat.
+    chat_context = get_room_model_pool().resident_chat_context(gpt_model_name, detached=True)
+    if chat_context is None:
+        # Model was unloaded in the meantime
+        return None
+    try:
+        text = ''.join(
+            chat_context.generate(WELCOME_PROMPT, max_tokens=WELCOME_MAX_TOKENS, priority=Priority.BACKGROUND)
+        )
+    finally:
+        chat_context.close()
+    return text.strip() or None
+
+
+def get_welcome_cache(gpt_model_name: str) -> WelcomeCache:
+    with welcome_caches_lock:
+        welcome_cache = welcome_caches.get(gpt_model_name)
+        if welcome_cache is None:
+            welcome_cache = WelcomeCache(
+                generate_func=partial(generate_welcome_message, gpt_model_name),
+                size=WELCOME_CACHE_SIZE,
+                ttl=WELCOME_CACHE_TTL,
+                executor=welcome_cache_executor,
+            )
+            welcome_caches[gpt_model_name] = welcome_cache
+        return welcome_cache
+
+
+def send_to_room(channel: Channel, message_data: dict) -> None:
+    channel_messages.inc()
+    channel.send(message_data=message_data)
+
+
+def send_room_state(*, server, room_name: str, room_data: RoomData, state: RoomState, info: str) -> None:
+    room_data.state = state
+    room_data.state_info = info
+    send_to_room(Channel(f'chat.room.{room_name}'), {'room_state': state})
+    room_index.touch(server.state['rooms'])
+
+
+def send_queue_state(jobs: list[GenerationJob], *, room_name: str) -> None:
+    send_to_room(Channel(f'chat.room.{room_name}'), {'queue': [job.owner for job in jobs]})
+
+
+def get_room_session_id(room_name: str) -> str:
+    return f'room-{room_name}'
+
+
+def load_room_snapshot(*, room_name: str, gpt_model_name: str) -> SessionSnapshot | None:
+    if not ROOM_SNAPSHOTS:
+        return None
+    try:
+        snapshot = SessionSnapshot.load(get_room_session_id(room_name))
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.exception('Loading the snapshot of room %r failed', room_name)
+        return None
+    if snapshot.model_name != gpt_model_name:
+        logger.info('Ignore snapshot of room %r: It was saved with %r', room_name, snapshot.model_name)
+        return None
+    return snapshot
+
+
+def save_room_snapshot(*, room_name: str, room_data: RoomData) -> None:
+    if not ROOM_SNAPSHOTS or room_data.chat_session is None:
+        return
+    chat_session = room_data.chat_session
+    session_id = get_room_session_id(room_name)
+    messages = [message.encode() for message in room_data.logs.copy()]
+    try:
+        if isinstance(chat_session, RemoteChatContext):
+            chat_session.save(session_id=session_id, messages=messages)
+        else:
+            save_session(chat_session, session_id=session_id, messages=messages)
+    except Exception:
+        logger.exception('Saving the snapshot of room %r failed', room_name)
+
+
+def load_room(*, server, room_name: str, room_data: RoomData, snapshot: SessionSnapshot | None = None) -> None:
+    gpt_model_name = room_data.gpt_model_name
+    send_room_state(
+        server=server,
+        room_name=room_name,
+        room_data=room_data,
+        state=RoomState.LOADING,
+        info=f'Loading {gpt_model_name}...',
+    )
+    start_time = monotonic()
+    try:
+        chat_session = get_room_model_pool().chat_context(gpt_model_name)
+    except Exception as err:
+        logger.exception('Loading %r for room %r failed', gpt_model_name, room_name)
+        send_room_state(
+            server=server,
+            room_name=room_name,
+            room_data=room_data,
+            state=RoomState.FAILED,
+            info=f'Loading {gpt_model_name} failed: {err}',
+        )
+        return
+
+    if server.state['rooms'].get(room_name) is not room_data:
+        logger.info('Room %r was closed while loading', room_name)
+        chat_session.close()
+        return
+
+    duration = monotonic() - start_time
+    model_load_time.observe(duration)
+    info = f'{gpt_model_name} loaded in {human_timedelta(duration)}'
+
+    if snapshot:
+        send_room_state(
+            server=server,
+            room_name=room_name,
+            room_data=room_data,
+            state=RoomState.LOADING,
+            info=f'Restore {snapshot.message_count} messages...',
+        )
+        try:
+            if isinstance(chat_session, RemoteChatContext):
+                result = chat_session.restore(snapshot)
+            else:
+                result = restore_session(chat_session, snapshot)
+        except Exception:
+            logger.exception('Restoring the snapshot of room %r failed', room_name)
+        else:
+            info = f'{info}, {result.summary()}'
+
+    if WELCOME_MESSAGE and WELCOME_CACHE_SIZE:
+        get_welcome_cache(gpt_model_name).get()  # Start filling the cache
+
+    assert chat_session.worker is not None, 'The room model pools assign a worker'
+    room_data.chat_session = chat_session
+    room_data.queue = GenerationQueue(
+        worker=chat_session.worker,
+        max_depth=MAX_QUEUE_DEPTH,
+        on_change=partial(send_queue_state, room_name=room_name),
+    )
+    send_room_state(
+        server=server,
+        room_name=room_name,
+        room_data=room_data,
+        state=RoomState.FREE,
+        info=info,
+    )
+
 
 class Gpt:
-    def __init__(self, *, channel, room_data: RoomData):
+    def __init__(self, *, channel, room_data: RoomData, log_message: bool = True):
         self.channel = channel
         self.room_data = room_data
+        self.log_message = log_message  # Add the complete answer to the room history?
         self.message_id = uuid4().hex
+        self.timestamp = time()
+        self.chunks: list[str] = []
+        self.coalescer = TokenCoalescer(
+            flush_func=self.send_tokens,
+            interval=TOKEN_FLUSH_INTERVAL,
+            max_bytes=TOKEN_FLUSH_MAX_BYTES,
+        )
 
     def __enter__(self):
-        self.room_data.state = RoomState.GPT_WRITES
-
         message = ChatMessage(
             id=self.message_id,
             type=MessageTypeEnum.WAIT,
-            dt=datetime.now(),
             user_name='GPT',
+            timestamp=self.timestamp,
         )
-        self.channel.send(message_data={'message': message})
+        send_to_room(self.channel, {'message': message})
 
         return self
 
-    def generate(self, *, prompt, max_tokens=300):
-        chat_session = self.room_data.chat_session
-        generator = chat_session.generate(prompt=prompt, streaming=True, max_tokens=max_tokens)
-        for token in generator:
-            token = token.replace('\n', ' ')
-            logger.info('GPT token: %r', token)
-            self.channel.send(
-                message_data={
-                    'message': ChatMessage(
-                        id=self.message_id,
-                        type=MessageTypeEnum.APPEND,
-                        message=token,
-                    )
-                }
-            )
+    def generate(self, *, prompt, max_tokens=300, callback=None, priority=Priority.INTERACTIVE, queued_at=None):
+        recorder = GenerationRecorder(
+            name=self.room_data.gpt_model_name,
+            max_tokens=max_tokens,
+            sinks=GENERATION_STATS_SINKS,
+            queued_at=queued_at,
+        )
+        cancelled = False
+
+        def keep_generating(token_id, response):
+            nonlocal cancelled
+            if callback is None or callback(token_id, response):
+                return True
+            cancelled = True
+            return False
+
+        generator = cached_generate(
+            self.room_data.chat_session,
+            prompt,
+            response_cache=response_cache,
+            max_tokens=max_tokens,
+            callback=keep_generating,
+            priority=priority,
+            on_start=recorder.start,
+        )
+        try:
+            for token in generator:
+                recorder.token()
+                self.append(token)
+        except Exception:
+            generator.close()  # Cancel the generation, before the next one can use the model
+            self.room_data.last_stats = recorder.finish(StopReason.ERROR)
+            raise
+        self.room_data.last_stats = recorder.finish(StopReason.CANCELLED if cancelled else None)
+
+    def append(self, token):
+        token = token.replace('\n', ' ')
+        self.chunks.append(token)
+        self.coalescer.add(token)
+
+    def send_tokens(self, text):
+        send_to_room(
+            self.channel,
+            {
+                'message': ChatMessage(
+                    id=self.message_id,
+                    type=MessageTypeEnum.APPEND,
+                    text=text,
+                )
+            },
+        )
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.room_data.state = RoomState.FREE
-        self.channel.send(
-            message_data={
+        self.coalescer.flush()
+        logger.info(
+            'GPT message %s: %i tokens sent in %i channel messages',
+            self.message_id,
+            self.coalescer.token_count,
+            self.coalescer.flush_count,
+        )
+        text = ''.join(self.chunks)
+        if self.log_message and text:
+            # Late joiners should see the answer, too:
+            self.room_data.logs.append(
+                ChatMessage(
+                    id=self.message_id,
+                    type=MessageTypeEnum.MESSAGE,
+                    text=text,
+                    user_name='GPT',
+                    timestamp=self.timestamp,
+                )
+            )
+        send_to_room(
+            self.channel,
+            {
                 'message': ChatMessage(
                     id=self.message_id,
                     type=MessageTypeEnum.COMPLETE,
                 )
-            }
+            },
         )
         if exc_type:
             return False
 
 
-class GptChatApp(App):
-    pass
-
+class StreamingText(Span):
+    """
+    Span of a streamed GPT answer.
 
-app = GptChatApp(__file__)
+    New text is appended as new text nodes, so that every update costs the same,
+    regardless of the length of the answer. The ellipsis is a separate node at the end.
+    """
 
-install_picocss(app)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chunks: list[str] = []  # The accumulated answer
+        self.ellipsis = Span(GPT_WRITE_ELLIPSIS)
+        self.append(self.ellipsis)
 
-app.settings.PICOCSS_BRAND = 'Multi-User GPT Chat'
-app.settings.PICOCSS_TITLE = 'Multi-User GPT Chat'
+    @property
+    def text(self) -> str:
+        return ''.join(self.chunks)
 
-app.settings.INITIAL_SERVER_STATE = {
-    'user': {},
-    'rooms': {},
-}
+    def append_text(self, text: str) -> None:
+        self.chunks.append(text)
+        self.insert(len(self.nodes) - 1, text)  # Before the ellipsis
 
+    def complete(self) -> None:
+        self.ellipsis.remove()
+        if not self.chunks:
+            self.append('<No answer from GPT>')
 
-@app.route('/<room>(/)', name='room')
-class ChatView(View):
-    def show_message(self, message, index=None):
-        message_id, unix_timestamp, type, user_name, message = message
 
-        span = Span(style='margin-left: 0.5em')
+class ChatLine(Div):
+    """
+    One message in the chat: user name, time and the message text.
+    """
 
-        line = Div(
+    def __init__(self, *, message_id: str, user_name: str, dt: datetime, text: Span):
+        super().__init__(
             Div(
                 Strong(user_name),
                 Span(
-                    str(datetime.fromtimestamp(unix_timestamp)),
+                    str(dt),
                     style={
                         'color': 'gray',
                         'font-size': '75%',
@@ -134,73 +498,278 @@ class ChatView(View):
                     },
                 ),
             ),
-            span,
+            text,
             data_message_id=message_id,
         )
+        self.message_id = message_id
+        self.text = text
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class HistoryLine:
+    """
+    A message of the room history, prepared for the chat line. Shared between all views of a room:
+    Lona nodes can only be in one view, so every view creates its own `ChatLine` from it.
+    """
+
+    message_id: str
+    user_name: str
+    dt: datetime
+    text: str
+    color: str | None = None
+
+    @classmethod
+    def from_message(cls, message: ChatMessage) -> 'HistoryLine':
+        if message.type == MessageTypeEnum.MESSAGE:
+            text, color = message.text, None
+        else:
+            text, color = f'*{message.text}*', HISTORY_COLORS.get(message.type)
+        return cls(
+            message_id=message.id,
+            user_name=message.user_name,
+            dt=datetime.fromtimestamp(message.timestamp),
+            text=text,
+            color=color,
+        )
 
-        if type == 'message':
-            span.set_text(message)
+    def get_chat_line(self) -> ChatLine:
+        span = Span(self.text, style='margin-left: 0.5em')
+        if self.color:
+            span.style['color'] = self.color
+        return ChatLine(message_id=self.message_id, user_name=self.user_name, dt=self.dt, text=span)
+
+
+def get_history_lines(room_data: RoomData) -> tuple[HistoryLine, ...]:
+    """
+    The prepared history of the room. Cached until a new message is added to the history.
+    """
+    logs = room_data.logs.copy()
+    # The history has a max. length, but every new message has a new id:
+    key = (len(logs), logs[-1].id) if logs else None
+    history_cache = room_data.history_cache
+    if history_cache is not None and history_cache[0] == key:
+        history_cache_hits.inc()
+        return history_cache[1]
+
+    history_cache_misses.inc()
+    lines = tuple(HistoryLine.from_message(message) for message in logs)
+    room_data.history_cache = (key, lines)
+    return lines
+
+
+class MessageScrollerDiv(ScrollerDiv):
+    """
+    Scroller of chat lines with an index of the message ids,
+    so a message can be found without searching the whole scroller.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.messages: dict[str, ChatLine] = {}  # message id -> chat line
+
+    def get_message(self, message_id: str) -> ChatLine | None:
+        return self.messages.get(message_id)
+
+    def add_message(self, line: ChatLine, index: int | None = None) -> bool:
+        """
+        Append or insert the chat line. Returns False, if the message is already displayed.
+        """
+        with self.lock:
+            if line.message_id in self.messages:
+                return False
+            self.messages[line.message_id] = line
+            if index is None:
+                self.append(line)
+            else:
+                self.insert(index, line)
+        return True
+
+    def add_history(self, lines: list[ChatLine]) -> int:
+        """
+        Insert the lines of the history in front of the displayed lines, with only one update.
+        Returns the number of added lines: Already displayed messages are skipped.
+        """
+        with self.lock:
+            lines = [line for line in lines if line.message_id not in self.messages]
+            if lines:
+                self.messages.update((line.message_id, line) for line in lines)
+                self.body.nodes = [*lines, *self.body.nodes]
+                self._trim()
+        return len(lines)
+
+    def _trim(self):
+        if self.lines is None:
+            return
 
-        else:
-            span.set_text(f'*{message}*')
+        while len(self.body.nodes) > self.lines:
+            line = self.body.nodes.pop(0)
+            self.messages.pop(line.message_id, None)
+
+
+class GptChatApp(App):
+    pass
+
+
+app = GptChatApp(__file__)
+
+install_picocss(app)
+
+app.settings.PICOCSS_BRAND = 'Multi-User GPT Chat'
+app.settings.PICOCSS_TITLE = 'Multi-User GPT Chat'
+
+app.settings.INITIAL_SERVER_STATE = {
+    'user': {},
+    'rooms': {},
+}
+
+
+def render_metrics(server) -> str:
+    # Only copy the references: No room lock is needed
+    rooms: list[tuple[str, RoomData]] = list(server.state['rooms'].items())
+    resident_models: list[PooledModel | WorkerProcess] = list(model_pool.models.values())
+    if worker_pool:
+        resident_models += worker_pool.models.values()
+
+    writer = MetricsWriter(prefix='gpt4all_')
+    room_states = collections.Counter(str(room_data.state) for _, room_data in rooms)
+    writer.gauge('rooms', 'Number of chat rooms', {(('state', state),): count for state, count in room_states.items()})
+    writer.gauge('users', 'Number of users in all rooms', sum(len(room_data.users) for _, room_data in rooms))
+    writer.gauge(
+        'room_queue_depth',
+        'Number of waiting prompts per room',
+        {(('room', room_name),): len(room_data.queue.jobs) for room_name, room_data in rooms if room_data.queue},
+    )
+    writer.gauge('resident_models', 'Number of loaded models', len(resident_models))
+    writer.gauge(
+        'resident_model_bytes',
+        'Size of the loaded model files',
+        sum(resident_model.size for resident_model in resident_models),
+    )
+    writer.histogram('model_load_seconds', 'Time to load the model of a room', model_load_time)
+    if worker_pool:
+        writer.counter('model_worker_restarts_total', 'Restarts of crashed model workers', worker_pool.restarts)
+    writer.counter('room_index_updates_total', 'Room list diffs sent to the lobby', room_index.publish_count)
+    writer.counter('channel_messages_total', 'Messages sent to the room channels', channel_messages.value)
+
+    writer.counter(
+        'generations_total',
+        'Finished generations',
+        {(('stop_reason', str(reason)),): count for reason, count in generation_stats.stop_reasons.copy().items()},
+    )
+    writer.counter('tokens_total', 'Generated tokens', generation_stats.tokens)
+    writer.counter(
+        'prefix_cache_total',
+        'Lookups in the prefix cache',
+        {(('result', 'hit'),): prefix_cache.hits, (('result', 'miss'),): prefix_cache.misses},
+    )
+    if response_cache:
+        writer.counter(
+            'response_cache_total',
+            'Lookups in the response cache',
+            {(('result', 'hit'),): response_cache.hits, (('result', 'miss'),): response_cache.misses},
+        )
+    writer.counter(
+        'history_cache_total',
+        'Lookups of the prepared room history on join',
+        {(('result', 'hit'),): history_cache_hits.value, (('result', 'miss'),): history_cache_misses.value},
+    )
+    writer.histogram('queue_wait_seconds', 'Time of a prompt in the room queue', generation_stats.queue_wait)
+    writer.histogram('ttft_seconds', 'Time to first token', generation_stats.ttft)
+    writer.histogram('inter_token_seconds', 'Time between two tokens', generation_stats.inter_token)
+    return writer.text()
+
+
+# Must be registered before the room route, that would match "/metrics", too:
+@app.route('/metrics', name='metrics', interactive=False)
+class MetricsView(View):
+    def handle_request(self, request):
+        return Response(text=render_metrics(self.server), content_type=PROMETHEUS_CONTENT_TYPE)
 
-            if type == 'join':
-                span.style['color'] = 'lime'
 
-            elif type == 'leave':
-                span.style['color'] = 'red'
+# OpenAI compatible API for other tools: Uses the same models as the chat rooms,
+# but always in the server process, see: MODEL_WORKERS
+openai_api = OpenAIApi(model_pool=model_pool, stats_sinks=GENERATION_STATS_SINKS)
+openai_api.add_routes(app)
 
+
+@app.route('/<room>(/)', name='room')
+class ChatView(View):
+    def show_message(self, message: ChatMessage):
+        line = HistoryLine.from_message(message).get_chat_line()
         with self.html.lock:
-            if self.messages_scroller.query_selector(f'[data-message-id={message_id}]'):
-                return
+            if self.messages_scroller.add_message(line):
+                self.show(self.html)
 
-            if index is None:
-                self.messages_scroller.append(line)
+    def handle_room_state(self):
+        if self.room_data.state == RoomState.LOADING:
+            return
 
-            else:
-                self.messages_scroller.insert(index, line)
+        if self.room_data.state == RoomState.FAILED:
+            self.show(self.get_room_state_html())
+            return
+
+        self.show(self.join_room())
+
+    def handle_queue_state(self, owners: list[str]):
+        if not self.joined:
+            return
+
+        if not owners:
+            text = ''
+        elif self.queue_owner in owners:
+            position = owners.index(self.queue_owner) + 1
+            text = f'{len(owners)} prompt(s) waiting, your prompt is at position {position}.'
+        else:
+            text = f'{len(owners)} prompt(s) waiting.'
+
+        self.show_queue_info(text)
 
+    def show_queue_info(self, text, color='gray'):
+        with self.html.lock:
+            self.queue_info.style['color'] = color
+            self.queue_info.set_text(text)
             self.show(self.html)
 
     def handle_messages(self, message: Message):
-        chat_message: ChatMessage = message.data['message']
-        if isinstance(chat_message, list):
-            return self.show_message(chat_message)
+        if 'room_state' in message.data:
+            return self.handle_room_state()
+
+        if 'queue' in message.data:
+            return self.handle_queue_state(message.data['queue'])
 
+        if not self.joined:
+            # The widgets are created by join_room(), together with the history
+            return
+
+        chat_message: ChatMessage = message.data['message']
         message_type: MessageTypeEnum = chat_message.type
 
+        if message_type in HISTORY_MESSAGE_TYPES:
+            return self.show_message(chat_message)
+
         if message_type == MessageTypeEnum.WAIT:
-            line = Div(
-                Div(
-                    Strong(chat_message.user_name),
-                    Span(
-                        str(chat_message.dt),
-                        style={
-                            'color': 'gray',
-                            'font-size': '75%',
-                            'margin-left': '0.5em',
-                        },
-                    ),
-                ),
-                Span(style='margin-left: 0.5em', data_message_id=chat_message.id),
+            line = ChatLine(
+                message_id=chat_message.id,
+                user_name=chat_message.user_name,
+                dt=datetime.fromtimestamp(chat_message.timestamp),
+                text=StreamingText(style='margin-left: 0.5em'),
             )
-            self.messages_scroller.append(line)
+            self.messages_scroller.add_message(line)
         elif message_type == MessageTypeEnum.APPEND:
-            span = self.messages_scroller.query_selector(f'[data-message-id={chat_message.id}]')
-            old_text = span.get_text()
-            old_text = old_text.rstrip(GPT_WRITE_ELLIPSIS)
-            new_token = chat_message.message
-            new_token = html.escape(new_token)
-            new_token = new_token.replace('\n', '<br>')
-            span.set_text(f'{old_text}{new_token}{GPT_WRITE_ELLIPSIS}')
+            line = self.messages_scroller.get_message(chat_message.id)
+            if line is None:
+                # The answer started before we joined or was trimmed from the scroller
+                return
+            line.text.append_text(chat_message.text)
 
         elif message_type == MessageTypeEnum.COMPLETE:
-            span = self.messages_scroller.query_selector(f'[data-message-id={chat_message.id}]')
-            text = span.get_text()
-            text = text.rstrip(GPT_WRITE_ELLIPSIS)
-            if not text:
-                text = html.escape('<No answer from GPT>')
-            span.set_text(text.rstrip(GPT_WRITE_ELLIPSIS))
+            line = self.messages_scroller.get_message(chat_message.id)
+            if line is not None:
+                line.text.complete()
+            chat_session = self.room_data.chat_session
+            assert chat_session is not None, 'Answers are only generated in loaded rooms'
+            self.last_thread_count.set_text(str(chat_session.last_thread_count))
+            self.update_generation_stats()
 
         else:
             raise NotImplementedError(f'Unknown message type: {chat_message.type}')
@@ -208,34 +777,102 @@ class ChatView(View):
         with self.html.lock:
             self.show(self.html)
 
-    def send_message(self, type, text):
-        if type == 'join':
-            with Gpt(channel=self.channel, room_data=self.room_data) as gpt:
-                gpt.generate(prompt=WELCOME_PROMPT, max_tokens=WELCOME_MAX_TOKENS)
+    def update_generation_stats(self):
+        if last_stats := self.room_data.last_stats:
+            self.last_generation.set_text(last_stats.summary())
+        else:
+            self.last_generation.set_text('-')
+
+        text = f'{generation_stats.generations} generations with {generation_stats.tokens} tokens'
+        if generation_stats.ttft.count:
+            text += f', mean time to first token: {generation_stats.ttft.sum / generation_stats.ttft.count:.2f} sec.'
+        self.all_generations.set_text(text)
+
+    def submit_gpt_job(self, *, prompt, max_tokens, priority=Priority.INTERACTIVE, log_message=True):
+        """
+        Queue the generation of a GPT answer. Raises QueueFullError if too many prompts are waiting.
+        """
+        channel = self.channel
+        room_data = self.room_data
+        rooms = self.server.state['rooms']
+
+        def generate(job: GenerationJob):
+            room_data.state = RoomState.GPT_WRITES
+            room_index.touch(rooms)
+            try:
+                with Gpt(channel=channel, room_data=room_data, log_message=log_message) as gpt:
+                    gpt.generate(
+                        prompt=prompt,
+                        max_tokens=max_tokens,
+                        callback=job.keep_generating,
+                        priority=priority,
+                        queued_at=job.created,
+                    )
+            finally:
+                room_data.state = RoomState.FREE
+                room_index.touch(rooms)
+
+        job = GenerationJob(func=generate, owner=self.queue_owner, name=self.user_name)
+        self.room_data.queue.submit(job)
+
+    def send_welcome_message(self):
+        if not WELCOME_MESSAGE:
             return
 
-        message = [
-            uuid1().hex,
-            time(),
-            type,
-            self.user_name,
-            text,
-        ]
+        if WELCOME_CACHE_SIZE:
+            welcome_cache = get_welcome_cache(self.room_data.gpt_model_name)
+            text = welcome_cache.get() or WELCOME_FALLBACK_MESSAGE
+            with Gpt(channel=self.channel, room_data=self.room_data, log_message=False) as gpt:
+                gpt.append(text)
+            return
+
+        try:
+            self.submit_gpt_job(
+                prompt=WELCOME_PROMPT,
+                max_tokens=WELCOME_MAX_TOKENS,
+                priority=Priority.BACKGROUND,
+                log_message=False,
+            )
+        except QueueFullError:
+            logger.info('Skip welcome message: Queue is full')
+
+    def send_message(self, type, text) -> bool:
+        """
+        Send the message to all clients and let GPT answer it.
+        Returns False, if the message was rejected, because too many prompts are waiting.
+        """
+        if type == 'join':
+            self.send_welcome_message()
+            return True
+
+        queue = self.room_data.queue
+        assert queue is not None, 'Only joined after the model was loaded'
+        if type == 'message' and queue.is_full():
+            self.show_queue_info('Too many prompts are waiting, please try again later.', color='red')
+            return False
+
+        message = ChatMessage(
+            id=uuid1().hex,
+            type=MessageTypeEnum(type),
+            text=text,
+            user_name=self.user_name,
+            timestamp=time(),
+        )
         logger.info('send_message: %s', message)
 
-        # add message to data
+        # add message to data (The oldest message is dropped, if the history is full)
         self.room_data.logs.append(message)
 
         # send message to all clients
-        self.channel.send({'message': message})
-
-        # trim messages
-        while len(self.room_data.logs) > MESSAGE_BACK_LOG:
-            self.room_data.logs.pop(0)
+        send_to_room(self.channel, {'message': message})
 
         if type == 'message':
-            with Gpt(channel=self.channel, room_data=self.room_data) as gpt:
-                gpt.generate(prompt=text, max_tokens=MAX_TOKENS)
+            try:
+                self.submit_gpt_job(prompt=text, max_tokens=MAX_TOKENS)
+            except QueueFullError as err:
+                self.show_queue_info(str(err), color='red')
+
+        return True
 
     def handle_send_button_click(self, input_event):
         message = self.message_text_area.value.strip()
@@ -245,13 +882,93 @@ class ChatView(View):
         if not message:
             return
 
-        self.send_message('message', message)
+        if not self.send_message('message', message):
+            # Let the user send the message again later
+            self.message_text_area.value = message
+
+    def get_room_state_html(self):
+        if self.room_data.state == RoomState.FAILED:
+            title = 'Room not available'
+        else:
+            title = 'Model warming up'
+        self.html = HTML(
+            H1(f'Chat Room: "{self.room_name}"'),
+            H2(title),
+            P(self.room_data.state_info),
+        )
+        return self.html
+
+    def join_room(self):
+        with self.join_lock:
+            if self.joined:
+                return self.html
+
+            self.messages_scroller = MessageScrollerDiv(lines=self.room_data.back_log, height='50vh')
+            self.message_text_area = TextArea()
+
+            self.send_button = InlineButton(
+                'Send',
+                handle_click=self.handle_send_button_click,
+            )
+            self.queue_info = P(style={'color': 'gray', 'font-size': '75%'})
+
+            chat_session = self.room_data.chat_session
+            model_config = chat_session.config
+            thread_count = chat_session.thread_count()
+            self.last_thread_count = Td(str(chat_session.last_thread_count or '-'))
+
+            table = Table(
+                THead(Tr(Th('Parameter'), Th('Value'))),
+                TBody(),
+            )
+            table.append(Tr(Td('Thread count'), Td(str(thread_count))))
+            table.append(Tr(Td('Threads of last generation'), self.last_thread_count))
+            self.last_generation = Td()
+            table.append(Tr(Td('Last generation'), self.last_generation))
+            self.all_generations = Td()
+            table.append(Tr(Td('Generations (all rooms)'), self.all_generations))
+            self.update_generation_stats()
+            table.append(Tr(Td('Scheduler'), Td(str(scheduler.policy))))
+            table.append(Tr(Td('Thread budget'), Td(str(scheduler.thread_budget))))
+            table.append(Tr(Td('Max. concurrent generations'), Td(str(scheduler.max_concurrent))))
+            for key, value in model_config.items():
+                table.append(Tr(Td(key), Td(html.escape(repr(value)))))
+
+            self.html = HTML(
+                H1(f'Chat Room: "{self.room_name}"'),
+                P(f'{model_config["type"]} - {model_config["name"]} ({model_config["filename"]})'),
+                P(self.room_data.state_info, style={'color': 'gray', 'font-size': '75%'}),
+                self.messages_scroller,
+                self.message_text_area,
+                self.send_button,
+                self.queue_info,
+                H2('model config:'),
+                table,
+            )
+
+            self.room_data.users.append(self.user_name)
+            if close_timer := self.room_data.close_timer:
+                close_timer.cancel()
+                self.room_data.close_timer = None
+            room_index.touch(self.server.state['rooms'])
+            self.send_message('join', 'Joined')
+
+            # load history: Rendered together with the room
+            self.messages_scroller.add_history(
+                [history_line.get_chat_line() for history_line in get_history_lines(self.room_data)]
+            )
+
+            self.joined = True
+
+        return self.html
 
     def handle_request(self, request):
         self.room_name = request.match_info['room']
         self.session_key = request.user.session_key
         self.user_name = self.server.state['user'].get(self.session_key, '')
         self.joined = False
+        self.join_lock = Lock()
+        self.queue_owner = uuid4().hex  # Identify our jobs in the room queue
 
         # redirect to lobby if the user has no user name set
         if not self.user_name:
@@ -264,61 +981,64 @@ class ChatView(View):
                 P(f'No room named "{self.room_name}" found'),
             )
 
-        # setup html
         self.room_data: RoomData = self.server.state['rooms'][self.room_name]
 
-        self.messages_scroller = ScrollerDiv(lines=MESSAGE_BACK_LOG, height='50vh')
-        self.message_text_area = TextArea()
-
-        self.send_button = InlineButton(
-            'Send',
-            handle_click=self.handle_send_button_click,
-        )
-
-        chat_session = self.room_data.chat_session
-        model_config = chat_session.config
-        model: LLModel = chat_session.model
-        thread_count = model.thread_count()
-
-        table = Table(
-            THead(Tr(Th('Parameter'), Th('Value'))),
-            TBody(),
-        )
-        table.append(Tr(Td('Thread count'), Td(str(thread_count))))
-        for key, value in model_config.items():
-            table.append(Tr(Td(key), Td(html.escape(repr(value)))))
-
-        self.html = HTML(
-            H1(f'Chat Room: "{self.room_name}"'),
-            P(f'{model_config["type"]} - {model_config["name"]} ({model_config["filename"]})'),
-            self.messages_scroller,
-            self.message_text_area,
-            self.send_button,
-            H2('model config:'),
-            table,
-        )
-
         # subscribe to channel
         self.channel = self.subscribe(f'chat.room.{self.room_name}', self.handle_messages)
 
-        self.room_data.users.append(self.user_name)
-        self.send_message('join', 'Joined')
-
-        # load history
-        for index, message in enumerate(self.room_data.logs.copy()):
-            self.show_message(message, index=index)
+        if self.room_data.state in (RoomState.LOADING, RoomState.FAILED):
+            # Show the state and join the room via handle_room_state(), if the model is loaded
+            return self.get_room_state_html()
 
-        self.joined = True
-
-        return self.html
+        return self.join_room()
 
     def on_cleanup(self) -> None:
         if not self.joined:
             return
 
+        queue = self.room_data.queue
+        assert queue is not None, 'Only joined after the model was loaded'
+        queue.cancel(owner=self.queue_owner)
         self.room_data.users.remove(self.user_name)
+        room_index.touch(self.server.state['rooms'])
         self.send_message('leave', 'Left')
 
+        if not self.room_data.users:
+            schedule_room_close(server=self.server, room_name=self.room_name, room_data=self.room_data)
+
+
+def schedule_room_close(*, server, room_name: str, room_data: RoomData) -> None:
+    """
+    Close the room after ROOM_CLOSE_DELAY, if nobody joined it in the meantime.
+    """
+    room_data.close_timer = Timer(
+        interval=ROOM_CLOSE_DELAY,
+        function=close_room,
+        kwargs=dict(server=server, room_name=room_name, room_data=room_data),
+    )
+    room_data.close_timer.start()
+
+
+def close_room(*, server, room_name: str, room_data: RoomData) -> None:
+    if room_data.users:
+        # Someone joined the room in the meantime
+        return
+
+    if server.state['rooms'].get(room_name) is not room_data:
+        return
+
+    if room_data.state == RoomState.LOADING:
+        # Users can only join loaded rooms: Wait for the end of the loading
+        schedule_room_close(server=server, room_name=room_name, room_data=room_data)
+        return
+
+    logger.info('close room: %s', room_name)
+    del server.state['rooms'][room_name]
+    save_room_snapshot(room_name=room_name, room_data=room_data)
+    room_data.close()
+
+    room_index.touch(server.state['rooms'])
+
 
 @app.route('/', name='lobby')
 class LobbyView(View):
@@ -351,54 +1071,79 @@ class LobbyView(View):
         return RedirectResponse('.')
 
     # rooms
-    def list_rooms(self, *args, **kwargs):
+    def update_room_table(self, changes: dict[str, RoomRow | None]):
+        """
+        Apply a diff of the room index: Only the changed rows are updated.
+        """
         with self.html.lock:
-            self.room_table[-1].clear()
-
-            for room_name, room_data in self.server.state['rooms'].items():
-                room_data: RoomData
-                user_count = len(room_data.users)
-
-                self.room_table[-1].append(
-                    Tr(
+            for room_name, row in changes.items():
+                tr = self.room_rows.get(room_name)
+                if row is None:
+                    if tr is not None:
+                        self.room_table[-1].remove(tr)
+                        del self.room_rows[room_name]
+                elif tr is None:
+                    tr = Tr(
                         Td(
                             A(
                                 room_name,
                                 href=self.server.reverse('room', room=room_name),
                             ),
                         ),
-                        Td(room_data.gpt_model_name),
-                        Td(str(user_count)),
-                    ),
-                )
+                        Td(row.gpt_model_name),
+                        Td(row.state),
+                        Td(str(row.user_count)),
+                    )
+                    self.room_table[-1].append(tr)
+                    self.room_rows[room_name] = tr
+                else:
+                    tr[1].set_text(row.gpt_model_name)
+                    tr[2].set_text(row.state)
+                    tr[3].set_text(str(row.user_count))
+
+    def handle_room_index(self, message: Message):
+        self.update_room_table(message.data['rooms'])
 
     def create_room(self, input_event):
         name = self.room_name.value
         gpt_model_name = self.gpt_model_name.value
+        back_log = self.back_log.value
 
         if not NAME.match(name):
             self.show_error_alert(f'"{name}" is no valid name')
 
             return
 
-        if name in self.server.state['rooms']:
-            self.show_error_alert(f'"{name}" is already taken')
+        if back_log is None or not float(back_log).is_integer() or not 1 <= back_log <= MAX_MESSAGE_BACK_LOG:
+            self.show_error_alert(f'History size must be between 1 and {MAX_MESSAGE_BACK_LOG}')
             return
 
-        logger.info('create_room: %s gpt_model_name: %s', name, gpt_model_name)
-        self.show_success_alert(f'Creating {name!r} room with {gpt_model_name}...')
-        gpt4all = GPT4All(model_name=gpt_model_name, n_threads=multiprocessing.cpu_count(), verbose=True)
-        chat_session = gpt4all.chat_session().__enter__()
+        if room_data := self.server.state['rooms'].get(name):
+            if room_data.state != RoomState.FAILED:
+                self.show_error_alert(f'"{name}" is already taken')
+                return
 
-        room_data = RoomData(gpt_model_name=gpt_model_name, chat_session=chat_session)
+        logger.info('create_room: %s gpt_model_name: %s', name, gpt_model_name)
+        room_data = RoomData(gpt_model_name=gpt_model_name, back_log=int(back_log), state=RoomState.LOADING)
         logger.debug('create room %r for %r with: %r', name, gpt_model_name, room_data)
 
+        # Reopen a closed room:
+        snapshot = load_room_snapshot(room_name=name, gpt_model_name=gpt_model_name)
+        if snapshot:
+            room_data.logs.extend(ChatMessage.decode(data) for data in snapshot.messages)
+
         self.server.state['rooms'][name] = room_data
+        room_loader.submit(load_room, server=self.server, room_name=name, room_data=room_data, snapshot=snapshot)
+        # Release the model, if nobody joins the new room:
+        schedule_room_close(server=self.server, room_name=name, room_data=room_data)
 
         self.room_name.value = ''
-        self.show_success_alert(f'Room "{name}" with {gpt_model_name} was created')
+        self.show_success_alert(
+            f'Room "{name}" with {gpt_model_name} was created, the model is loading: ',
+            A(name, href=self.server.reverse('room', room=name)),
+        )
 
-        Channel('chat.room.open').send()
+        room_index.touch(self.server.state['rooms'])
 
     def handle_request(self, request):
         self.session_key = request.user.session_key
@@ -429,6 +1174,14 @@ class LobbyView(View):
             Option2('mistral-7b-openorca.Q4_0.gguf', value='mistral-7b-openorca.Q4_0.gguf'),
         )
         self.room_name = TextInput(placeholder='Room Name', value='test')
+        self.back_log = NumberInput(
+            value=MESSAGE_BACK_LOG,
+            min=1,
+            max=MAX_MESSAGE_BACK_LOG,
+            step=1,
+            placeholder='History size',
+            title='Number of messages in the room history',
+        )
 
         self.create_room_button = InlineButton(
             'Create Room',
@@ -440,28 +1193,28 @@ class LobbyView(View):
                 Tr(
                     Th('Room Name'),
                     Th('GPT model'),
+                    Th('State'),
                     Th('User Chatting'),
                 ),
             ),
             TBody(),
         )
+        self.room_rows: dict[str, Tr] = {}
 
         self.html = HTML(
             H1('Chat Rooms'),
             self.alerts,
             self.gpt_model_name,
             self.room_name,
+            self.back_log,
             self.create_room_button,
             Br(),
             Br(),
             self.room_table,
         )
 
-        self.list_rooms()
-
-        self.channel = self.subscribe(
-            'chat.room.*',
-            self.list_rooms,
-        )
+        # Subscribe first, so that no change is missed. The diffs are idempotent:
+        self.channel = self.subscribe(ROOM_INDEX_CHANNEL, self.handle_room_index)
+        self.update_room_table(get_room_rows(self.server.state['rooms']))
 
         return self.html
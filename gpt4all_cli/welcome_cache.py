@@ -0,0 +1,83 @@
+import collections
+import logging
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Executor
+
+
+logger = logging.getLogger(__name__)
+
+
+class WelcomeCache:
+    """
+    A pool of pre-generated welcome messages of one model.
+
+    `get()` returns a cached message instantly and starts a background refill via the `executor`,
+    if messages are missing. Messages older than `ttl` seconds are dropped.
+    `generate_func` should return None, if no message can be generated (e.g.: the model is not loaded)
+    """
+
+    def __init__(
+        self,
+        *,
+        generate_func: Callable[[], str | None],
+        size: int,
+        ttl: float,
+        executor: Executor,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.generate_func = generate_func
+        self.size = size
+        self.ttl = ttl
+        self.executor = executor
+        self.clock = clock
+
+        self.messages: collections.deque[tuple[float, str]] = collections.deque()  # (create time, text)
+        self.lock = threading.Lock()
+        self.refilling = False
+
+    def _drop_expired(self) -> None:
+        # The messages are rotated, so they are not sorted by age:
+        min_time = self.clock() - self.ttl
+        if any(created < min_time for created, _ in self.messages):
+            self.messages = collections.deque(message for message in self.messages if message[0] >= min_time)
+
+    def get(self) -> str | None:
+        with self.lock:
+            self._drop_expired()
+            if self.messages:
+                message = self.messages.popleft()
+                self.messages.append(message)  # Rotate the messages
+                text = message[1]
+            else:
+                text = None
+
+            start_refill = len(self.messages) < self.size and not self.refilling
+            if start_refill:
+                self.refilling = True
+
+        if start_refill:
+            self.executor.submit(self.refill)
+        return text
+
+    def refill(self) -> None:
+        try:
+            while True:
+                with self.lock:
+                    self._drop_expired()
+                    if len(self.messages) >= self.size:
+                        return
+
+                text = self.generate_func()
+                if text is None:
+                    return
+
+                logger.info('New welcome message: %r', text)
+                with self.lock:
+                    self.messages.append((self.clock(), text))
+        except Exception:
+            logger.exception('Generating a welcome message failed')
+        finally:
+            with self.lock:
+                self.refilling = False